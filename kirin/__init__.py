@@ -92,6 +92,7 @@ redis_client = Redis(
 # activate a command
 import kirin.command.load_realtime
 import kirin.command.piv_worker
+import kirin.command.piv_router
 
 from kirin.core import model
 
@@ -112,6 +113,7 @@ rmq_handler = RabbitMQHandler(app.config[str("RABBITMQ_CONNECTION_STRING")], app
 
 import kirin.api
 from kirin import utils
+from kirin.core import probes, realtime_versions  # register their db session listeners
 
 if str("LOGGER") in app.config:
     logging.config.dictConfig(app.config[str("LOGGER")])
@@ -52,12 +52,21 @@ api.add_resource(resources.Status, "/status", endpoint=str("status"))
 api.add_resource(cots.Cots, "/cots", endpoint=str("cots"))
 api.add_resource(piv.PivIndex, "/piv", endpoint=str("piv_index"))
 api.add_resource(piv.Piv, "/piv/<string:id>", endpoint=str("piv"))
+api.add_resource(piv.PivBulk, "/piv/<string:id>/bulk", endpoint=str("piv_bulk"))
 api.add_resource(gtfs_rt.GtfsRTIndex, "/gtfs_rt", endpoint=str("gtfs_rt_index"))
 api.add_resource(gtfs_rt.GtfsRT, "/gtfs_rt/<string:id>", endpoint=str("gtfs_rt"))
+api.add_resource(
+    resources.GtfsRTFeed, "/gtfs_rt/feed.pb", "/gtfs_rt/<string:id>/feed.pb", endpoint=str("gtfs_rt_feed")
+)
 api.add_resource(
     resources.Contributors, "/contributors", "/contributors/<string:id>", endpoint=str("contributors")
 )
+api.add_resource(
+    resources.ContributorProfiling, "/contributors/<string:id>/profiling", endpoint=str("contributor_profiling")
+)
 api.add_resource(resources.Health, "/health", endpoint=str("health"))
+api.add_resource(resources.Metrics, "/metrics", endpoint=str("metrics"))
+api.add_resource(resources.RealTimeUpdates, "/real_time_updates/<string:id>", endpoint=str("real_time_updates"))
 
 
 def _log_exception(sender, exception):
@@ -0,0 +1,166 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import datetime
+import gzip
+import json
+import os
+
+import sqlalchemy
+
+from kirin.core.model import db, TripUpdate, VehicleJourney, StopTimeUpdate, RealTimeUpdate
+
+# Before being purged, realtime history can be archived (see PURGE_ARCHIVE_PATH setting) in gzipped NDJSON
+# files (one JSON object per line), partitioned by table, day and contributor:
+# <root>/<table>/day=<YYYY-MM-DD>/<contributor>.ndjson.gz
+# Each purged chunk is appended as a new gzip member, so files stay readable by zcat or gzip.open().
+
+ARCHIVE_FETCH_SIZE = 1000
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+class PurgeArchive(object):
+    """
+    Write the rows about to be purged in archive files.
+    Rows are read from the transaction of the purge (before the DELETE statement) with a server-side cursor,
+    ARCHIVE_FETCH_SIZE rows at a time, so that memory stays bounded whatever the size of the chunk purged.
+    """
+
+    def __init__(self, root, fetch_size=ARCHIVE_FETCH_SIZE):
+        self.root = root
+        self.fetch_size = fetch_size
+
+    def _get_path(self, table_name, day, contributor):
+        return os.path.join(
+            self.root, table_name, "day={}".format(day.isoformat()), "{}.ndjson.gz".format(contributor)
+        )
+
+    def _open(self, path):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):  # created concurrently otherwise
+                    raise
+        return gzip.open(path, "ab")
+
+    def _write(self, table_name, query):
+        """
+        Stream the rows of the query in archive files.
+        The query must provide "archive_day" and "archive_contributor" columns (used for partitioning only).
+        :return: number of rows archived
+        """
+        files = {}
+        nb_rows = 0
+        try:
+            connection = db.session.connection().execution_options(stream_results=True)
+            result = connection.execute(query)
+            while True:
+                rows = result.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    record = dict(row.items())
+                    partition = (record.pop("archive_day").date(), record.pop("archive_contributor"))
+                    if partition not in files:
+                        files[partition] = self._open(self._get_path(table_name, *partition))
+                    line = json.dumps(record, default=_json_default, sort_keys=True) + "\n"
+                    files[partition].write(line.encode("utf-8"))
+                    nb_rows += 1
+            result.close()
+        finally:
+            for f in files.values():
+                f.close()
+        return nb_rows
+
+    def archive_trip_updates(self, filters):
+        """
+        Archive TripUpdates (with their VehicleJourney) and their StopTimeUpdates, partitioned by the
+        start day of the VehicleJourney.
+        :param filters: filters on trip_update and vehicle_journey tables, selecting the trips to archive
+        """
+        vj_table = VehicleJourney.__table__
+        tu_table = TripUpdate.__table__
+        stu_table = StopTimeUpdate.__table__
+        partition_columns = [
+            vj_table.c.start_timestamp.label("archive_day"),
+            tu_table.c.contributor_id.label("archive_contributor"),
+        ]
+        trips = sqlalchemy.select(
+            list(tu_table.c) + [vj_table.c.navitia_trip_id, vj_table.c.start_timestamp] + partition_columns
+        ).where(sqlalchemy.and_(tu_table.c.vj_id == vj_table.c.id, *filters))
+        nb_rows = self._write(tu_table.name, trips)
+
+        stop_times = (
+            sqlalchemy.select(list(stu_table.c) + partition_columns)
+            .where(
+                sqlalchemy.and_(
+                    stu_table.c.trip_update_id == tu_table.c.vj_id, tu_table.c.vj_id == vj_table.c.id
+                )
+            )
+            .where(sqlalchemy.and_(*filters))
+        )
+        nb_rows += self._write(stu_table.name, stop_times)
+        return nb_rows
+
+    def archive_rt_updates(self, filters):
+        """
+        Archive RealTimeUpdates metadata (without their raw payload), partitioned by their creation day.
+        :param filters: filters on real_time_update table, selecting the RealTimeUpdates to archive
+        """
+        rtu_table = RealTimeUpdate.__table__
+        rt_updates = sqlalchemy.select(
+            [c for c in rtu_table.c if c.name != "raw_data"]
+            + [
+                rtu_table.c.created_at.label("archive_day"),
+                rtu_table.c.contributor_id.label("archive_contributor"),
+            ]
+        ).where(sqlalchemy.and_(*filters))
+        return self._write(rtu_table.name, rt_updates)
+
+
+def get_purge_archive():
+    """
+    :return: the archive where purged rows are written (None if purged rows are not archived)
+    """
+    from kirin import app
+
+    root = app.config[str("PURGE_ARCHIVE_PATH")]
+    return PurgeArchive(root) if root else None
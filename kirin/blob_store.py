@@ -0,0 +1,183 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import gzip
+import hashlib
+import os
+import uuid
+
+import six
+
+from kirin.exceptions import InternalException
+
+# Raw payloads of RealTimeUpdates can be stored outside the database (see RAW_DATA_STORE setting).
+# They are then stored compressed under their content hash (sha256): identical payloads are stored once,
+# and real_time_update only keeps the hash and the size of the payload.
+
+
+class FileSystemBlobStore(object):
+    """
+    Store blobs gzipped in a local (or mounted) directory: <root>/<hash[:2]>/<hash>.gz
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _get_path(self, key):
+        return os.path.join(self.root, key[:2], "{}.gz".format(key))
+
+    def put(self, key, data):
+        path = self._get_path(key)
+        if os.path.exists(path):
+            # blob is already stored, keep it alive as long as it's received (see remove_older_than())
+            os.utime(path, None)
+            return
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):  # created concurrently otherwise
+                    raise
+        # written under a temporary name first, so that a blob is either complete or absent
+        tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+
+    def get(self, key):
+        with gzip.open(self._get_path(key), "rb") as f:
+            return f.read()
+
+    def _remove_if_older_than(self, path, until_timestamp):
+        # checked again just before removing, as the blob may have been stored again meanwhile
+        if os.path.getmtime(path) >= until_timestamp:
+            return 0
+        os.remove(path)
+        return 1
+
+    def _remove_unused(self, old_paths_by_key, until_timestamp, get_used_keys):
+        used_keys = get_used_keys(list(old_paths_by_key)) if get_used_keys else set()
+        return sum(
+            self._remove_if_older_than(path, until_timestamp)
+            for key, path in old_paths_by_key.items()
+            if key not in used_keys
+        )
+
+    def remove_older_than(self, until_timestamp, get_used_keys=None, chunk_size=1000):
+        """
+        Remove the blobs that were not stored since until_timestamp (and are not used anymore)
+        :param get_used_keys: function returning which of the given keys are still used (these blobs are kept),
+            called by chunks of chunk_size keys
+        :return: number of blobs removed
+        """
+        nb_removed = 0
+        old_paths_by_key = {}
+        for directory, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                if os.path.getmtime(path) >= until_timestamp:
+                    continue
+                if not file_name.endswith(".gz"):
+                    nb_removed += self._remove_if_older_than(path, until_timestamp)  # interrupted write
+                    continue
+                old_paths_by_key[file_name[: -len(".gz")]] = path
+                if len(old_paths_by_key) >= chunk_size:
+                    nb_removed += self._remove_unused(old_paths_by_key, until_timestamp, get_used_keys)
+                    old_paths_by_key = {}
+        if old_paths_by_key:
+            nb_removed += self._remove_unused(old_paths_by_key, until_timestamp, get_used_keys)
+        return nb_removed
+
+
+BLOB_STORE_TYPES = {"filesystem": lambda config: FileSystemBlobStore(config[str("RAW_DATA_STORE_PATH")])}
+
+_blob_store = {}
+
+
+def get_blob_store():
+    """
+    :return: the store configured for raw payloads (None if they are stored in db)
+    """
+    from kirin import app
+
+    store_type = app.config[str("RAW_DATA_STORE")]
+    if store_type == "db":
+        return None
+    if store_type not in _blob_store:
+        if store_type not in BLOB_STORE_TYPES:
+            raise InternalException("unknown RAW_DATA_STORE: {}".format(store_type))
+        _blob_store[store_type] = BLOB_STORE_TYPES[store_type](app.config)
+    return _blob_store[store_type]
+
+
+def _to_bytes(raw_data):
+    return raw_data.encode("utf-8") if isinstance(raw_data, six.text_type) else raw_data
+
+
+def save_raw_data(rt_update, raw_data):
+    """
+    Store the raw payload of a RealTimeUpdate (in db or in the configured blob store)
+    """
+    blob_store = get_blob_store()
+    if blob_store is None or raw_data is None:
+        rt_update.raw_data = raw_data
+        return
+    data = _to_bytes(raw_data)
+    key = hashlib.sha256(data).hexdigest()
+    blob_store.put(key, data)
+    rt_update.raw_data = None
+    rt_update.raw_data_hash = key
+    rt_update.raw_data_size = len(data)
+
+
+def has_raw_data(rt_update, raw_data):
+    """
+    :return: True if the raw payload of the RealTimeUpdate is raw_data (without reading it from the blob store)
+    """
+    if rt_update.raw_data_hash is None:
+        return rt_update.raw_data == raw_data
+    return raw_data is not None and rt_update.raw_data_hash == hashlib.sha256(_to_bytes(raw_data)).hexdigest()
+
+
+def load_raw_data(rt_update):
+    """
+    :return: the raw payload of a RealTimeUpdate (as stored in db: text)
+    """
+    if rt_update.raw_data_hash is None:
+        return rt_update.raw_data
+    blob_store = get_blob_store()
+    if blob_store is None:
+        raise InternalException(
+            "raw data of RealTimeUpdate {} is in a blob store, RAW_DATA_STORE is needed".format(rt_update.id)
+        )
+    return blob_store.get(rt_update.raw_data_hash).decode("utf-8")
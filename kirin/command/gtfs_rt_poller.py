@@ -0,0 +1,89 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import logging
+
+import gevent
+from gevent.lock import BoundedSemaphore
+from gevent.pool import Pool
+
+from kirin import manager, app, new_relic
+from kirin.gtfs_rt.scheduler import get_gtfsrt_poll_configs, pop_due_poll_configs
+from kirin.gtfs_rt.tasks import poll_gtfsrt
+from kirin.command.cooperative_db import make_db_cooperative
+from kirin.utils import log_exception
+
+logger = logging.getLogger(__name__)
+
+
+@new_relic.agent.background_task(name="gtfs_rt_poller-poll", group="Task")
+def _poll(config, processing_slots):
+    with app.app_context():
+        try:
+            poll_gtfsrt(config, processing_slot=processing_slots)
+        except Exception as e:
+            log_exception(e, "gtfs_rt_poller")
+
+
+@manager.command
+def gtfs_rt_poller():
+    """
+    Poll all GTFS-RT feeds concurrently from a single process (instead of celery's beat and workers).
+    Feeds are retrieved concurrently (each one at its own retrieval_interval), but only a bounded number of
+    them are processed at the same time.
+    """
+    if app.config[str("USE_GEVENT")]:
+        make_db_cooperative()
+    else:
+        logger.warning("KIRIN_USE_GEVENT is not set: GTFS-RT feeds will not be polled concurrently")
+
+    polling_pool = Pool(app.config[str("GTFS_RT_POLLER_MAX_FEEDS")])
+    processing_slots = BoundedSemaphore(app.config[str("GTFS_RT_POLLER_PROCESSING_WORKERS")])
+    in_flight = set()
+
+    logger.info("launching the GTFS-RT poller")
+    while True:
+        try:
+            with app.app_context():
+                due_configs = pop_due_poll_configs(get_gtfsrt_poll_configs())
+            for config, _ in due_configs:
+                contributor_id = config["contributor"]
+                if contributor_id in in_flight:
+                    logger.warning("previous polling of '%s' is not finished, skipping", contributor_id)
+                    continue
+                in_flight.add(contributor_id)
+                greenlet = polling_pool.spawn(_poll, config, processing_slots)
+                greenlet.link(lambda _, c_id=contributor_id: in_flight.discard(c_id))
+        except Exception as e:
+            log_exception(e, "gtfs_rt_poller")
+        gevent.sleep(app.config[str("POLLER_MIN_INTERVAL")])
@@ -0,0 +1,222 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import logging
+import time
+import uuid
+from copy import deepcopy
+from datetime import datetime
+
+import gevent
+import six
+from kombu import Connection, Exchange, Queue, Producer
+from kombu.mixins import ConsumerMixin
+
+from kirin import manager, app, new_relic, redis_client
+from kirin.command.piv_worker import CONF_RELOAD_INTERVAL, consume_all_piv_contributors
+from kirin.core.model import db
+from kirin.piv.piv import get_piv_contributor
+from kirin.piv.sharding import (
+    get_train_key,
+    get_shard,
+    get_shard_exchange,
+    get_shard_queue,
+    SHARD_BARRIER_HEADER,
+)
+from kirin.utils import build_redis_piv_shard_count_key, build_redis_piv_shard_barrier_key, log_exception
+
+logger = logging.getLogger(__name__)
+
+
+class PivRouter(ConsumerMixin):
+    """
+    Consume the queue of a PIV contributor, and forward each message to the shard queue of its train.
+    Each shard queue is processed by one PivWorker, keeping messages of a train in order.
+    """
+
+    def __init__(self, contributor, shard_count):
+        if not contributor.broker_url or not contributor.exchange_name or not contributor.queue_name:
+            raise ValueError("Missing broker configuration for contributor '{0}'".format(contributor.id))
+        self.contributor_id = contributor.id
+        self.shard_count = shard_count
+        self.last_config_checked_time = datetime.now()
+        # store config to spot configuration changes
+        self.broker_url = deepcopy(contributor.broker_url)
+        self.exchange_name = deepcopy(contributor.exchange_name)
+        self.queue_name = deepcopy(contributor.queue_name)
+
+    @new_relic.agent.background_task(name="piv_router-enter", group="Task")
+    def __enter__(self):
+        self.connection = Connection(self.broker_url)
+        channel = self.connection.channel()
+        exchange = Exchange(
+            name=self.exchange_name, type="fanout", durable=True, no_declare=True, auto_delete=False
+        )
+        self.queue = Queue(name=self.queue_name, exchange=exchange, durable=True, auto_delete=False)
+        self.queue.declare(channel=channel)
+        self.shard_exchange = get_shard_exchange(self.queue_name)
+        for shard in range(self.shard_count):
+            get_shard_queue(self.queue_name, shard).declare(channel=channel)
+        self.producer = Producer(channel, exchange=self.shard_exchange)
+        self._wait_for_previous_shards()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.connection.release()
+
+    def _get_shard_queue_state(self, shard):
+        queue = get_shard_queue(self.queue_name, shard)
+        return queue(self.connection.default_channel).queue_declare(passive=True)
+
+    def _get_shard_barrier(self, shard):
+        barrier = redis_client.get(build_redis_piv_shard_barrier_key(self.contributor_id, shard))
+        return barrier.decode("utf-8") if barrier is not None else None
+
+    def _wait_for_previous_shards(self):
+        """
+        When the nb of shards changes, some trains move to another shard.
+        To never process messages of a train out of order, messages are only routed with the new nb of shards
+        once all messages routed with the previous configuration are processed (messages wait in the
+        contributor's queue meanwhile).
+        Messages may be in flight (prefetched or in a batch of a PivWorker) when a shard queue is empty:
+        a barrier message is sent to each shard queue consumed, and the PivWorker acknowledges it in redis
+        once the messages received before are processed.
+        If the barriers are not all acknowledged within PIV_ROUTER_RESHARD_TIMEOUT, the router keeps routing
+        on the previous nb of shards.
+        """
+        shard_count_key = build_redis_piv_shard_count_key(self.contributor_id)
+        previous_shard_count = redis_client.get(shard_count_key)
+        if previous_shard_count is not None and int(previous_shard_count) != self.shard_count:
+            previous_shard_count = int(previous_shard_count)
+            barrier = uuid.uuid4().hex
+            waited_shards = set()
+            for shard in range(previous_shard_count):
+                state = self._get_shard_queue_state(shard)
+                if state.consumer_count == 0:
+                    # nothing in flight, and nobody to process the queued messages
+                    if state.message_count > 0:
+                        logger.warning(
+                            "nb of shards changed for '{0}': {1} messages in shard {2} without PivWorker".format(
+                                self.contributor_id, state.message_count, shard
+                            )
+                        )
+                    continue
+                self.producer.publish(
+                    "",
+                    routing_key=six.text_type(shard),
+                    content_type="plain/text",
+                    content_encoding="utf-8",
+                    headers={SHARD_BARRIER_HEADER: barrier},
+                    delivery_mode=2,  # persistent
+                )
+                waited_shards.add(shard)
+
+            timeout = time.time() + app.config[str("PIV_ROUTER_RESHARD_TIMEOUT")]
+            while waited_shards:
+                waited_shards = {s for s in waited_shards if self._get_shard_barrier(s) != barrier}
+                if not waited_shards:
+                    break
+                if time.time() > timeout:
+                    # keep the previous nb of shards (the change is tried again when the router restarts)
+                    logger.error(
+                        "nb of shards changed for '{0}', but shards {1} were not processed in time: "
+                        "keep routing on {2} shards".format(
+                            self.contributor_id, sorted(waited_shards), previous_shard_count
+                        )
+                    )
+                    self.shard_count = previous_shard_count
+                    return
+                logger.info(
+                    "nb of shards changed for '{0}', waiting for shards {1} to be processed".format(
+                        self.contributor_id, sorted(waited_shards)
+                    )
+                )
+                gevent.sleep(1)
+        redis_client.set(shard_count_key, self.shard_count)
+
+    def get_consumers(self, Consumer, channel):
+        return [
+            Consumer(
+                queues=[self.queue],
+                accept=["plain/text"],  # avoid deserializing to json dict
+                prefetch_count=app.config[str("PIV_ROUTER_PREFETCH_COUNT")],
+                callbacks=[self.route_message],
+            )
+        ]
+
+    def route_message(self, body, message):
+        try:
+            shard = get_shard(get_train_key(body), self.shard_count)
+            # forward the message as received
+            self.producer.publish(
+                message.body,
+                routing_key=six.text_type(shard),
+                content_type=message.content_type,
+                content_encoding=message.content_encoding,
+                headers=message.headers,
+                delivery_mode=2,  # persistent
+                timestamp=message.properties.get("timestamp"),
+            )
+            message.ack()
+        except Exception as e:
+            log_exception(e, "piv_router")
+            raise  # let the router die, message is not acknowledged and will be routed again
+
+    @new_relic.agent.background_task(name="piv_router-on_iteration", group="Task")
+    def on_iteration(self):
+        if datetime.now() - self.last_config_checked_time < CONF_RELOAD_INTERVAL:
+            return
+        self.last_config_checked_time = datetime.now()
+
+        db.session.expire_all()
+        contributor = get_piv_contributor(self.contributor_id)
+        if (
+            not contributor
+            or contributor.broker_url != self.broker_url
+            or contributor.exchange_name != self.exchange_name
+            or contributor.queue_name != self.queue_name
+        ):
+            logger.info(
+                "configuration of contributor '{0}' changed, let the router die".format(self.contributor_id)
+            )
+            self.should_stop = True
+
+
+@manager.command
+def piv_router():
+    """
+    Route the messages of all active PIV contributors to PIV_SHARD_COUNT shard queues (by train),
+    each shard being processed by a "piv_worker --shard <shard>"
+    """
+    shard_count = app.config[str("PIV_SHARD_COUNT")]
+    consume_all_piv_contributors(lambda contributor: PivRouter(contributor, shard_count))
@@ -32,21 +32,30 @@
 
 from __future__ import absolute_import, print_function, unicode_literals, division
 
-from kirin import manager, app, new_relic
+from kirin import manager, app, new_relic, redis_client
 from kirin.core.model import db
 from kirin.core.types import ConnectorType
-from kirin.core.build_wrapper import wrap_build
+from kirin.core.build_wrapper import wrap_build, wrap_build_batch
 from kirin.piv import KirinModelBuilder
+from kirin.piv.sharding import coalesce_messages, get_shard_queue, get_shard_barrier
 from kirin.piv.piv import get_piv_contributors, get_piv_contributor
+from kirin.command.cooperative_db import make_db_cooperative
 
 from kombu.mixins import ConsumerMixin
 from kombu import Connection, Exchange, Queue
 from datetime import datetime, timedelta
 from copy import deepcopy
+import gevent
 import logging
+import threading
 import time
 
-from kirin.utils import log_exception
+from kirin.utils import (
+    log_exception,
+    record_consumer_activity,
+    build_redis_piv_shard_barrier_key,
+    parse_json_input,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -55,9 +64,29 @@ CONF_RELOAD_INTERVAL = timedelta(
 )
 
 
+def _get_message_lag(message):
+    """
+    :return: time (seconds) since the message was published (None if the publisher didn't timestamp it)
+    """
+    timestamp = message.properties.get("timestamp")
+    if isinstance(timestamp, datetime):
+        published_at = timestamp
+    elif isinstance(timestamp, (int, float)):
+        published_at = datetime.utcfromtimestamp(timestamp)
+    else:
+        return None
+    return (datetime.utcnow() - published_at).total_seconds()
+
+
 class PivWorker(ConsumerMixin):
     @new_relic.agent.background_task(name="piv_worker-init", group="Task")
-    def __init__(self, contributor):
+    def __init__(self, contributor, batch_size=1, batch_max_wait=0, shard=None):
+        """
+        :param batch_size: max nb of messages processed at once (1 to disable batching)
+        :param batch_max_wait: max duration (seconds) a message can wait for its batch to be complete
+        :param shard: if provided, consume the given shard queue (fed by the PIV router) instead of the
+        contributor's queue
+        """
         if contributor.connector_type != ConnectorType.piv.value:
             raise ValueError(
                 "Contributor '{0}': PivWorker requires type {1}".format(contributor.id, ConnectorType.piv.value)
@@ -80,12 +109,27 @@ class PivWorker(ConsumerMixin):
         self.broker_url = deepcopy(contributor.broker_url)
         self.navitia_coverage = deepcopy(contributor.navitia_coverage)
         self.navitia_token = deepcopy(contributor.navitia_token)
+        self.exchange_name = deepcopy(contributor.exchange_name)
+        self.queue_name = deepcopy(contributor.queue_name)
+        self.shard = shard
+        self.batch_size = max(batch_size, 1)
+        self.batch_max_wait = timedelta(seconds=batch_max_wait)
+        self.pending_messages = []
+        self.pending_since = None
+        # activity since last record
+        self.activity_since = datetime.now()
+        self.consumed_count = 0
+        self.max_lag = None
 
     @new_relic.agent.background_task(name="piv_worker-enter", group="Task")
     def __enter__(self):
         self.connection = Connection(self.builder.contributor.broker_url)
-        self.exchange = self._get_exchange(self.builder.contributor.exchange_name)
-        self.queue = self._get_or_create_queue(self.builder.contributor.queue_name)
+        if self.shard is None:
+            self.exchange = self._get_exchange(self.exchange_name)
+            self.queue = self._get_or_create_queue(self.queue_name)
+        else:
+            self.queue = get_shard_queue(self.queue_name, self.shard)
+            self.queue.declare(channel=self.connection.channel())
         return self
 
     def __exit__(self, type, value, traceback):
@@ -104,13 +148,59 @@ class PivWorker(ConsumerMixin):
             Consumer(
                 queues=[self.queue],
                 accept=["plain/text"],  # avoid deserializing to json dict
-                prefetch_count=1,
+                prefetch_count=self.batch_size,
                 callbacks=[self.process_message],
             )
         ]
 
-    @new_relic.agent.background_task(name="piv_worker-process_message", group="Task")
+    def _get_queue_depth(self):
+        try:
+            return self.queue(self.connection.default_channel).queue_declare(passive=True).message_count
+        except Exception:
+            return None
+
+    def _record_activity(self):
+        now = datetime.now()
+        record_consumer_activity(
+            contributor=self.builder.contributor.id,
+            message_count=self.consumed_count,
+            duration=(now - self.activity_since).total_seconds(),
+            lag=self.max_lag,
+            queue_depth=self._get_queue_depth(),
+        )
+        self.activity_since = now
+        self.consumed_count = 0
+        self.max_lag = None
+
     def process_message(self, body, message):
+        barrier = get_shard_barrier(message)
+        if barrier is not None:
+            self._process_barrier(barrier, message)
+            return
+        self.consumed_count += 1
+        lag = _get_message_lag(message)
+        if lag is not None:
+            self.max_lag = lag if self.max_lag is None else max(lag, self.max_lag)
+        # parsed once for all: used to coalesce messages, then by the builder
+        body = parse_json_input(body)
+        if self.batch_size == 1:
+            self._process_single_message(body, message)
+            return
+        if not self.pending_messages:
+            self.pending_since = datetime.now()
+        self.pending_messages.append((body, message))
+        if len(self.pending_messages) >= self.batch_size:
+            self._process_batch()
+
+    def _process_barrier(self, barrier, message):
+        # all messages received before the barrier are processed, let the PIV router know it
+        if self.pending_messages:
+            self._process_batch()
+        redis_client.set(build_redis_piv_shard_barrier_key(self.builder.contributor.id, self.shard), barrier)
+        message.ack()
+
+    @new_relic.agent.background_task(name="piv_worker-process_message", group="Task")
+    def _process_single_message(self, body, message):
         try:
             wrap_build(self.builder, body)
         except Exception as e:
@@ -122,11 +212,38 @@ class PivWorker(ConsumerMixin):
             # * we do not want to process this message after another one (produced later) on the same train
             message.ack()
 
+    @new_relic.agent.background_task(name="piv_worker-process_batch", group="Task")
+    def _process_batch(self):
+        messages, self.pending_messages = self.pending_messages, []
+        kept_messages = coalesce_messages(messages)
+        logger.info(
+            "processing a batch of PIV messages",
+            extra={
+                str("contributor"): self.builder.contributor.id,
+                str("message_count"): len(messages),
+                str("coalesced_count"): len(messages) - len(kept_messages),
+            },
+        )
+        try:
+            wrap_build_batch(self.builder, [body for body, _ in kept_messages])
+        except Exception as e:
+            log_exception(e, "piv_worker")
+        finally:
+            # see _process_single_message() about acknowledging messages in case of error
+            for _, message in messages:
+                message.ack()
+
     @new_relic.agent.background_task(name="piv_worker-on_iteration", group="Task")
     def on_iteration(self):
+        # called after each message received, or every second when the queue is idle
+        if self.pending_messages and datetime.now() - self.pending_since >= self.batch_max_wait:
+            self._process_batch()
+
         if datetime.now() - self.last_config_checked_time < CONF_RELOAD_INTERVAL:
             return
 
+        self._record_activity()
+
         # SQLAlchemy is not querying the DB for read (uses cache instead),
         # unless we specifically tell that the data is expired.
         db.session.expire(self.builder.contributor)
@@ -138,8 +255,8 @@ class PivWorker(ConsumerMixin):
             or contributor.broker_url != self.broker_url
             or contributor.navitia_coverage != self.navitia_coverage
             or contributor.navitia_token != self.navitia_token
-            or contributor.exchange_name != self.exchange.name
-            or contributor.queue_name != self.queue.name
+            or contributor.exchange_name != self.exchange_name
+            or contributor.queue_name != self.queue_name
         ):
             logger.info(
                 "configuration of contributor '{0}' changed, let the worker die".format(
@@ -150,40 +267,114 @@ class PivWorker(ConsumerMixin):
             return
 
 
-@manager.command
-def piv_worker():
-    import sys
+def _run_consumer(contributor_id, make_consumer):
+    """
+    Run the consumer of a contributor (restarting it when its configuration changes),
+    as long as the contributor exists and is active
+    :param make_consumer: function building the consumer (ex: PivWorker) of a contributor
+    """
+    with app.app_context():
+        while True:
+            should_wait = True
+            contributor = None
+            try:
+                contributor = get_piv_contributor(contributor_id)
+                if not contributor:
+                    logger.info("no more PIV contributor '{0}', stopping its consumer".format(contributor_id))
+                    return
+                with make_consumer(contributor) as consumer:
+                    should_wait = False  # wait only after init crash
+                    logger.info(
+                        "launching the {0} for '{1}'".format(consumer.__class__.__name__, contributor.id)
+                    )
+                    consumer.run()
+            except Exception as e:
+                logger.warning("PIV consumer of '{0}' died: {1}".format(contributor_id, e))
+            finally:
+                try:
+                    db.session.commit()
+                except Exception as db_e:
+                    logger.warning("Exception while db-commit: {0}".format(db_e))
+                    db.session.rollback()
+                if should_wait:
+                    time.sleep(CONF_RELOAD_INTERVAL.total_seconds())  # cooperative with gevent (monkey-patched)
+                if contributor:
+                    # force db-reload otherwise staying locked on previous contributor's config
+                    db.session.expire(contributor)
+
+
+def _spawn_consumer(contributor_id, make_consumer):
+    """
+    Run the consumer of a contributor in a greenlet, or in a thread if gevent is not used
+    (consuming blocks in kombu's drain_events() then)
+    :return: the greenlet or the thread running the consumer
+    """
+    if app.config[str("USE_GEVENT")]:
+        return gevent.spawn(_run_consumer, contributor_id, make_consumer)
+    thread = threading.Thread(
+        target=_run_consumer, args=(contributor_id, make_consumer), name=str("piv_consumer-" + contributor_id)
+    )
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def _is_consumer_running(consumer):
+    if isinstance(consumer, threading.Thread):
+        return consumer.is_alive()
+    return not consumer.ready()
+
 
-    # We assume one and only one PIV contributor is going to exist in the DB
+def consume_all_piv_contributors(make_consumer):
+    """
+    Consume the queues of all active PIV contributors concurrently (one consumer per contributor,
+    each one in its own greenlet, or in its own thread if gevent is not used)
+    :param make_consumer: function building the consumer (ex: PivWorker) of a contributor
+    """
+    if app.config[str("USE_GEVENT")]:
+        make_db_cooperative()
+
+    consumers = {}  # greenlet (or thread) running the consumer of each contributor
     while True:
-        should_wait = True
         try:
             contributors = get_piv_contributors()
             if len(contributors) == 0:
                 logger.warning("no PIV contributor")
-                time.sleep(CONF_RELOAD_INTERVAL.total_seconds())
-                continue
-            contributor = contributors[0]
-            if len(contributors) > 1:
-                logger.warning(
-                    "more than one PIV contributors: {0}; choosing '{1}'".format(
-                        map(lambda c: c.id, contributors), contributor.id
+            consumed_queues = {}
+            for contributor in contributors:
+                # messages of a queue can't be attributed to several contributors
+                queue = (contributor.broker_url, contributor.queue_name)
+                if queue in consumed_queues:
+                    logger.warning(
+                        "PIV contributors '{0}' and '{1}' share the same queue '{2}': ignoring '{1}'".format(
+                            consumed_queues[queue], contributor.id, contributor.queue_name
+                        )
                     )
-                )
-            with PivWorker(contributor) as worker:
-                should_wait = False  # wait only after init crash
-                logger.info("launching the PIV worker for '{0}'".format(contributor.id))
-                worker.run()
+                    continue
+                consumed_queues[queue] = contributor.id
+
+                consumer = consumers.get(contributor.id)
+                if consumer is None or not _is_consumer_running(consumer):
+                    consumers[contributor.id] = _spawn_consumer(contributor.id, make_consumer)
+            db.session.commit()
         except Exception as e:
-            logger.warning("PIV worker died: {0}".format(e))
-        finally:
-            try:
-                db.session.commit()
-            except Exception as db_e:
-                logger.warning("Exception while db-commit: {0}".format(db_e))
-                db.session.rollback()
-            if should_wait:
-                time.sleep(CONF_RELOAD_INTERVAL.total_seconds())
-            db.session.expire(
-                contributor
-            )  # force db-reload otherwise staying locked on previous contributor's config
+            logger.warning("Exception while checking PIV contributors: {0}".format(e))
+            db.session.rollback()
+        time.sleep(CONF_RELOAD_INTERVAL.total_seconds())  # cooperative with gevent (monkey-patched)
+
+
+@manager.command
+def piv_worker(shard=None):
+    """
+    Process the messages of all active PIV contributors concurrently (one PivWorker per contributor)
+    :param shard: only process the given shard of each contributor's messages (see piv_router)
+    """
+    shard = int(shard) if shard is not None else None
+    consume_all_piv_contributors(
+        lambda contributor: PivWorker(
+            contributor,
+            batch_size=app.config[str("PIV_WORKER_BATCH_SIZE")],
+            batch_max_wait=app.config[str("PIV_WORKER_BATCH_MAX_WAIT")],
+            shard=shard,
+        )
+    )
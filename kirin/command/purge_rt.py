@@ -30,24 +30,47 @@
 # www.navitia.io
 
 from __future__ import absolute_import, print_function, unicode_literals, division
-from kirin import manager
+from kirin import manager, app
 from kirin.core.model import db, RealTimeUpdate, Contributor
 import datetime
 import logging
+import time
 from sqlalchemy.exc import IntegrityError
 
 
 @manager.command
-def purge_rt(nb_day_to_keep, connector):
+def purge_rt(nb_day_to_keep, connector, dry_run=False):
     """
     purge table real_time_update and associate_realtimeupdate_tripupdate
     for given connector with nb_day_to_keep of history
+    (with --dry_run, only the number of real_time_update to purge is estimated)
     """
     logger = logging.getLogger(__name__)
     until = datetime.date.today() - datetime.timedelta(days=int(nb_day_to_keep))
+    contributors = [c.id for c in Contributor.find_by_connector_type(connector, include_deactivated=True)]
+    if dry_run:
+        for contributor in contributors:
+            logger.info(
+                "%s real_time_update to purge for %s until %s",
+                RealTimeUpdate.count_by_contributors_until(contributors=[contributor], until=until),
+                contributor,
+                until,
+            )
+        return
+
     logger.info("purge table real_time_update for %s until %s", connector, until)
-    RealTimeUpdate.remove_by_connectors_until(connectors=[connector], until=until)
-    db.session.commit()
+    start = time.time()
+    nb_deleted = RealTimeUpdate.remove_by_contributors_until(
+        contributors=contributors, until=until, chunk_size=app.config[str("PURGE_CHUNK_SIZE")]
+    )
+    duration = time.time() - start
+    logger.info(
+        "%s real_time_update purged for %s in %.1fs (%.1f/s)",
+        nb_deleted,
+        connector,
+        duration,
+        nb_deleted / duration if duration else 0,
+    )
 
 
 @manager.command
@@ -0,0 +1,53 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import logging
+import sys
+
+from kirin import manager
+from kirin.blob_store import load_raw_data
+from kirin.core.model import RealTimeUpdate
+
+
+@manager.command
+def print_raw_data(rt_update_id):
+    """
+    print the raw data received for given RealTimeUpdate (wherever it is stored: db or blob store)
+    """
+    rt_update = RealTimeUpdate.query.get(rt_update_id)
+    if not rt_update:
+        logging.getLogger(__name__).info("RealTimeUpdate %s not found", rt_update_id)
+        return
+    raw_data = load_raw_data(rt_update)
+    if raw_data is not None:
+        sys.stdout.write(raw_data.encode("utf-8"))
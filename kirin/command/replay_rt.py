@@ -0,0 +1,382 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import logging
+import math
+import time
+from collections import Counter
+
+from google.protobuf import text_format
+from redis import ConnectionPool
+from six.moves import zip_longest
+from sqlalchemy import create_engine, select, func, and_
+from sqlalchemy.engine.url import make_url
+
+from kirin import manager, app, gtfs_realtime_pb2
+from kirin import cots, piv, gtfs_rt
+from kirin.blob_store import load_raw_data
+from kirin.core.build_wrapper import wrap_build
+from kirin.core.model import (
+    db,
+    RealTimeUpdate,
+    Contributor,
+    TripUpdate,
+    VehicleJourney,
+    StopTimeUpdate,
+    associate_realtimeupdate_tripupdate,
+)
+from kirin.core.types import ConnectorType
+from kirin.exceptions import InternalException
+from kirin.utils import as_utc_naive_dt
+
+REPLAY_BUILDERS = {
+    ConnectorType.cots.value: cots.KirinModelBuilder,
+    ConnectorType.piv.value: piv.KirinModelBuilder,
+    ConnectorType.gtfs_rt.value: gtfs_rt.KirinModelBuilder,
+}
+# nb of VJs whose TripUpdate is read at once from the scratch database
+MERGE_RESULTS_CHUNK_SIZE = 500
+
+
+def _is_same_redis(redis_url):
+    source = ConnectionPool.from_url(redis_url).connection_kwargs
+    return (source["host"], source["port"], source["db"]) == (
+        app.config[str("REDIS_HOST")],
+        app.config[str("REDIS_PORT")],
+        app.config[str("REDIS_DB")],
+    )
+
+
+def _is_same_db(db_url):
+    def get_location(url):
+        url = make_url(url)
+        return url.host, url.port or 5432, url.database  # PostgreSQL's default port
+
+    return get_location(db_url) == get_location(app.config[str("SQLALCHEMY_DATABASE_URI")])
+
+
+def _get_contributor(source, contributor_id):
+    """
+    :return: the contributor in Kirin database, copied from the source database if needed
+    """
+    contributor = Contributor.query.get(contributor_id)
+    if contributor is not None:
+        return contributor
+    table = Contributor.__table__
+    row = source.execute(table.select().where(table.c.id == contributor_id)).first()
+    if row is None:
+        return None
+    db.session.execute(table.insert().values(**dict(row)))
+    db.session.commit()
+    return Contributor.query.get(contributor_id)
+
+
+def _stream_rt_updates(source, contributor_id, since_dt, until_dt):
+    """
+    Yield the RealTimeUpdates of the contributor stored in the source database (oldest first),
+    with the number of TripUpdates their processing impacted
+    """
+    rtu = RealTimeUpdate.__table__
+    association = associate_realtimeupdate_tripupdate
+    nb_trip_updates = (
+        select([func.count()])
+        .where(association.c.real_time_update_id == rtu.c.id)
+        .as_scalar()
+        .label("nb_trip_updates")
+    )
+    q = (
+        select([rtu.c.id, rtu.c.created_at, rtu.c.status, rtu.c.raw_data, rtu.c.raw_data_hash, nb_trip_updates])
+        .where(
+            and_(
+                rtu.c.contributor_id == contributor_id, rtu.c.created_at >= since_dt, rtu.c.created_at < until_dt
+            )
+        )
+        .order_by(rtu.c.created_at, rtu.c.id)
+    )
+    connection = source.connect().execution_options(stream_results=True)
+    try:
+        for row in connection.execute(q):
+            yield row
+    finally:
+        connection.close()
+
+
+def _to_input_raw(connector_type, raw_data):
+    """
+    GTFS-RT feeds are stored as text, the connector receives them serialized
+    """
+    if connector_type != ConnectorType.gtfs_rt.value:
+        return raw_data
+    proto = gtfs_realtime_pb2.FeedMessage()
+    try:
+        text_format.Merge(raw_data, proto)
+    except text_format.ParseError:
+        # feed stored because it was not decodable: it will be rejected again
+        return raw_data
+    return proto.SerializeToString()
+
+
+def _get_stop_time_result(stop_time_update):
+    return (
+        stop_time_update.stop_id,
+        stop_time_update.arrival_status,
+        stop_time_update.arrival_delay,
+        stop_time_update.departure_status,
+        stop_time_update.departure_delay,
+    )
+
+
+def _get_source_merge_results(source, contributor_id, since_dt, until_dt):
+    """
+    Merge result (status, effect and stop_time_updates) of the TripUpdates impacted by the RealTimeUpdates
+    replayed, in the source database.
+    :return: the merge result of each VJ (navitia_trip_id, start_timestamp), and the VJs impacted again after
+    until_dt (their merge result in the source database can't be compared)
+    """
+    vj, tu, stu = VehicleJourney.__table__, TripUpdate.__table__, StopTimeUpdate.__table__
+    rtu, association = RealTimeUpdate.__table__, associate_realtimeupdate_tripupdate
+    rtu_of_trip_update = association.join(rtu, association.c.real_time_update_id == rtu.c.id)
+    last_update = (
+        select([func.max(rtu.c.created_at)])
+        .select_from(rtu_of_trip_update)
+        .where(association.c.trip_update_id == tu.c.vj_id)
+        .as_scalar()
+        .label("last_update")
+    )
+    impacted = (
+        select([association.c.trip_update_id])
+        .select_from(rtu_of_trip_update)
+        .where(
+            and_(
+                rtu.c.contributor_id == contributor_id, rtu.c.created_at >= since_dt, rtu.c.created_at < until_dt
+            )
+        )
+    )
+    q = (
+        select(
+            [
+                vj.c.navitia_trip_id,
+                vj.c.start_timestamp,
+                tu.c.status,
+                tu.c.effect,
+                last_update,
+                stu.c.stop_id,
+                stu.c.arrival_status,
+                stu.c.arrival_delay,
+                stu.c.departure_status,
+                stu.c.departure_delay,
+            ]
+        )
+        .select_from(vj.join(tu, tu.c.vj_id == vj.c.id).outerjoin(stu, stu.c.trip_update_id == tu.c.vj_id))
+        .where(tu.c.vj_id.in_(impacted))
+        .order_by(vj.c.navitia_trip_id, vj.c.start_timestamp, stu.c.order)
+    )
+    results = {}
+    impacted_after = set()
+    for row in source.execute(q):
+        vj_key = (row.navitia_trip_id, row.start_timestamp)
+        if row.last_update >= until_dt:
+            impacted_after.add(vj_key)
+            continue
+        _, _, stop_times = results.setdefault(vj_key, (row.status, row.effect, []))
+        if row.stop_id is not None:
+            stop_times.append(_get_stop_time_result(row))
+    return results, impacted_after
+
+
+def _get_replayed_merge_results(vj_keys):
+    """
+    :return: the merge result of each VJ (navitia_trip_id, start_timestamp) in Kirin (scratch) database
+    """
+    results = {}
+    vj_keys = list(vj_keys)
+    for i in range(0, len(vj_keys), MERGE_RESULTS_CHUNK_SIZE):
+        for trip_update in TripUpdate.find_by_dated_vjs(vj_keys[i : i + MERGE_RESULTS_CHUNK_SIZE]):
+            results[(trip_update.vj.navitia_trip_id, trip_update.vj.start_timestamp)] = (
+                trip_update.status,
+                trip_update.effect,
+                [_get_stop_time_result(stu) for stu in trip_update.stop_time_updates],
+            )
+    return results
+
+
+def _diff_merge_results(source_result, replayed_result):
+    """
+    :return: the kind of difference between 2 merge results of a VJ (None if identical), and its details
+    """
+    if replayed_result is None:
+        return "only in source", ""
+    if source_result is None:
+        return "only replayed", ""
+    source_status, source_effect, source_stop_times = source_result
+    replayed_status, replayed_effect, replayed_stop_times = replayed_result
+    if (source_status, source_effect) != (replayed_status, replayed_effect):
+        return "trip", "{} replayed {}".format(
+            (source_status, source_effect), (replayed_status, replayed_effect)
+        )
+    for order, (source_stop_time, replayed_stop_time) in enumerate(
+        zip_longest(source_stop_times, replayed_stop_times)
+    ):
+        if source_stop_time != replayed_stop_time:
+            return "stop_time", "stop_time_update {}: {} replayed {}".format(
+                order, source_stop_time, replayed_stop_time
+            )
+    return None, ""
+
+
+def _log_merge_diffs(logger, source_results, impacted_after, replayed_vjs):
+    vj_keys = (set(source_results) | replayed_vjs) - impacted_after
+    replayed_results = _get_replayed_merge_results(vj_keys)
+    diffs = Counter()
+    for vj_key in sorted(vj_keys):
+        diff, details = _diff_merge_results(source_results.get(vj_key), replayed_results.get(vj_key))
+        if diff is None:
+            diffs["identical"] += 1
+            continue
+        diffs[diff] += 1
+        logger.info("TripUpdate of %s on %s differs (%s) %s", vj_key[0], vj_key[1], diff, details)
+    logger.info(
+        "merge results of %s VJs compared (%s impacted again after the replayed period not compared): %s",
+        len(vj_keys),
+        len(impacted_after),
+        ", ".join("{} {}".format(count, diff) for diff, count in sorted(diffs.items())),
+    )
+
+
+def _percentile(sorted_values, percent):
+    # nearest-rank method
+    index = int(math.ceil(percent / 100 * len(sorted_values))) - 1
+    return sorted_values[max(index, 0)]
+
+
+@manager.command
+def replay_rt(contributor_id, start, end, source_db, source_redis, speed=0, no_publish=False):
+    """
+    replay the RealTimeUpdates received for given contributor between start and end (timezoned datetimes)
+    read from the source_db (database URI) into Kirin database and redis, that must be scratch ones
+    (source_redis is the URL of the redis used with source_db, to check it's not shared)
+    (with --speed 0, as fast as possible, else at the given factor of the real time: 1 for real time)
+    (with --no_publish, the result is not sent to Navitia)
+    """
+    logger = logging.getLogger(__name__)
+    if _is_same_db(source_db):
+        logger.error("RealTimeUpdates can't be replayed in the database storing them, use a scratch database")
+        return
+    if _is_same_redis(source_redis):
+        # redis keeps state of the contributor (hashes of the last data, realtime versions, probes...)
+        logger.error("RealTimeUpdates can't be replayed with the redis used with them, use a scratch redis")
+        return
+    speed = float(speed)
+    since_dt, until_dt = as_utc_naive_dt(start), as_utc_naive_dt(end)
+    source = create_engine(source_db)
+    contributor = _get_contributor(source, contributor_id)
+    if contributor is None:
+        logger.error("contributor %s not found", contributor_id)
+        return
+    builder = REPLAY_BUILDERS[contributor.connector_type](contributor)
+
+    latencies = []
+    status_changes = Counter()
+    nb_trip_updates_changes = 0
+    nb_skipped = 0
+    replayed_vjs = set()
+    first_created_at = None
+    replay_start = time.time()
+    for rtu in _stream_rt_updates(source, contributor_id, since_dt, until_dt):
+        try:
+            raw_data = load_raw_data(rtu)
+        except (IOError, OSError, InternalException) as e:
+            logger.warning("raw data of RealTimeUpdate %s can't be read: %s", rtu.id, e)
+            raw_data = None
+        if raw_data is None:
+            nb_skipped += 1
+            continue
+
+        if speed:
+            # keep the time elapsed between two RealTimeUpdates (divided by speed)
+            first_created_at = first_created_at or rtu.created_at
+            elapsed = (rtu.created_at - first_created_at).total_seconds() / speed
+            delay = replay_start + elapsed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        start_time = time.time()
+        replayed = None
+        try:
+            replayed = wrap_build(builder, _to_input_raw(contributor.connector_type, raw_data), not no_publish)
+        except Exception:
+            db.session.rollback()
+        latencies.append(time.time() - start_time)
+
+        status, nb_trip_updates = "KO", 0
+        if replayed is not None:
+            status, nb_trip_updates = replayed.status, len(replayed.trip_updates)
+            replayed_vjs.update((tu.vj.navitia_trip_id, tu.vj.start_timestamp) for tu in replayed.trip_updates)
+        status_changes[(rtu.status, status)] += 1
+        if nb_trip_updates != rtu.nb_trip_updates:
+            nb_trip_updates_changes += 1
+        if status != rtu.status or nb_trip_updates != rtu.nb_trip_updates:
+            logger.info(
+                "RealTimeUpdate %s: %s (%s TripUpdates) replayed %s (%s TripUpdates)",
+                rtu.id,
+                rtu.status,
+                rtu.nb_trip_updates,
+                status,
+                nb_trip_updates,
+            )
+
+    duration = time.time() - replay_start
+    logger.info(
+        "%s RealTimeUpdates replayed for %s in %.1fs (%.1f/s, %.1f/s processing only), %s without raw data",
+        len(latencies),
+        contributor_id,
+        duration,
+        len(latencies) / duration if duration else 0,
+        len(latencies) / sum(latencies) if sum(latencies) else 0,
+        nb_skipped,
+    )
+    if not latencies:
+        return
+    latencies.sort()
+    logger.info(
+        "latency: p50=%.3fs p90=%.3fs p99=%.3fs max=%.3fs",
+        _percentile(latencies, 50),
+        _percentile(latencies, 90),
+        _percentile(latencies, 99),
+        latencies[-1],
+    )
+    for (original_status, status), count in sorted(status_changes.items()):
+        logger.info("status %s replayed %s: %s", original_status, status, count)
+    logger.info("%s RealTimeUpdates with a different number of TripUpdates", nb_trip_updates_changes)
+
+    source_results, impacted_after = _get_source_merge_results(source, contributor_id, since_dt, until_dt)
+    _log_merge_diffs(logger, source_results, impacted_after, replayed_vjs)
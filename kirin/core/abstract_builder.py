@@ -40,6 +40,7 @@ from flask import current_app
 
 from kirin import redis_client
 from kirin.core.model import Contributor, RealTimeUpdate, TripUpdate
+from kirin.prometheus import instrument_navitia
 
 
 class AbstractKirinModelBuilder(six.with_metaclass(ABCMeta, object)):
@@ -54,7 +55,7 @@ class AbstractKirinModelBuilder(six.with_metaclass(ABCMeta, object)):
 
     def __init__(self, contributor):
         # type: (Contributor) -> None
-        self.navitia = navitia_wrapper.Navitia(
+        navitia = navitia_wrapper.Navitia(
             url=current_app.config.get(str("NAVITIA_URL")),
             token=contributor.navitia_token,
             timeout=current_app.config.get(str("NAVITIA_TIMEOUT"), 5),
@@ -62,6 +63,7 @@ class AbstractKirinModelBuilder(six.with_metaclass(ABCMeta, object)):
             query_timeout=current_app.config.get(str("NAVITIA_QUERY_CACHE_TIMEOUT"), 600),
             pubdate_timeout=current_app.config.get(str("NAVITIA_PUBDATE_CACHE_TIMEOUT"), 600),
         ).instance(contributor.navitia_coverage)
+        self.navitia = instrument_navitia(navitia, contributor)
         self.contributor = contributor
 
     def build_rt_update(self, input_raw):
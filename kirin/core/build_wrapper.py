@@ -36,14 +36,27 @@ import socket
 from collections import namedtuple
 
 import six
+from sqlalchemy import inspect
+from sqlalchemy.exc import SQLAlchemyError
 
 import kirin
 from kirin import gtfs_realtime_pb2
+from kirin.core import model
 from kirin.core.model import TripUpdate
 from kirin.core.populate_pb import convert_to_gtfsrt
+from kirin.core.sql_stats import sql_accounting
 from kirin.exceptions import MessageNotPublished, KirinException
 from kirin.new_relic import is_invalid_input_exception, record_custom_parameter
-from kirin.utils import set_rtu_status_ko, allow_reprocess_same_data, record_call, db_commit
+from kirin.prometheus import observe_stage, record_trip_updates, record_feed_size
+from kirin.profiling import start_sampled_profiler, dump_profiler
+from kirin.utils import (
+    set_rtu_status_ko,
+    allow_reprocess_same_data,
+    record_call,
+    db_commit,
+    make_rt_update,
+    get_raw_input,
+)
 
 TimeDelayTuple = namedtuple("TimeDelayTuple", ["time", "delay"])
 
@@ -82,18 +95,13 @@ def publish(feed, contributor_id):
         raise MessageNotPublished()
 
 
-def handle(builder, real_time_update, trip_updates):
+def _merge_trip_updates(builder, real_time_update, trip_updates):
     """
-    Receive a RealTimeUpdate with at least one TripUpdate filled with the data received
-    by the connector.
     Each TripUpdate is associated with the base-schedule VehicleJourney, complete/merge realtime is done using builder
-    Then persist in db, publish for Navitia
-    Returns real_time_update and the log_dict
     """
-    if not real_time_update:
-        raise TypeError()
     id_timestamp_tuples = [(tu.vj.navitia_trip_id, tu.vj.start_timestamp) for tu in trip_updates]
     old_trip_updates = TripUpdate.find_by_dated_vjs(id_timestamp_tuples)
+    nb_merged = 0
     for trip_update in trip_updates:
         # find if there is already a row in db
         old = next(
@@ -113,86 +121,291 @@ def handle(builder, real_time_update, trip_updates):
             # we have to link the current_vj_update with the new real_time_update
             # this link is done quite late to avoid too soon persistence of trip_update by sqlalchemy
             current_trip_update.real_time_updates.append(real_time_update)
+            nb_merged += 1
+    record_trip_updates(builder.contributor, nb_merged, len(trip_updates) - nb_merged)
 
-    db_commit(real_time_update)
 
-    feed = convert_to_gtfsrt(real_time_update.trip_updates, gtfs_realtime_pb2.FeedHeader.DIFFERENTIAL)
+def _publish_trip_updates(builder, trip_updates):
+    """
+    Publish the TripUpdates for Navitia
+    Returns the log_dict
+    """
+    feed = convert_to_gtfsrt(trip_updates, gtfs_realtime_pb2.FeedHeader.DIFFERENTIAL)
     feed_str = feed.SerializeToString()
-    publish(feed_str, builder.contributor.id)
+    with observe_stage("publish", builder.contributor):
+        publish(feed_str, builder.contributor.id)
+    record_feed_size("published", builder.contributor, feed_str)
 
     data_time = datetime.datetime.utcfromtimestamp(feed.header.timestamp)
-    log_dict = {
+    return {
         "contributor": builder.contributor.id,
         "timestamp": data_time,
         "trip_update_count": len(feed.entity),
         "size": len(feed_str),
     }
-    # After merging trip_updates information of connector realtime, navitia and kirin database, if there is no new
-    # information destined to navitia, update real_time_update with status = 'KO' and a proper error message.
+
+
+def _set_no_new_information(real_time_update):
+    """
+    After merging trip_updates information of connector realtime, navitia and kirin database, if there is no new
+    information destined to navitia, update real_time_update with status = 'KO' and a proper error message.
+    """
     if not real_time_update.trip_updates and real_time_update.status == "OK":
         msg = "No new information destined to navitia for this {}".format(real_time_update.connector)
         set_rtu_status_ko(real_time_update, msg, is_reprocess_same_data_allowed=False)
         logging.getLogger(__name__).warning(
-            "RealTimeUpdate id={}: {}".format(real_time_update.id, msg), extra=log_dict
+            "RealTimeUpdate id={}: {}".format(real_time_update.id, msg),
+            extra={str("contributor"): real_time_update.contributor_id},
         )
+
+
+def handle(builder, real_time_update, trip_updates, publish=True):
+    """
+    Receive a RealTimeUpdate with at least one TripUpdate filled with the data received
+    by the connector.
+    Each TripUpdate is associated with the base-schedule VehicleJourney, complete/merge realtime is done using builder
+    Then persist in db, publish for Navitia (unless publish is False)
+    Returns real_time_update and the log_dict
+    """
+    if not real_time_update:
+        raise TypeError()
+    with observe_stage("merge", builder.contributor):
+        _merge_trip_updates(builder, real_time_update, trip_updates)
+        _set_no_new_information(real_time_update)
+
+    # the RealTimeUpdate and the result of its processing are persisted at once
+    with observe_stage("db_commit", builder.contributor):
         db_commit(real_time_update)
 
+    log_dict = _publish_trip_updates(builder, real_time_update.trip_updates) if publish else {}
+
     return real_time_update, log_dict
 
 
-def wrap_build(builder, input_raw):
+def handle_batch(builder, built_updates, failed_rt_updates=()):
+    """
+    Same as handle() for a list of (RealTimeUpdate, TripUpdates), persisted in db
+    (along with the RealTimeUpdates of the batch that failed to be built)
+    and published for Navitia only once for all of them
+    Returns the log_dict
+    """
+    with observe_stage("merge", builder.contributor):
+        for real_time_update, trip_updates in built_updates:
+            _merge_trip_updates(builder, real_time_update, trip_updates)
+            _set_no_new_information(real_time_update)
+
+    with observe_stage("db_commit", builder.contributor):
+        model.db.session.add_all([real_time_update for real_time_update, _ in built_updates])
+        model.db.session.add_all(failed_rt_updates)
+        model.db.session.commit()
+
+    if not built_updates:
+        return {}
+
+    # a TripUpdate may be linked to several RealTimeUpdates of the batch, publish it once
+    published_trip_updates = []
+    for real_time_update, _ in built_updates:
+        for trip_update in real_time_update.trip_updates:
+            if not any(trip_update is tu for tu in published_trip_updates):
+                published_trip_updates.append(trip_update)
+    return _publish_trip_updates(builder, published_trip_updates)
+
+
+def _rollback_processing(rt_updates):
+    """
+    Rollback the session after a failed processing, so that the error can be committed.
+    RealTimeUpdates not persisted keep the (rolled back) result of their processing: drop it.
+    Persisted ones are reloaded from db (their result is kept if it was committed before the failure).
+    """
+    model.db.session.rollback()
+    for rt_update in rt_updates:
+        if rt_update is not None and inspect(rt_update).transient:
+            del rt_update.trip_updates[:]
+
+
+def _manage_build_error(builder, rt_update, e, commit=True):
+    """
+    Set the RealTimeUpdate (if built) in error, and allow reprocessing if meaningful
+    :param commit: if False, the RealTimeUpdate is only set in error (to be persisted later)
+    Returns the status of the processing
+    """
+    status = "failure"
+    allow_reprocess = True
+    if is_invalid_input_exception(e):
+        status = "warning"  # Kirin did his job correctly if the input is invalid and rejected
+        allow_reprocess = False  # reprocess is useless if input is invalid
+
+    if rt_update is not None:
+        error = e.data["error"] if (isinstance(e, KirinException) and "error" in e.data) else e.message
+        set_rtu_status_ko(rt_update, error, is_reprocess_same_data_allowed=allow_reprocess)
+        if commit:
+            db_commit(rt_update)
+    else:
+        # rt_update is not built, make sure reprocess is allowed
+        allow_reprocess_same_data(builder.contributor.id)
+    return status
+
+
+def _log_status(status, log_dict):
+    record_call(status, **log_dict)
+    if status == "OK":
+        logging.getLogger(__name__).info(status, extra=log_dict)
+    elif status == "warning":
+        logging.getLogger(__name__).warning(status, extra=log_dict)
+    else:
+        logging.getLogger(__name__).error(status, extra=log_dict)
+
+
+def wrap_build(builder, input_raw, publish=True):
     """
     Function wrapping the processing of realtime information of an external feed
     This manages errors/logger/newrelic
     :param builder: the KirinModelBuilder to be called (must inherit from abstract_builder.AbstractKirinModelBuilder)
     :param input_raw: the feed to process
+    :param publish: if False, the result is only persisted in db and not sent to Navitia
+    :return: the RealTimeUpdate processed
+    """
+    record_feed_size("received", builder.contributor, get_raw_input(input_raw))
+    # create a raw rt_update obj, to save the raw_input into the db
+    return _wrap_build(builder, lambda: builder.build_rt_update(input_raw), publish)
+
+
+def enqueue_build(builder, input_raw):
+    """
+    Only store the feed in db, as a "pending" RealTimeUpdate, and let a Kirin-worker process it
+    (see tasks.process_pending_rt_updates)
+    :return: the RealTimeUpdate stored
+    """
+    from kirin.tasks import process_pending_rt_updates
+
+    contributor = builder.contributor
+    record_feed_size("received", contributor, get_raw_input(input_raw))
+    rt_update = make_rt_update(
+        input_raw, connector_type=contributor.connector_type, contributor_id=contributor.id, status="pending"
+    )
+    db_commit(rt_update)
+    process_pending_rt_updates.delay(contributor.id)
+    return rt_update
+
+
+def wrap_build_pending(builder, rt_update):
+    """
+    Same as wrap_build() for a feed already stored as a "pending" RealTimeUpdate by enqueue_build()
     """
+
+    def build_rt_update():
+        rt_update.status = "OK"
+        record_custom_parameter("real_time_update_id", rt_update.id)
+        # time spent waiting to be processed
+        lag = (datetime.datetime.utcnow() - rt_update.created_at).total_seconds()
+        return rt_update, {"real_time_update_id": rt_update.id, "lag": lag}
+
+    _wrap_build(builder, build_rt_update)
+
+
+def _wrap_build(builder, build_rt_update, publish=True):
     contributor = builder.contributor
     start_datetime = datetime.datetime.utcnow()
     rt_update = None
     log_dict = {"contributor": contributor.id}
     record_custom_parameter("contributor", contributor.id)
     status = "OK"
+    profiler = start_sampled_profiler(contributor.id)
 
-    try:
-        # create a raw rt_update obj, save the raw_input into the db
-        rt_update, rtu_log_dict = builder.build_rt_update(input_raw)
-        log_dict.update(rtu_log_dict)
-
-        # raw_input is interpreted
-        trip_updates, tu_log_dict = builder.build_trip_updates(rt_update)
-        log_dict.update(tu_log_dict)
-
-        # finally confront to previously existing information (base_schedule, previous real-time)
-        _, handler_log_dict = handle(builder, rt_update, trip_updates)
-        log_dict.update(handler_log_dict)
-
-    except Exception as e:
-        status = "failure"
-        allow_reprocess = True
-        if is_invalid_input_exception(e):
-            status = "warning"  # Kirin did his job correctly if the input is invalid and rejected
-            allow_reprocess = False  # reprocess is useless if input is invalid
-
-        if rt_update is not None:
-            error = e.data["error"] if (isinstance(e, KirinException) and "error" in e.data) else e.message
-            set_rtu_status_ko(rt_update, error, is_reprocess_same_data_allowed=allow_reprocess)
-            db_commit(rt_update)
-        else:
-            # rt_update is not built, make sure reprocess is allowed
-            allow_reprocess_same_data(contributor.id)
-
-        log_dict.update({"exc_summary": six.text_type(e), "reason": e})
-
-        record_custom_parameter("reason", e)  # using __str__() here to have complete details
-        raise  # filters later for APM (auto.)
-
-    finally:
-        log_dict.update({"duration": (datetime.datetime.utcnow() - start_datetime).total_seconds()})
-        record_call(status, **log_dict)
-        if status == "OK":
-            logging.getLogger(__name__).info(status, extra=log_dict)
-        elif status == "warning":
-            logging.getLogger(__name__).warning(status, extra=log_dict)
-        else:
-            logging.getLogger(__name__).error(status, extra=log_dict)
+    with sql_accounting() as sql_stats:
+        try:
+            with observe_stage("build_rt_update", contributor):
+                rt_update, rtu_log_dict = build_rt_update()
+            log_dict.update(rtu_log_dict)
+
+            # raw_input is interpreted
+            with observe_stage("build_trip_updates", contributor):
+                trip_updates, tu_log_dict = builder.build_trip_updates(rt_update)
+            log_dict.update(tu_log_dict)
+
+            # finally confront to previously existing information (base_schedule, previous real-time)
+            _, handler_log_dict = handle(builder, rt_update, trip_updates, publish)
+            log_dict.update(handler_log_dict)
+
+        except Exception as e:
+            _rollback_processing([rt_update])
+            status = _manage_build_error(builder, rt_update, e)
+
+            log_dict.update({"exc_summary": six.text_type(e), "reason": e})
+
+            record_custom_parameter("reason", e)  # using __str__() here to have complete details
+            raise  # filters later for APM (auto.)
+
+        finally:
+            log_dict.update({"duration": (datetime.datetime.utcnow() - start_datetime).total_seconds()})
+            log_dict.update(sql_stats)
+            _log_status(status, log_dict)
+            if profiler:
+                dump_profiler(profiler, contributor.id, rt_update.id if rt_update else None)
+
+    return rt_update
+
+
+def wrap_build_batch(builder, inputs_raw):
+    """
+    Same as wrap_build() for several inputs of the same contributor:
+    each input is interpreted separately (an invalid input only fails itself),
+    then the result is persisted in db and published for Navitia only once for the whole batch.
+    :param builder: the KirinModelBuilder to be called (must inherit from abstract_builder.AbstractKirinModelBuilder)
+    :param inputs_raw: the feeds to process
+    :return: the RealTimeUpdate of each input (None if it could not be built)
+    """
+    contributor = builder.contributor
+    start_datetime = datetime.datetime.utcnow()
+    log_dict = {"contributor": contributor.id, "batch_size": len(inputs_raw)}
+    record_custom_parameter("contributor", contributor.id)
+    rt_updates = []
+    built_updates = []
+    failed_rt_updates = []
+
+    with sql_accounting() as sql_stats:
+        for input_raw in inputs_raw:
+            rt_update = None
+            record_feed_size("received", contributor, get_raw_input(input_raw))
+            try:
+                with observe_stage("build_rt_update", contributor):
+                    rt_update, _ = builder.build_rt_update(input_raw)
+                with observe_stage("build_trip_updates", contributor):
+                    trip_updates, _ = builder.build_trip_updates(rt_update)
+                built_updates.append((rt_update, trip_updates))
+            except Exception as e:
+                if isinstance(e, SQLAlchemyError):
+                    # the session can't be used anymore, nothing of the batch is persisted yet
+                    _rollback_processing([rt_update] + [built_update[0] for built_update in built_updates])
+                input_log_dict = {"contributor": contributor.id, "exc_summary": six.text_type(e), "reason": e}
+                # the error is persisted with the rest of the batch
+                _log_status(_manage_build_error(builder, rt_update, e, commit=False), input_log_dict)
+                if rt_update is not None:
+                    failed_rt_updates.append(rt_update)
+            rt_updates.append(rt_update)
+        log_dict["failed_count"] = len(inputs_raw) - len(built_updates)
+
+        if not built_updates and not failed_rt_updates:
+            return rt_updates
+
+        status = "OK"
+        try:
+            log_dict.update(handle_batch(builder, built_updates, failed_rt_updates))
+
+        except Exception as e:
+            _rollback_processing([built_update[0] for built_update in built_updates] + failed_rt_updates)
+            for rt_update, _ in built_updates:
+                status = _manage_build_error(builder, rt_update, e, commit=False)
+            model.db.session.add_all([built_update[0] for built_update in built_updates] + failed_rt_updates)
+            model.db.session.commit()
+
+            log_dict.update({"exc_summary": six.text_type(e), "reason": e})
+            record_custom_parameter("reason", e)
+            raise
+
+        finally:
+            log_dict.update({"duration": (datetime.datetime.utcnow() - start_datetime).total_seconds()})
+            log_dict.update(sql_stats)
+            _log_status(status, log_dict)
+
+    return rt_updates
@@ -32,16 +32,38 @@
 from __future__ import absolute_import, print_function, unicode_literals, division
 from datetime import timedelta
 from sqlalchemy.dialects import postgresql
-from sqlalchemy.orm import backref, deferred
+from sqlalchemy.orm import backref, deferred, sessionmaker
 from sqlalchemy.ext.orderinglist import ordering_list
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from contextlib import contextmanager
 import datetime
+import logging
+import time
 import sqlalchemy
 from sqlalchemy import desc
 from kirin.core.types import ModificationType, TripEffect, ConnectorType, DELETED_STATUSES, ADDED_STATUSES
 from kirin.exceptions import ObjectNotFound, InternalException
 
-db = SQLAlchemy()
+
+class RoutingSession(SignallingSession):
+    """
+    Session reading from the replica database when asked to (see read_from_replica()).
+    Writes always go to the primary database.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica_engine = self.info.get("replica_engine")
+        if replica_engine is not None and not self._flushing:
+            return replica_engine
+        return super(RoutingSession, self).get_bind(mapper=mapper, clause=clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
 
 # default name convention for db constraints (when not specified), for future alembic updates
 meta = sqlalchemy.schema.MetaData(
@@ -59,12 +81,65 @@ DEFAULT_DAYS_TO_KEEP_RT_UPDATE = 30
 GTFS_RT_DAYS_TO_KEEP_TRIP_UPDATE = 3
 GTFS_RT_DAYS_TO_KEEP_RT_UPDATE = 10
 
-# force the server to use UTC time for each connection checkouted from the pool
-@sqlalchemy.event.listens_for(sqlalchemy.pool.Pool, "checkout")
-def set_utc_on_connect(dbapi_con, connection_record, connection_proxy):
+# force the server to use UTC time for each new connection of the pool
+# (committed to survive the rollbacks done when connections are given back to the pool)
+@sqlalchemy.event.listens_for(sqlalchemy.pool.Pool, "connect")
+def set_utc_on_connect(dbapi_con, connection_record):
     c = dbapi_con.cursor()
     c.execute("SET timezone='utc'")
     c.close()
+    dbapi_con.commit()
+
+
+REPLICA_BIND = "replica"
+
+# result of the last check of the replica's lag: replica is used only if it is late by less than REPLICA_MAX_LAG
+_replica_status = {"checked_at": None, "usable": False}
+
+
+def _is_replica_usable(app, replica_engine):
+    now = time.time()
+    checked_at = _replica_status["checked_at"]
+    if checked_at is not None and now - checked_at < app.config[str("REPLICA_LAG_CHECK_INTERVAL")]:
+        return _replica_status["usable"]
+
+    usable = False
+    try:
+        # the lag is the age of the last transaction replayed (the primary is never idle for long)
+        lag = replica_engine.scalar(
+            "SELECT CASE WHEN pg_is_in_recovery() "
+            "THEN EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) ELSE 0 END;"
+        )
+        usable = lag is not None and lag <= app.config[str("REPLICA_MAX_LAG")]
+        if not usable:
+            logging.getLogger(__name__).warning("replica database is lagging (%ss), using primary", lag)
+    except Exception:
+        logging.getLogger(__name__).exception("replica database is unreachable, using primary")
+    _replica_status.update({"checked_at": now, "usable": usable})
+    return usable
+
+
+@contextmanager
+def read_from_replica():
+    """
+    Route the reads of the current session to the replica database (SQLALCHEMY_BINDS["replica"]),
+    if it's configured and not lagging too much.
+    To be used only for reads that can afford to be a bit late, otherwise reads stay on the primary.
+    """
+    app = db.get_app()
+    replica_engine = None
+    if app.config.get(str("SQLALCHEMY_BINDS")) and REPLICA_BIND in app.config[str("SQLALCHEMY_BINDS")]:
+        engine = db.get_engine(app, bind=REPLICA_BIND)
+        if _is_replica_usable(app, engine):
+            replica_engine = engine
+
+    session = db.session()
+    previous_engine = session.info.get("replica_engine")
+    session.info["replica_engine"] = replica_engine
+    try:
+        yield
+    finally:
+        session.info["replica_engine"] = previous_engine
 
 
 def gen_uuid():
@@ -401,16 +476,66 @@ class TripUpdate(db.Model, TimestampMixin):  # type: ignore
         return query.all()
 
     @classmethod
-    def remove_by_contributors_and_period(cls, contributors, start_date=None, end_date=None):
-        trip_updates_to_remove = cls.find_by_contributor_period(
-            contributors=contributors, start_date=start_date, end_date=end_date
-        )
-        for t in trip_updates_to_remove:
-            f = sqlalchemy.text("associate_realtimeupdate_tripupdate.trip_update_id='{}'".format(t.vj_id))
-            db.session.query(associate_realtimeupdate_tripupdate).filter(f).delete(synchronize_session=False)
-            db.session.delete(t)
+    def remove_by_contributors_and_period(
+        cls,
+        contributors,
+        chunk_size,
+        start_date=None,
+        end_date=None,
+        on_chunk_deleted=None,
+        before_chunk_deleted=None,
+    ):
+        """
+        Delete TripUpdates (with their VehicleJourney, StopTimeUpdates and associations to RealTimeUpdates,
+        thanks to db cascades) by chunks of at most chunk_size trips, in vj_id order.
+        Each chunk is deleted by a single statement and committed.
+
+        :param on_chunk_deleted: called after each chunk with the number of trips deleted and the duration (s)
+        :param before_chunk_deleted: called before deleting each chunk (in the same transaction) with the
+            filters (on trip_update and vehicle_journey tables) selecting the trips of the chunk
+        :return: total number of trips deleted
+        """
+        vj_table = VehicleJourney.__table__
+        tu_table = cls.__table__
+        filters = [tu_table.c.vj_id == vj_table.c.id, tu_table.c.contributor_id.in_(contributors)]
+        if start_date:
+            filters.append(
+                vj_table.c.start_timestamp >= datetime.datetime.combine(start_date, datetime.time(0, 0))
+            )
+        if end_date:
+            filters.append(vj_table.c.start_timestamp < datetime.datetime.combine(end_date, datetime.time(0, 0)))
+
+        nb_deleted = 0
+        last_id = None
+        while True:
+            start = time.time()
+            chunk_filters = list(filters)
+            if last_id is not None:
+                chunk_filters.append(tu_table.c.vj_id > last_id)
+            chunk = (
+                sqlalchemy.select([tu_table.c.vj_id])
+                .where(sqlalchemy.and_(*chunk_filters))
+                .order_by(tu_table.c.vj_id)
+                .limit(chunk_size)
+                .alias("chunk")
+            )
+            max_id = db.session.execute(sqlalchemy.select([sqlalchemy.func.max(chunk.c.vj_id)])).scalar()
+            if max_id is None:
+                break
+
+            # DELETE FROM vehicle_journey USING trip_update WHERE ...: cascades to trip_update and below
+            chunk_filters.append(tu_table.c.vj_id <= max_id)
+            if before_chunk_deleted:
+                before_chunk_deleted(chunk_filters)
+            result = db.session.execute(vj_table.delete().where(sqlalchemy.and_(*chunk_filters)))
+            db.session.commit()
 
-        db.session.commit()
+            nb_deleted += result.rowcount
+            last_id = max_id
+            if on_chunk_deleted:
+                on_chunk_deleted(result.rowcount, time.time() - start)
+
+        return nb_deleted
 
     def find_stop(self, stop_id, order=None):
         # To handle a vj with the same stop served multiple times (lollipop) we search first with
@@ -441,6 +566,9 @@ class RealTimeUpdate(db.Model, TimestampMixin):  # type: ignore
     db.Index("status_idx", status)
     error = db.Column(db.Text, nullable=True)
     raw_data = deferred(db.Column(db.Text, nullable=True))
+    # when raw_data is stored outside db (see kirin.blob_store): its content hash (sha256) and size (bytes)
+    raw_data_hash = db.Column(db.Text, nullable=True)
+    raw_data_size = db.Column(db.Integer, nullable=True)
     contributor_id = db.Column(db.Text, db.ForeignKey("contributor.id"), nullable=False)
 
     trip_updates = db.relationship(
@@ -454,6 +582,7 @@ class RealTimeUpdate(db.Model, TimestampMixin):  # type: ignore
     __table_args__ = (
         db.Index("realtime_update_created_at", "created_at"),
         db.Index("realtime_update_contributor_id_and_created_at", "created_at", "contributor_id"),
+        db.Index("realtime_update_raw_data_hash", "raw_data_hash"),
     )
 
     def __init__(self, raw_data, connector_type, contributor_id, status="OK", error=None):
@@ -464,6 +593,21 @@ class RealTimeUpdate(db.Model, TimestampMixin):  # type: ignore
         self.error = error
         self.contributor_id = contributor_id
 
+    @classmethod
+    def find_last_by_contributors(cls, contributor_ids, status=None):
+        """
+        :return: the last RealTimeUpdate (optionally with given status) of each contributor,
+        retrieved at once (SELECT DISTINCT ON)
+        """
+        query = db.session.query(
+            cls.id, cls.contributor_id, cls.created_at, cls.status, cls.updated_at, cls.error
+        )
+        query = query.filter(cls.contributor_id.in_(contributor_ids))
+        if status:
+            query = query.filter(cls.status == status)
+        query = query.distinct(cls.contributor_id).order_by(cls.contributor_id, desc(cls.created_at))
+        return query.all()
+
     @classmethod
     def get_probes_by_contributor(cls):
         """
@@ -472,38 +616,109 @@ class RealTimeUpdate(db.Model, TimestampMixin):  # type: ignore
         result = {"last_update": {}, "last_valid_update": {}, "last_update_error": {}}
 
         contributor_ids = [contributor.id for contributor in Contributor.query_existing().all()]
-        for c_id in contributor_ids:
-            sql = db.session.query(cls.created_at, cls.status, cls.updated_at, cls.error)
-            sql = sql.filter(cls.contributor_id == c_id)
-            sql = sql.order_by(desc(cls.created_at))
-            row = sql.first()
-            if row:
-                date = row.updated_at if row.updated_at else row.created_at  # update if exist, otherwise created
-                result["last_update"][c_id] = date.strftime("%Y-%m-%dT%H:%M:%SZ")
-                if row.status == "OK":
-                    result["last_valid_update"][c_id] = row.created_at.strftime("%Y-%m-%dT%H:%M:%SZ")
-                    # no error to populate
-                else:
-                    result["last_update_error"][c_id] = row.error
-                    sql_ok = sql.filter(cls.status == "OK")
-                    row_ok = sql_ok.first()
-                    if row_ok:
-                        result["last_valid_update"][c_id] = row_ok.created_at.strftime("%Y-%m-%dT%H:%M:%SZ")
+        if not contributor_ids:
+            return result
+        for row in cls.find_last_by_contributors(contributor_ids):
+            c_id = row.contributor_id
+            date = row.updated_at if row.updated_at else row.created_at  # update if exist, otherwise created
+            result["last_update"][c_id] = date.strftime("%Y-%m-%dT%H:%M:%SZ")
+            if row.status != "OK":
+                result["last_update_error"][c_id] = row.error
+        for row in cls.find_last_by_contributors(contributor_ids, status="OK"):
+            result["last_valid_update"][row.contributor_id] = row.created_at.strftime("%Y-%m-%dT%H:%M:%SZ")
 
         return result
 
     @classmethod
-    def remove_by_contributors_until(cls, contributors, until):
-        sub_query = (
-            db.session.query(cls.id)
-            .outerjoin(associate_realtimeupdate_tripupdate)
-            .filter(cls.contributor_id.in_(contributors))
-            .filter(cls.created_at < until)
-            .filter(associate_realtimeupdate_tripupdate.c.real_time_update_id == None)
-        )  # '==' works, not 'is'
-        cls.query.filter(cls.id.in_(sub_query)).delete(synchronize_session=False)
-
-        db.session.commit()
+    def _purgeable_filters(cls, contributors, until):
+        associations = associate_realtimeupdate_tripupdate
+        return [
+            cls.contributor_id.in_(contributors),
+            cls.created_at < until,
+            ~sqlalchemy.exists().where(associations.c.real_time_update_id == cls.id),
+        ]
+
+    @classmethod
+    def count_by_contributors_until(cls, contributors, until):
+        """
+        Number of RealTimeUpdates that would be removed by remove_by_contributors_until()
+        """
+        return cls.query.filter(*cls._purgeable_filters(contributors, until)).count()
+
+    @classmethod
+    def remove_by_contributors_until(
+        cls, contributors, until, chunk_size, on_chunk_deleted=None, before_chunk_deleted=None
+    ):
+        """
+        Delete RealTimeUpdates created before until that are not associated to any TripUpdate anymore.
+        The index on (created_at, contributor_id) is walked by time-ordered chunks of about chunk_size
+        RealTimeUpdates (all those with the same created_at are in the same chunk), each chunk being deleted
+        by a single statement and committed.
+
+        :param on_chunk_deleted: called after each chunk with the number of RTUs deleted and the duration (s)
+        :param before_chunk_deleted: called before deleting each chunk (in the same transaction) with the
+            filters (on real_time_update table) selecting the RTUs of the chunk
+        :return: total number of RealTimeUpdates deleted
+        """
+        rtu_table = cls.__table__
+        nb_deleted = 0
+        last_created_at = None
+        while True:
+            start = time.time()
+            range_filters = []
+            if last_created_at is not None:
+                range_filters.append(rtu_table.c.created_at > last_created_at)
+            chunk = (
+                sqlalchemy.select([rtu_table.c.created_at])
+                .where(
+                    sqlalchemy.and_(
+                        rtu_table.c.contributor_id.in_(contributors),
+                        rtu_table.c.created_at < until,
+                        *range_filters
+                    )
+                )
+                .order_by(rtu_table.c.created_at)
+                .limit(chunk_size)
+                .alias("chunk")
+            )
+            max_created_at = db.session.execute(
+                sqlalchemy.select([sqlalchemy.func.max(chunk.c.created_at)])
+            ).scalar()
+            if max_created_at is None:
+                break
+
+            # RTUs still used by a TripUpdate are kept (they will be purged once the TripUpdate is)
+            range_filters.append(rtu_table.c.created_at <= max_created_at)
+            chunk_filters = cls._purgeable_filters(contributors, until) + range_filters
+            if before_chunk_deleted:
+                before_chunk_deleted(chunk_filters)
+            result = db.session.execute(rtu_table.delete().where(sqlalchemy.and_(*chunk_filters)))
+            db.session.commit()
+
+            nb_deleted += result.rowcount
+            last_created_at = max_created_at
+            if on_chunk_deleted:
+                on_chunk_deleted(result.rowcount, time.time() - start)
+
+        return nb_deleted
+
+    @classmethod
+    def find_used_raw_data_hashes(cls, raw_data_hashes):
+        """
+        :return: the set of given raw data hashes still referenced by a RealTimeUpdate (see kirin.blob_store)
+        """
+        if not raw_data_hashes:
+            return set()
+        q = db.session.query(cls.raw_data_hash).filter(cls.raw_data_hash.in_(raw_data_hashes)).distinct()
+        return {raw_data_hash for raw_data_hash, in q}
+
+    @classmethod
+    def get_next_pending(cls, contributor_id):
+        """
+        :return: the oldest RealTimeUpdate of the contributor waiting to be processed (see ASYNC_INGESTION)
+        """
+        q = cls.query.filter_by(contributor_id=contributor_id, status="pending")
+        return q.order_by(cls.created_at, cls.id).first()
 
     @classmethod
     def get_last_rtu(cls, connector_type, contributor_id):
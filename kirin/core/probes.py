@@ -0,0 +1,183 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import logging
+
+import sqlalchemy
+import ujson
+from redis.exceptions import RedisError
+
+from kirin.core import model
+from kirin.core.model import RealTimeUpdate
+from kirin.utils import build_redis_probes_key
+
+
+# compare-and-set of the probes summary of a contributor with the state of one of its RealTimeUpdates
+# (atomic, so that concurrent commits of a contributor can't overwrite a more recent state with an older one)
+# KEYS: probes key of the contributor, key telling that probes summaries are refreshed
+# ARGV: rtu_id, created_at, last_update, status, last_update_error (json), last_valid_update
+_STORE_RTU_PROBE_SCRIPT = """
+local last = redis.call('HMGET', KEYS[1], 'rtu_id', 'created_at', 'valid_rtu_id', 'valid_created_at')
+local rtu_id, created_at, is_ok = ARGV[1], ARGV[2], ARGV[4] == 'OK'
+if not last[1] or last[1] == rtu_id or created_at >= last[2] then
+    redis.call('HMSET', KEYS[1], 'rtu_id', rtu_id, 'created_at', created_at, 'last_update', ARGV[3])
+    if is_ok then
+        redis.call('HDEL', KEYS[1], 'last_update_error')
+    else
+        redis.call('HSET', KEYS[1], 'last_update_error', ARGV[5])
+    end
+end
+if is_ok then
+    if not last[3] or last[3] == rtu_id or created_at >= last[4] then
+        redis.call('HMSET', KEYS[1], 'valid_rtu_id', rtu_id, 'valid_created_at', created_at,
+                   'last_valid_update', ARGV[6])
+    end
+elseif rtu_id == last[3] then
+    -- last valid update is not valid anymore, previous one is only known by db
+    redis.call('DEL', KEYS[2])
+end
+"""
+
+
+def _format_probe_dt(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _store_rtu_probes(rtu_probes):
+    """
+    Update the probes summary of each contributor in redis with the given RealTimeUpdates' states
+    (all at once, each one being applied atomically).
+    Only the last RealTimeUpdate (and last valid one) of each contributor is taken into account.
+    """
+    from kirin import app, redis_client
+
+    store_rtu_probe = redis_client.register_script(_STORE_RTU_PROBE_SCRIPT)
+    pipe = redis_client.pipeline()
+    for probe in sorted(rtu_probes, key=lambda p: p["created_at"]):
+        store_rtu_probe(
+            keys=[
+                build_redis_probes_key(probe["contributor_id"]),
+                app.config[str("CONTRIBUTOR_PROBES_REFRESHED_KEY")],
+            ],
+            args=[
+                probe["id"],
+                probe["created_at"].isoformat(),
+                _format_probe_dt(probe["updated_at"] or probe["created_at"]),
+                probe["status"],
+                ujson.dumps(probe["error"]),
+                _format_probe_dt(probe["created_at"]),
+            ],
+            client=pipe,
+        )
+    pipe.execute()
+
+
+@sqlalchemy.event.listens_for(model.db.session, "after_flush")
+def _collect_rtu_probes(session, flush_context):
+    # keep the state of the RealTimeUpdates written, to update probes summary once committed
+    rtu_probes = session.info.setdefault("rtu_probes", [])
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, RealTimeUpdate) and obj.created_at:
+            rtu_probes.append(
+                {
+                    "id": obj.id,
+                    "contributor_id": obj.contributor_id,
+                    "created_at": obj.created_at,
+                    "updated_at": obj.updated_at,
+                    "status": obj.status,
+                    "error": obj.error,
+                }
+            )
+
+
+@sqlalchemy.event.listens_for(model.db.session, "after_commit")
+def _update_rtu_probes(session):
+    rtu_probes = session.info.pop("rtu_probes", None)
+    if not rtu_probes:
+        return
+    try:
+        _store_rtu_probes(rtu_probes)
+    except RedisError:
+        logging.getLogger(__name__).exception("Exception with redis while updating contributors probes")
+
+
+@sqlalchemy.event.listens_for(model.db.session, "after_soft_rollback")
+def _discard_rtu_probes(session, previous_transaction):
+    session.info.pop("rtu_probes", None)
+
+
+def refresh_contributors_probes(contributor_ids):
+    """
+    (Re)build the probes summary of given contributors in redis from db
+    """
+    from kirin import app, redis_client
+
+    rtu_probes = [
+        row._asdict()
+        for status in (None, "OK")
+        for row in model.RealTimeUpdate.find_last_by_contributors(contributor_ids, status=status)
+    ]
+    redis_client.delete(*[build_redis_probes_key(c_id) for c_id in contributor_ids])
+    _store_rtu_probes(rtu_probes)
+    redis_client.set(
+        app.config[str("CONTRIBUTOR_PROBES_REFRESHED_KEY")],
+        1,
+        ex=app.config[str("CONTRIBUTOR_PROBES_REFRESH_INTERVAL")],
+    )
+
+
+def get_contributors_probes():
+    """
+    create a dict of probes of active contributors from the summary maintained in redis
+    (refreshed from db if too old)
+    """
+    from kirin import app, redis_client
+
+    result = {"last_update": {}, "last_valid_update": {}, "last_update_error": {}}
+    with model.read_from_replica():
+        contributor_ids = [contributor.id for contributor in model.Contributor.query_existing().all()]
+        if not contributor_ids:
+            return result
+        if not redis_client.exists(app.config[str("CONTRIBUTOR_PROBES_REFRESHED_KEY")]):
+            refresh_contributors_probes(contributor_ids)
+
+    pipe = redis_client.pipeline()
+    for c_id in contributor_ids:
+        pipe.hmget(build_redis_probes_key(c_id), "last_update", "last_valid_update", "last_update_error")
+    for c_id, (last_update, last_valid_update, last_update_error) in zip(contributor_ids, pipe.execute()):
+        if last_update is not None:
+            result["last_update"][c_id] = last_update.decode("utf-8")
+        if last_valid_update is not None:
+            result["last_valid_update"][c_id] = last_valid_update.decode("utf-8")
+        if last_update_error is not None:
+            result["last_update_error"][c_id] = ujson.loads(last_update_error)
+    return result
@@ -0,0 +1,87 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import logging
+
+import sqlalchemy
+from redis.exceptions import RedisError
+
+from kirin.core import model
+from kirin.utils import build_redis_realtime_version_key
+
+
+@sqlalchemy.event.listens_for(model.db.session, "after_flush")
+def _collect_realtime_changes(session, flush_context):
+    # contributors whose realtime (TripUpdates) changed, to bump their version once committed
+    changed_contributors = session.info.setdefault("changed_contributors", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, model.TripUpdate) and obj.contributor_id:
+            changed_contributors.add(obj.contributor_id)
+
+
+@sqlalchemy.event.listens_for(model.db.session, "after_commit")
+def _update_realtime_versions(session):
+    changed_contributors = session.info.pop("changed_contributors", None)
+    if not changed_contributors:
+        return
+    try:
+        bump_realtime_versions(changed_contributors)
+    except RedisError:
+        logging.getLogger(__name__).exception("Exception with redis while updating realtime versions")
+
+
+@sqlalchemy.event.listens_for(model.db.session, "after_soft_rollback")
+def _discard_realtime_changes(session, previous_transaction):
+    session.info.pop("changed_contributors", None)
+
+
+def bump_realtime_versions(contributor_ids):
+    """
+    Signal that the realtime (TripUpdates) of given contributors changed in db
+    (to invalidate what was computed from it, like the GTFS-RT feeds exported)
+    """
+    from kirin import redis_client
+
+    pipe = redis_client.pipeline()
+    for c_id in contributor_ids:
+        pipe.incr(build_redis_realtime_version_key(c_id))
+    pipe.execute()
+
+
+def get_realtime_versions(contributor_ids):
+    """
+    :return: the current version of the realtime of each contributor (see bump_realtime_versions())
+    """
+    from kirin import redis_client
+
+    versions = redis_client.mget([build_redis_realtime_version_key(c_id) for c_id in contributor_ids])
+    return [int(v) if v is not None else 0 for v in versions]
@@ -0,0 +1,93 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import threading
+import time
+from contextlib import contextmanager
+
+import sqlalchemy
+from sqlalchemy.engine import Engine
+
+# SQL activity of the current accounting block (thread/greenlet local), see sql_accounting()
+_call_context = threading.local()
+
+
+@contextmanager
+def sql_accounting():
+    """
+    Count the SQL statements, round trips to the database (statements, commits and rollbacks)
+    and time spent executing statements (seconds) in the block.
+    Yields the dict of stats, filled when the block is exited.
+    """
+    stats = {"sql_statements": 0, "sql_round_trips": 0, "sql_duration": 0.0}
+    previous_stats = getattr(_call_context, "stats", None)
+    _call_context.stats = stats
+    try:
+        yield stats
+    finally:
+        _call_context.stats = previous_stats
+        if previous_stats is not None:
+            # nested accounting is also accounted by the enclosing one
+            for key, value in stats.items():
+                previous_stats[key] += value
+
+
+def _count_round_trips(count=1):
+    stats = getattr(_call_context, "stats", None)
+    if stats is not None:
+        stats["sql_round_trips"] += count
+    return stats
+
+
+@sqlalchemy.event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.time())
+
+
+@sqlalchemy.event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.time() - conn.info["query_start_time"].pop()
+    # psycopg2's executemany() runs the statement once per set of parameters
+    stats = _count_round_trips(len(parameters) if executemany else 1)
+    if stats is not None:
+        stats["sql_statements"] += 1
+        stats["sql_duration"] += duration
+
+
+@sqlalchemy.event.listens_for(Engine, "commit")
+def _commit(conn):
+    _count_round_trips()
+
+
+@sqlalchemy.event.listens_for(Engine, "rollback")
+def _rollback(conn):
+    _count_round_trips()
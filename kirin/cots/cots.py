@@ -36,11 +36,12 @@ import logging
 
 from flask_restful import Resource
 
-from kirin.core.build_wrapper import wrap_build
+from kirin.core.build_wrapper import wrap_build, enqueue_build
 from kirin.cots import KirinModelBuilder
 from kirin.exceptions import InvalidArguments, SubServiceError
 from kirin.core import model
 from kirin.core.types import ConnectorType
+from kirin.resources.real_time_updates import accepted_response
 
 
 def get_cots_contributor(include_deactivated=False):
@@ -79,5 +80,9 @@ class Cots(Resource):
     def post(self):
         raw_json = get_cots(flask.globals.request)
 
+        if current_app.config[str("ASYNC_INGESTION")]:
+            rt_update = enqueue_build(self.builder, raw_json)
+            return accepted_response("COTS feed accepted", rt_update)
+
         wrap_build(self.builder, raw_json)
         return "OK", 200
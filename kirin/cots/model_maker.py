@@ -54,6 +54,8 @@ from kirin.utils import (
     get_value,
     as_utc_naive_dt,
     as_duration,
+    attach_json,
+    get_rtu_json,
 )
 from kirin.core.types import (
     TripEffect,
@@ -335,12 +337,13 @@ class KirinModelBuilder(AbstractKirinModelBuilder):
         rt_update = make_rt_update(
             input_raw, connector_type=self.contributor.connector_type, contributor_id=self.contributor.id
         )
+        attach_json(rt_update, input_raw)
         log_dict = {}
         return rt_update, log_dict
 
     def build_trip_updates(self, rt_update):
         """
-        parse the COTS raw json stored in the rt_update object (in Kirin db)
+        interpret the COTS json attached to the rt_update object (parsed once when received)
         and return a list of trip updates
 
         The TripUpdates are not yet associated with the RealTimeUpdate
@@ -348,10 +351,7 @@ class KirinModelBuilder(AbstractKirinModelBuilder):
         Most of the realtime information parsed is contained in the 'nouvelleVersion' sub-object
         (see fixtures and documentation)
         """
-        try:
-            json = ujson.loads(rt_update.raw_data)
-        except ValueError as e:
-            raise InvalidArguments("invalid json: {}".format(e.message))
+        json = get_rtu_json(rt_update)
 
         if "nouvelleVersion" not in json:
             raise InvalidArguments('No object "nouvelleVersion" available in feed provided')
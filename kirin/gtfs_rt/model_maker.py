@@ -30,6 +30,7 @@
 # www.navitia.io
 from __future__ import absolute_import, print_function, unicode_literals, division
 import datetime
+import hashlib
 import logging
 
 import six
@@ -43,11 +44,14 @@ from kirin.core.merge_utils import merge
 from kirin.core.types import ModificationType, get_higher_status, get_effect_by_stop_time_status, ConnectorType
 from kirin.exceptions import InternalException, InvalidArguments
 from kirin.utils import make_rt_update, floor_datetime, to_navitia_utc_str, set_rtu_status_ko, manage_db_error
-from kirin.utils import record_internal_failure
-from kirin import app
+from kirin.utils import record_internal_failure, build_redis_entity_hashes_key
+from kirin import app, redis_client
 import itertools
 import calendar
 
+# field of the entity-hashes' redis hash storing the navitia publication date the hashes are valid for
+ENTITY_HASHES_PUB_DATE_FIELD = "__navitia_publication_date__"
+
 
 class KirinModelBuilder(AbstractKirinModelBuilder):
     def __init__(self, contributor):
@@ -110,20 +114,79 @@ class KirinModelBuilder(AbstractKirinModelBuilder):
 
         trip_updates = []
 
+        entity_hashes = None
+        previous_entity_hashes = {}
+        if (
+            app.config.get(str("GTFS_RT_ENTITY_DIFF"))
+            and proto.header.incrementality == gtfs_realtime_pb2.FeedHeader.FULL_DATASET
+        ):
+            entity_hashes = {
+                entity.id: _get_entity_hash(entity) for entity in proto.entity if entity.trip_update
+            }
+            previous_entity_hashes = self._get_previous_entity_hashes()
+
+        unchanged_entity_count = 0
         for entity in proto.entity:
             if not entity.trip_update:
                 continue
+            if entity_hashes is not None and previous_entity_hashes.get(entity.id) == entity_hashes[entity.id]:
+                # entity is exactly the same as in previous feed, so is the resulting trip (already processed)
+                unchanged_entity_count += 1
+                continue
             tu = self._make_trip_updates(entity.trip_update, input_data_time=input_data_time)
             trip_updates.extend(tu)
 
-        if not trip_updates:
+        if entity_hashes is not None:
+            # entities of previous feed absent from this one are forgotten, they will be processed if they come back.
+            # Last info about the trip is kept as is (in db and navitia).
+            vanished_entity_count = len(six.viewkeys(previous_entity_hashes) - six.viewkeys(entity_hashes))
+            self._save_entity_hashes(entity_hashes)
+            log_dict.update(
+                {
+                    "unchanged_entity_count": unchanged_entity_count,
+                    "vanished_entity_count": vanished_entity_count,
+                }
+            )
+
+        if not trip_updates and not unchanged_entity_count:
             msg = "No information for this gtfs-rt with timestamp: {}".format(proto.header.timestamp)
             set_rtu_status_ko(rt_update, msg, is_reprocess_same_data_allowed=False)
             self.log.warning(msg)
 
-        log_dict = {}
         return trip_updates, log_dict
 
+    def _get_previous_entity_hashes(self):
+        """
+        :return: dict of the entity hashes of previous feed processed for the contributor
+        (empty if unknown, or if navitia data changed since)
+        """
+        try:
+            raw_hashes = redis_client.hgetall(build_redis_entity_hashes_key(self.contributor.id))
+        except Exception as e:
+            self.log.debug("exception occurred when getting previous entity hashes: %s", six.text_type(e))
+            return {}  # whatever the exception is, we just process the whole feed
+
+        hashes = {
+            (k.decode("utf-8") if isinstance(k, six.binary_type) else k): v for k, v in six.iteritems(raw_hashes)
+        }
+        if hashes.pop(ENTITY_HASHES_PUB_DATE_FIELD, None) != six.text_type(self.instance_data_pub_date):
+            return {}  # resulting trips may differ on a different navitia data
+        return hashes
+
+    def _save_entity_hashes(self, entity_hashes):
+        key = build_redis_entity_hashes_key(self.contributor.id)
+        try:
+            pipe = redis_client.pipeline()
+            pipe.delete(key)
+            if entity_hashes:
+                to_store = dict(entity_hashes)
+                to_store[ENTITY_HASHES_PUB_DATE_FIELD] = six.text_type(self.instance_data_pub_date)
+                pipe.hmset(key, to_store)
+                pipe.expire(key, app.config.get(str("GTFS_RT_ENTITY_HASHES_TIMEOUT")))
+            pipe.execute()
+        except Exception as e:
+            self.log.debug("exception occurred when saving entity hashes: %s", six.text_type(e))
+
     def _get_stop_code(self, nav_stop):
         for c in nav_stop.get("codes", []):
             if c["type"] == self.stop_code_key:
@@ -260,6 +323,10 @@ class KirinModelBuilder(AbstractKirinModelBuilder):
         return merge(navitia_vj, db_trip_update, new_trip_update, is_new_complete=False)
 
 
+def _get_entity_hash(entity):
+    return hashlib.sha1(entity.SerializeToString()).hexdigest()
+
+
 def _init_stop_update(nav_stop, stop_sequence):
     st_update = model.StopTimeUpdate(
         nav_stop,
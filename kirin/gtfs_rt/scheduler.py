@@ -0,0 +1,126 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import logging
+import time
+
+import six
+
+from kirin import app, redis_client
+from kirin.gtfs_rt.gtfs_rt import get_gtfsrt_contributors
+from kirin.utils import get_contributors_version, record_poll_schedule
+
+DEFAULT_RETRIEVAL_INTERVAL = 10
+
+# configs of GTFS-RT contributors to poll, reloaded only when contributors change
+_poll_configs_cache = {"version": None, "loaded_at": None, "configs": []}
+
+
+def _make_poll_config(contributor):
+    return {
+        "contributor": contributor.id,
+        "navitia_url": app.config.get(str("NAVITIA_URL")),
+        "token": contributor.navitia_token,
+        "coverage": contributor.navitia_coverage,
+        "feed_url": contributor.feed_url,
+        "retrieval_interval": contributor.retrieval_interval,
+        "timeout": app.config.get(str("GTFS_RT_TIMEOUT"), 1),
+        "is_scheduled": True,
+    }  # WARNING: cleanup might be done here, but be cautious when removing.
+    # Keep in mind that during deployment, workers from version n and n+1 are present
+    # (so no remove before both version stop using what's removed).
+
+
+def get_gtfsrt_poll_configs():
+    """
+    :return: polling configs of all active GTFS-RT contributors.
+    The db is only requested if contributors changed since last call (or if cache is too old,
+    to catch changes made outside of the API).
+    """
+    version = get_contributors_version()
+    now = time.time()
+    cache = _poll_configs_cache
+    if (
+        cache["loaded_at"] is None
+        or version != cache["version"]
+        or now - cache["loaded_at"] > app.config[str("GTFS_RT_CONTRIBUTORS_RELOAD_INTERVAL")]
+    ):
+        cache["configs"] = [_make_poll_config(c) for c in get_gtfsrt_contributors()]
+        cache["version"] = version
+        cache["loaded_at"] = now
+    return cache["configs"]
+
+
+def pop_due_poll_configs(configs):
+    """
+    Find the contributors that are due for polling, and schedule their next polling.
+    The schedule is a priority queue of the next due time for each contributor (a redis sorted-set,
+    shared by all workers).
+    New contributors are due immediately, removed ones are dropped from the schedule.
+    :return: list of (config, lag) of due contributors, lag being the delay (seconds) between
+    due time and now
+    """
+    schedule_key = app.config[str("GTFS_RT_POLL_SCHEDULE_KEY")]
+    now = time.time()
+    schedule = {
+        (member.decode("utf-8") if isinstance(member, six.binary_type) else member): due_at
+        for member, due_at in redis_client.zrange(schedule_key, 0, -1, withscores=True)
+    }
+    configs_by_id = {config["contributor"]: config for config in configs}
+
+    pipe = redis_client.pipeline()
+    removed = [c_id for c_id in schedule if c_id not in configs_by_id]
+    if removed:
+        pipe.zrem(schedule_key, *removed)
+
+    due_configs = []
+    for c_id, config in six.iteritems(configs_by_id):
+        interval = config.get("retrieval_interval") or DEFAULT_RETRIEVAL_INTERVAL
+        due_at = schedule.get(c_id, now)
+        if due_at > now + interval:
+            # retrieval_interval was shortened: don't wait for the previous (longer) interval
+            due_at = now + interval
+            pipe.zadd(schedule_key, c_id, due_at)
+        if due_at > now:
+            continue
+        next_due_at = due_at + interval
+        if next_due_at <= now:
+            # too late to catch up with the schedule: restart it from now (avoids bursts)
+            next_due_at = now + interval
+        pipe.zadd(schedule_key, c_id, next_due_at)
+        due_configs.append((config, now - due_at))
+    pipe.execute()
+
+    for config, lag in due_configs:
+        record_poll_schedule(contributor=config["contributor"], lag=lag)
+    return due_configs
@@ -30,12 +30,14 @@
 # www.navitia.io
 
 from __future__ import absolute_import, print_function, unicode_literals, division
+import hashlib
 import logging
 from datetime import datetime
 
 import requests
 import six
 
+from kirin import http_client
 from kirin.core import model
 from kirin.core.build_wrapper import wrap_build
 from kirin.core.types import ConnectorType
@@ -49,6 +51,8 @@ from kirin.utils import (
     manage_db_error,
     manage_db_no_new,
     build_redis_etag_key,
+    build_redis_last_modified_key,
+    build_redis_content_hash_key,
     record_input_retrieval,
     make_kirin_last_call_dt_name,
 )
@@ -66,26 +70,63 @@ class InvalidFeed(Exception):
     pass
 
 
-def _is_newer(config):
+def _build_conditional_headers(contributor):
+    """
+    Build the headers of a conditional GET, using validators (ETag, Last-Modified)
+    received with the previous feed of the contributor
+    """
+    headers = {}
+    try:
+        etag, last_modified = redis_client.mget(
+            [build_redis_etag_key(contributor), build_redis_last_modified_key(contributor)]
+        )
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    except Exception as e:
+        logging.getLogger(__name__).debug(
+            "exception occurred when building conditional headers for %s: %s",
+            contributor,
+            six.text_type(e),
+            extra={str("contributor"): contributor},
+        )
+    return headers  # whatever the exception is, we don't want to break the polling
+
+
+def _is_newer(config, response):
+    """
+    Check if the feed retrieved is different from the previous one, and remember it for next polling.
+    Validators (ETag, then Last-Modified) are compared when provided by the server,
+    otherwise fall back on comparing a hash of the content.
+    """
     logger = logging.LoggerAdapter(
         logging.getLogger(__name__), extra={str("contributor"): config["contributor"]}
     )
     contributor = config["contributor"]
     try:
-        head = requests.head(config["feed_url"], timeout=config.get("timeout", 1))
-
-        new_etag = head.headers.get("ETag")
-        if not new_etag:
-            return True  # unable to get a ETag, we continue the polling
-
-        etag_key = build_redis_etag_key(contributor)
-        old_etag = redis_client.get(etag_key)
+        new_etag = response.headers.get("ETag")
+        new_last_modified = response.headers.get("Last-Modified")
+        if new_etag:
+            key, new_value = build_redis_etag_key(contributor), new_etag
+        elif new_last_modified:
+            key, new_value = build_redis_last_modified_key(contributor), new_last_modified
+        else:
+            key, new_value = (
+                build_redis_content_hash_key(contributor),
+                hashlib.sha1(response.content).hexdigest(),
+            )
 
-        if new_etag == old_etag:
-            logger.info("get the same ETag of %s, skipping the polling for %s", etag_key, contributor)
+        old_value = redis_client.get(key)
+        if new_value == old_value:
+            logger.info("get the same %s of %s, skipping the polling for %s", key, new_value, contributor)
             return False
 
-        redis_client.set(etag_key, new_etag)
+        pipe = redis_client.pipeline()
+        pipe.set(key, new_value)
+        if new_etag and new_last_modified:
+            pipe.set(build_redis_last_modified_key(contributor), new_last_modified)
+        pipe.execute()
 
     except Exception as e:
         logger.debug(
@@ -117,15 +158,34 @@ def _is_last_call_too_recent(func_name, contributor, minimal_call_interval):
 @new_relic.agent.function_trace()  # trace it specifically in transaction times
 def _retrieve_gtfsrt(config):
     start_dt = datetime.utcnow()
-    resp = requests.get(config["feed_url"], timeout=config.get("timeout", 1))
+    resp = http_client.get(
+        config["feed_url"],
+        headers=_build_conditional_headers(config["contributor"]),
+        timeout=config.get("timeout", 1),
+    )
     duration_ms = (datetime.utcnow() - start_dt).total_seconds() * 1000
-    record_input_retrieval(contributor=config["contributor"], duration_ms=duration_ms)
+    record_input_retrieval(
+        contributor=config["contributor"],
+        duration_ms=duration_ms,
+        size=len(resp.content),
+        status_code=resp.status_code,
+        not_modified=resp.status_code == requests.codes.not_modified,
+    )
     return resp
 
 
 @celery.task(bind=True)  # type: ignore
 @retry(stop_max_delay=TASK_STOP_MAX_DELAY, wait_fixed=TASK_WAIT_FIXED, retry_on_exception=should_retry_exception)
 def gtfs_poller(self, config):
+    poll_gtfsrt(config)
+
+
+def poll_gtfsrt(config, processing_slot=None):
+    """
+    Retrieve the feed of a GTFS-RT contributor and process it if it's new
+    :param processing_slot: optional context-manager (ex: semaphore) held during the processing of the feed,
+    to bound the number of feeds processed at the same time
+    """
     func_name = "gtfs_poller"
     contributor = (
         model.Contributor.query_existing()
@@ -142,21 +202,20 @@ def gtfs_poller(self, config):
             return
 
         retrieval_interval = config.get("retrieval_interval", 10)
-        if _is_last_call_too_recent(func_name, contributor.id, retrieval_interval):
+        # the poll scheduler already guarantees the interval between 2 pollings
+        if not config.get("is_scheduled") and _is_last_call_too_recent(
+            func_name, contributor.id, retrieval_interval
+        ):
             # do nothing if the last call is too recent
             new_relic.ignore_transaction()
             return
 
         logger.debug("polling of %s", config.get("feed_url"))
 
-        # We do a HEAD request at the very beginning of polling and we compare it with the previous one to check if
-        # the gtfs-rt is changed.
-        # If the HEAD request or Redis get/set fail, we just ignore this part and do the polling anyway
-        if not _is_newer(config):
-            new_relic.ignore_transaction()
-            manage_db_no_new(connector_type=ConnectorType.gtfs_rt.value, contributor_id=contributor.id)
-            return
-
+        # We do a conditional GET using validators (ETag, Last-Modified) from previous polling:
+        # a "304 Not Modified" answer means there is no new data.
+        # If the server doesn't support validators, the content is compared to the previous one.
+        # If Redis get/set fail, we just ignore this part and process the feed anyway
         try:
             response = _retrieve_gtfsrt(config)
             response.raise_for_status()
@@ -171,5 +230,14 @@ def gtfs_poller(self, config):
             logger.debug(six.text_type(e))
             return
 
-        wrap_build(KirinModelBuilder(contributor), response.content)
+        if response.status_code == requests.codes.not_modified or not _is_newer(config, response):
+            new_relic.ignore_transaction()
+            manage_db_no_new(connector_type=ConnectorType.gtfs_rt.value, contributor_id=contributor.id)
+            return
+
+        if processing_slot is None:
+            wrap_build(KirinModelBuilder(contributor), response.content)
+        else:
+            with processing_slot:
+                wrap_build(KirinModelBuilder(contributor), response.content)
         logger.info("%s for %s is finished", func_name, contributor.id)
@@ -0,0 +1,133 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import collections
+import datetime
+import logging
+import threading
+import time
+
+import gevent
+
+import kirin
+from kirin.utils import can_connect_to_navitia, can_connect_to_database
+
+# Dependencies are probed in background every HEALTH_SAMPLING_INTERVAL seconds, so that /health and /status
+# answer from the last samples instead of probing on each call (load-balancers call /health very often).
+
+PROBES = [
+    ("navitia", can_connect_to_navitia),
+    ("database", can_connect_to_database),
+    ("rabbitmq", lambda: kirin.rmq_handler.info()),
+]
+
+
+class HealthSampler(object):
+    def __init__(self, interval, history_size):
+        """
+        :param interval: time (seconds) between 2 samplings, 0 to probe dependencies on each call
+        :param history_size: nb of previous samples kept for each dependency
+        """
+        self.interval = interval
+        self.history = {name: collections.deque(maxlen=history_size) for name, _ in PROBES}
+        self.samples = {}
+        self.last_sampling = None
+        self.started = False
+
+    def sample(self):
+        from kirin import app
+
+        with app.app_context():
+            for name, probe in PROBES:
+                start = time.time()
+                try:
+                    value = probe()
+                except Exception:
+                    value = None
+                sample = {
+                    "ok": bool(value),
+                    "sampled_at": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    "duration": time.time() - start,
+                }
+                self.history[name].append(sample)
+                self.samples[name] = dict(sample, value=value)
+        self.last_sampling = time.time()
+
+    def _loop(self):
+        while True:
+            try:
+                self.sample()
+            except Exception:
+                logging.getLogger(__name__).exception("exception while sampling health")
+            time.sleep(self.interval)
+
+    def start(self):
+        from kirin import app
+
+        if self.started or self.interval <= 0:
+            return
+        self.started = True
+        if app.config[str("USE_GEVENT")]:
+            gevent.spawn(self._loop)  # time.sleep() is cooperative then (monkey-patched)
+        else:
+            thread = threading.Thread(target=self._loop, name=str("health_sampler"))
+            thread.daemon = True
+            thread.start()
+
+    def get_samples(self):
+        """
+        :return: last sample of each dependency (probed now if sampling is disabled or late)
+        """
+        self.start()
+        if self.last_sampling is None or time.time() - self.last_sampling > 2 * self.interval:
+            self.sample()
+        return self.samples
+
+    def get_history(self):
+        """
+        :return: previous samples (without values) of each dependency, oldest first
+        """
+        return {name: list(history) for name, history in self.history.items()}
+
+
+_health_sampler = None
+
+
+def get_health_sampler():
+    from kirin import app
+
+    global _health_sampler
+    if _health_sampler is None:
+        _health_sampler = HealthSampler(
+            app.config[str("HEALTH_SAMPLING_INTERVAL")], app.config[str("HEALTH_SAMPLING_HISTORY_SIZE")]
+        )
+    return _health_sampler
@@ -0,0 +1,200 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from requests.adapters import HTTPAdapter
+from six.moves.urllib.parse import urlparse
+from urllib3 import connection, connectionpool
+from urllib3.util.retry import Retry
+
+from kirin import new_relic
+
+# Shared HTTP sessions used to call external services (GTFS-RT feeds, Navitia, COTS sub-services).
+# One session is kept per process and per host, so that successive calls to a host reuse an already
+# established (keep-alive) connection instead of paying a new TCP/TLS handshake each time.
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+_call_context = threading.local()  # handshakes done during the current call (thread/greenlet local)
+_host_stats = defaultdict(lambda: {"requests": 0, "new_connections": 0, "handshake_duration": 0.0})
+
+
+class _TimedConnectionMixin(object):
+    """
+    Record the duration of each connection establishment (TCP connection and TLS handshake)
+    """
+
+    def connect(self):
+        start = time.time()
+        super(_TimedConnectionMixin, self).connect()
+        handshakes = getattr(_call_context, "handshakes", None)
+        if handshakes is not None:
+            handshakes.append(time.time() - start)
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, connection.HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, connection.HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super(_KeepAliveAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+def _make_session():
+    from kirin import app
+
+    retries = Retry(
+        total=app.config[str("HTTP_MAX_RETRIES")],
+        # never retry once the request is sent: timeouts are short and POST is not idempotent
+        read=0,
+        status_forcelist=(502, 503, 504),  # only applied to idempotent methods (GET, HEAD...)
+        backoff_factor=app.config[str("HTTP_RETRY_BACKOFF_FACTOR")],
+        raise_on_status=False,
+    )
+    adapter = _KeepAliveAdapter(
+        pool_connections=1, pool_maxsize=app.config[str("HTTP_POOL_MAXSIZE")], max_retries=retries
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    return session
+
+
+def get_session(url):
+    """
+    :return: the session (and its pool of keep-alive connections) dedicated to the host of the url
+    """
+    global _sessions_pid
+    scheme, netloc = urlparse(url)[:2]
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            # never share connections with a parent process (celery forks its workers)
+            _sessions.clear()
+            _host_stats.clear()
+            _sessions_pid = os.getpid()
+        session = _sessions.get((scheme, netloc))
+        if session is None:
+            session = _sessions[(scheme, netloc)] = _make_session()
+        return session
+
+
+def _record_http_call(host, method, duration, handshakes, failed):
+    if not failed:  # a failed connection is neither new nor reused
+        stats = _host_stats[host]
+        stats["requests"] += 1
+        stats["new_connections"] += len(handshakes)
+        stats["handshake_duration"] += sum(handshakes)
+
+    params = {
+        "host": host,
+        "method": method,
+        "duration": duration * 1000,
+        "failed": failed,
+        "connection_reused": not failed and not handshakes,
+        "handshake_duration": sum(handshakes) * 1000,
+    }
+    logging.getLogger(__name__).debug("HTTP call", extra=params)
+    new_relic.record_custom_event("kirin_http_call", params)
+
+
+def request(method, url, **kwargs):
+    """
+    Same as requests.request(), using the shared session of the host of the url
+    """
+    session = get_session(url)
+    _call_context.handshakes = []
+    start = time.time()
+    failed = True
+    try:
+        response = session.request(method, url, **kwargs)
+        failed = False
+        return response
+    finally:
+        handshakes, _call_context.handshakes = _call_context.handshakes, None
+        _record_http_call(urlparse(url).netloc, method, time.time() - start, handshakes, failed)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def head(url, **kwargs):
+    kwargs.setdefault("allow_redirects", False)
+    return request("HEAD", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def get_http_pool_status():
+    """
+    :return: for each host called by the current process, the number of requests and of new connections,
+    the connection reuse ratio and the average handshake duration (ms)
+    """
+    status = {}
+    for host, stats in _host_stats.items():
+        requests_count, new_connections = stats["requests"], stats["new_connections"]
+        status[host] = {
+            "requests": requests_count,
+            "new_connections": new_connections,
+            "reuse_ratio": 1 - min(new_connections, requests_count) / requests_count if requests_count else None,
+            "handshake_duration_avg": stats["handshake_duration"] * 1000 / new_connections
+            if new_connections
+            else None,
+        }
+    return status
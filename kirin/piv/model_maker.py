@@ -52,7 +52,15 @@ from kirin.core.types import (
     StopTimeEvent,
 )
 from kirin.exceptions import InvalidArguments, UnsupportedValue, ObjectNotFound
-from kirin.utils import make_rt_update, get_value, as_utc_naive_dt, record_internal_failure, as_duration
+from kirin.utils import (
+    make_rt_update,
+    get_value,
+    as_utc_naive_dt,
+    record_internal_failure,
+    as_duration,
+    attach_json,
+    get_rtu_json,
+)
 
 # The default company for PIV is SNCF (code '1187')
 DEFAULT_COMPANY_CODE = "1187"
@@ -227,6 +235,22 @@ def _check_stop_time_consistency(previous_rt_stop_time_dep, current_rt_stop_time
         raise InvalidArguments("invalid feed: stop_point's({}) time is not consistent".format(uic8))
 
 
+def get_piv_key(json_train):
+    """
+    :return: the key identifying the train of a PIV feed (date, number, company and mode)
+    """
+    train_date = get_value(json_train, "dateCirculation")
+    train_numbers = get_value(json_train, "numero")
+    train_company = get_value(get_value(json_train, "operateur"), "codeOperateur")
+    mode_dict = get_value(json_train, "modeTransport")
+    train_mode = get_value(mode_dict, "codeMode")
+    train_submode = get_value(mode_dict, "codeSousMode")
+    train_typemode = get_value(mode_dict, "typeMode")
+    return "{d}:{n}:{c}:{m}:{s}:{t}".format(
+        d=train_date, n=train_numbers, c=train_company, m=train_mode, s=train_submode, t=train_typemode
+    )
+
+
 def _get_message(arret):
     arrival_stop = get_value(arret, "arrivee", nullable=True)
     departure_stop = get_value(arret, "depart", nullable=True)
@@ -250,20 +274,18 @@ class KirinModelBuilder(AbstractKirinModelBuilder):
         rt_update = make_rt_update(
             input_raw, connector_type=self.contributor.connector_type, contributor_id=self.contributor.id
         )
+        attach_json(rt_update, input_raw)
         log_dict = {}
         return rt_update, log_dict
 
     def build_trip_updates(self, rt_update):
         """
-        parse the PIV raw json stored in the rt_update object (in Kirin db)
+        interpret the PIV json attached to the rt_update object (parsed once when received)
         and return a list of trip updates
 
         The TripUpdates are not associated with the RealTimeUpdate at this point
         """
-        try:
-            json = ujson.loads(rt_update.raw_data)
-        except ValueError as e:
-            raise InvalidArguments("invalid json: {}".format(e.message))
+        json = get_rtu_json(rt_update)
 
         dict_objects = get_value(json, "objects")
         json_train = get_value(dict_objects[0], "object")  # TODO: can we get more than 1 relevant in objects[]?
@@ -273,7 +295,7 @@ class KirinModelBuilder(AbstractKirinModelBuilder):
         if not piv_disruptions and not plan_transport_source:
             raise InvalidArguments('No object "evenement" or "planTransportSource" available in feed provided')
 
-        higher_trip_disruption = ujson.loads('{"type": "UNDEFINED", "texte": ""}')
+        higher_trip_disruption = {"type": "UNDEFINED", "texte": ""}
         if piv_disruptions:
             for piv_disruption in piv_disruptions:
                 piv_disruption_type = get_value(piv_disruption, "type", nullable=True)
@@ -292,21 +314,12 @@ class KirinModelBuilder(AbstractKirinModelBuilder):
                 raise UnsupportedValue("None of the disruption-types {} are supported".format(piv_disruptions))
         elif plan_transport_source:
             if plan_transport_source in ["PTP", "OPE"]:
-                higher_trip_disruption = ujson.loads('{"type": "CREATION", "texte": ""}')
+                higher_trip_disruption = {"type": "CREATION", "texte": ""}
             else:
                 raise UnsupportedValue("planTransportSource {} is not supported".format(plan_transport_source))
 
         json_train["evenement"] = higher_trip_disruption
-        train_date = get_value(json_train, "dateCirculation")
-        train_numbers = get_value(json_train, "numero")
-        train_company = get_value(get_value(json_train, "operateur"), "codeOperateur")
-        mode_dict = get_value(json_train, "modeTransport")
-        train_mode = get_value(mode_dict, "codeMode")
-        train_submode = get_value(mode_dict, "codeSousMode")
-        train_typemode = get_value(mode_dict, "typeMode")
-        piv_key = "{d}:{n}:{c}:{m}:{s}:{t}".format(
-            d=train_date, n=train_numbers, c=train_company, m=train_mode, s=train_submode, t=train_typemode
-        )
+        piv_key = get_piv_key(json_train)
 
         list_ads = get_value(json_train, "listeArretsDesserte")
         ads = _retrieve_interesting_stops(get_value(list_ads, "arret"))
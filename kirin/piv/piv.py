@@ -31,15 +31,19 @@
 
 from __future__ import absolute_import, print_function, unicode_literals, division
 import flask
+import six
 from flask import url_for
 from flask.globals import current_app
 from flask_restful import Resource, marshal, abort
 
-from kirin.core.build_wrapper import wrap_build
+from kirin.core.build_wrapper import wrap_build, wrap_build_batch, enqueue_build
 from kirin.exceptions import InvalidArguments
 from kirin.core import model
 from kirin.core.types import ConnectorType
 from kirin.piv import KirinModelBuilder
+from kirin.piv.sharding import coalesce_messages
+from kirin.resources.real_time_updates import accepted_response
+from kirin.utils import parse_json_input
 
 
 def get_piv_contributors(include_deactivated=False):
@@ -77,18 +81,71 @@ class PivIndex(Resource):
         return response, 200
 
 
+def _find_piv_contributor(id):
+    if id is None:
+        abort(400, message="Contributor's id is missing")
+
+    contributor = (
+        model.Contributor.query_existing().filter_by(id=id, connector_type=ConnectorType.piv.value).first()
+    )
+    if not contributor:
+        abort(404, message="Contributor '{}' not found".format(id))
+    return contributor
+
+
+def _get_bulk_result(index, rt_update):
+    result = {"line": index + 1}
+    if rt_update is None:
+        result["status"] = "KO"
+    else:
+        result.update({"status": rt_update.status, "real_time_update_id": rt_update.id})
+        if rt_update.error:
+            result["error"] = rt_update.error
+    return result
+
+
 class Piv(Resource):
     def post(self, id=None):
-        if id is None:
-            abort(400, message="Contributor's id is missing")
-
-        contributor = (
-            model.Contributor.query_existing().filter_by(id=id, connector_type=ConnectorType.piv.value).first()
-        )
-        if not contributor:
-            abort(404, message="Contributor '{}' not found".format(id))
+        contributor = _find_piv_contributor(id)
 
         raw_json = _get_piv(flask.globals.request)
 
+        if current_app.config[str("ASYNC_INGESTION")]:
+            rt_update = enqueue_build(KirinModelBuilder(contributor), raw_json)
+            return accepted_response("PIV feed accepted", rt_update)
+
         wrap_build(KirinModelBuilder(contributor), raw_json)
         return {"message": "PIV feed processed"}, 200
+
+
+class PivBulk(Resource):
+    def post(self, id=None):
+        """
+        Process a backlog of PIV messages (one json message per line), in order:
+        only the last message of each train is processed, by batches of PIV_BULK_BATCH_SIZE messages
+        (each batch being persisted in db and published for Navitia at once)
+        """
+        contributor = _find_piv_contributor(id)
+
+        lines = _get_piv(flask.globals.request).splitlines()
+        # each message is parsed once for all: used to coalesce messages, then by the builder
+        messages = [(parse_json_input(line), index) for index, line in enumerate(lines) if line.strip()]
+        if not messages:
+            raise InvalidArguments("no piv data provided")
+
+        results = {index: {"line": index + 1, "status": "coalesced"} for _, index in messages}
+        kept_messages = coalesce_messages(messages)
+        builder = KirinModelBuilder(contributor)
+        batch_size = current_app.config[str("PIV_BULK_BATCH_SIZE")]
+        for start in range(0, len(kept_messages), batch_size):
+            batch = kept_messages[start : start + batch_size]
+            try:
+                rt_updates = wrap_build_batch(builder, [body for body, _ in batch])
+                for (_, index), rt_update in zip(batch, rt_updates):
+                    results[index] = _get_bulk_result(index, rt_update)
+            except Exception as e:
+                # already logged, the whole batch failed
+                for _, index in batch:
+                    results[index] = {"line": index + 1, "status": "KO", "error": six.text_type(e)}
+
+        return {"message": "PIV bulk processed", "results": [results[index] for _, index in messages]}, 200
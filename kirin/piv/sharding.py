@@ -0,0 +1,116 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import hashlib
+
+import six
+import ujson
+from kombu import Exchange, Queue
+
+from kirin.piv.model_maker import get_piv_key
+from kirin.utils import JsonInput
+
+# header of the barrier messages sent by the PIV router to shard queues (see piv_router)
+SHARD_BARRIER_HEADER = "x-kirin-shard-barrier"
+
+
+def get_train_key(body):
+    """
+    :param body: the PIV message, raw or already parsed (JsonInput, not parsed again)
+    :return: the PIV key of the train concerned by a PIV message (None if not found)
+    """
+    try:
+        json_data = body.json_data if isinstance(body, JsonInput) else ujson.loads(body)
+        return get_piv_key(json_data["objects"][0]["object"])
+    except Exception:
+        return None  # the processing of the message will report the problem
+
+
+def coalesce_messages(messages):
+    """
+    Keep only the last message for each train ("Last PIV information is always right"),
+    messages not related to a known train are all kept
+    :param messages: list of (body, message) in reception order
+    :return: list of (body, message) to process, in reception order
+    """
+    last_index_by_key = {}
+    for index, (body, _) in enumerate(messages):
+        key = get_train_key(body)
+        last_index_by_key[key if key is not None else index] = index
+    kept_indexes = set(last_index_by_key.values())
+    return [m for index, m in enumerate(messages) if index in kept_indexes]
+
+
+def jump_consistent_hash(key, bucket_count):
+    """
+    Jump consistent hash (Lamping & Veach): when the nb of buckets changes from n to n+1,
+    only 1/(n+1) of the keys move (all to the new bucket)
+    :return: the bucket of the key, in [0, bucket_count)
+    """
+    h = int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+    b, j = -1, 0
+    while j < bucket_count:
+        b = j
+        h = (h * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((h >> 33) + 1)))
+    return b
+
+
+def get_shard(train_key, shard_count):
+    """
+    :return: the shard handling the messages of a train (messages without train all go to the first shard)
+    """
+    if train_key is None:
+        return 0
+    return jump_consistent_hash(train_key, shard_count)
+
+
+def get_shard_barrier(message):
+    """
+    :return: the id of the barrier if the message is a barrier sent by the PIV router (None otherwise)
+    """
+    return (message.headers or {}).get(SHARD_BARRIER_HEADER)
+
+
+def get_shard_exchange(queue_name):
+    return Exchange(name="{}.shards".format(queue_name), type="direct", durable=True, auto_delete=False)
+
+
+def get_shard_queue(queue_name, shard):
+    return Queue(
+        name="{}.shard.{}".format(queue_name, shard),
+        exchange=get_shard_exchange(queue_name),
+        routing_key=six.text_type(shard),
+        durable=True,
+        auto_delete=False,
+    )
@@ -0,0 +1,143 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import cProfile
+import datetime
+import logging
+import os
+import random
+import time
+
+from redis.exceptions import RedisError
+
+from kirin.utils import build_redis_profiling_key
+
+# The processing of the feeds of a contributor can be profiled in production: while a sample rate N is set
+# for a contributor (see /contributors/<id>/profiling), 1 in N executions of wrap_build() is run under cProfile
+# and its statistics are written in PROFILING_DIR (to be read with pstats, snakeviz...).
+# The sample rate is cached by each process for PROFILING_CACHE_TIMEOUT seconds, so that feeds are not slowed down
+# by a call to redis when no profiling is set.
+# Note: cProfile profiles the whole thread, so with gevent (USE_GEVENT) greenlets running meanwhile in the same
+# process (other feeds polled) are profiled too. Only one execution is profiled at a time in a process (a second
+# profiler would replace the hook of the first one).
+
+# contributor_id -> (sample rate, time of expiration)
+_sample_rates = {}
+_profiler_running = False
+
+
+def set_profiling(contributor_id, sample_rate, duration):
+    """
+    Profile 1 in sample_rate executions of wrap_build() for the contributor, during duration (seconds)
+    """
+    from kirin import redis_client
+
+    redis_client.set(build_redis_profiling_key(contributor_id), sample_rate, ex=duration)
+    _sample_rates.pop(contributor_id, None)
+
+
+def stop_profiling(contributor_id):
+    from kirin import redis_client
+
+    redis_client.delete(build_redis_profiling_key(contributor_id))
+    _sample_rates.pop(contributor_id, None)
+
+
+def get_profiling(contributor_id):
+    """
+    :return: the sample rate of the profiling of the contributor (None if not profiled) and its remaining time
+    """
+    from kirin import redis_client
+
+    pipe = redis_client.pipeline()
+    pipe.get(build_redis_profiling_key(contributor_id))
+    pipe.ttl(build_redis_profiling_key(contributor_id))
+    sample_rate, ttl = pipe.execute()
+    if sample_rate is None:
+        return None, None
+    return int(sample_rate), ttl
+
+
+def _get_sample_rate(contributor_id):
+    from kirin import app, redis_client
+
+    sample_rate, expiration = _sample_rates.get(contributor_id, (None, 0))
+    if time.time() < expiration:
+        return sample_rate
+    try:
+        sample_rate = redis_client.get(build_redis_profiling_key(contributor_id))
+        sample_rate = int(sample_rate) if sample_rate is not None else None
+    except RedisError:
+        # never break the processing for profiling
+        logging.getLogger(__name__).exception("Exception with redis while getting profiling")
+        sample_rate = None
+    _sample_rates[contributor_id] = (sample_rate, time.time() + app.config[str("PROFILING_CACHE_TIMEOUT")])
+    return sample_rate
+
+
+def start_sampled_profiler(contributor_id):
+    """
+    :return: a started profiler if this execution is sampled for profiling (None otherwise)
+    """
+    global _profiler_running
+    sample_rate = _get_sample_rate(contributor_id)
+    if not sample_rate or _profiler_running or random.randint(1, sample_rate) != 1:
+        return None
+    _profiler_running = True
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def dump_profiler(profiler, contributor_id, rt_update_id):
+    """
+    Stop the profiler and write its statistics in <PROFILING_DIR>/<contributor>/<datetime>_<rt_update_id>.pstats
+    """
+    from kirin import app
+
+    global _profiler_running
+    profiler.disable()
+    _profiler_running = False
+    directory = os.path.join(app.config[str("PROFILING_DIR")], contributor_id)
+    file_name = "{}_{}.pstats".format(datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S"), rt_update_id)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        profiler.dump_stats(os.path.join(directory, file_name))
+    except (IOError, OSError):
+        logging.getLogger(__name__).exception(
+            "impossible to write profile %s", file_name, extra={str("contributor"): contributor_id}
+        )
+        return
+    logging.getLogger(__name__).info(
+        "profile written in %s", os.path.join(directory, file_name), extra={str("contributor"): contributor_id}
+    )
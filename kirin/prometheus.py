@@ -0,0 +1,137 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    logging.getLogger(__name__).warning("prometheus_client is not available, no metrics will be provided")
+    prometheus_client = None
+
+# Metrics are provided on /metrics by the webservice.
+# To also get the metrics of other processes (Kirin-workers, PIV-workers...) running on the same host,
+# all processes must share a directory set in the "prometheus_multiproc_dir" environment variable.
+
+LABELS = ["contributor", "connector"]
+
+if prometheus_client:
+    STAGE_DURATION = prometheus_client.Histogram(
+        "kirin_stage_duration_seconds", "Duration of each stage of the processing of a feed", ["stage"] + LABELS
+    )
+    NAVITIA_CALL_DURATION = prometheus_client.Histogram(
+        "kirin_navitia_call_duration_seconds", "Duration of calls to Navitia by type", ["call"] + LABELS
+    )
+    TRIP_UPDATES = prometheus_client.Counter(
+        "kirin_trip_updates_total",
+        "TripUpdates merged (or skipped if inconsistent or unchanged)",
+        ["result"] + LABELS,
+    )
+    FEED_SIZE = prometheus_client.Histogram(
+        "kirin_feed_size_bytes",
+        "Size of the feeds received and published",
+        ["feed"] + LABELS,
+        buckets=(1e3, 1e4, 1e5, 1e6, 1e7, float("inf")),
+    )
+
+
+@contextmanager
+def observe_stage(stage, contributor):
+    """
+    Measure the duration of a stage of the processing of a feed
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        if prometheus_client:
+            STAGE_DURATION.labels(stage, contributor.id, contributor.connector_type).observe(time.time() - start)
+
+
+def record_trip_updates(contributor, nb_merged, nb_skipped):
+    if prometheus_client:
+        TRIP_UPDATES.labels("merged", contributor.id, contributor.connector_type).inc(nb_merged)
+        TRIP_UPDATES.labels("skipped", contributor.id, contributor.connector_type).inc(nb_skipped)
+
+
+def record_feed_size(feed, contributor, data):
+    """
+    :param feed: "received" or "published"
+    """
+    if prometheus_client and data is not None:
+        FEED_SIZE.labels(feed, contributor.id, contributor.connector_type).observe(len(data))
+
+
+class _InstrumentedNavitia(object):
+    """
+    Wrap a navitia_wrapper instance to measure the duration of each type of call
+    """
+
+    def __init__(self, navitia, contributor):
+        self._navitia = navitia
+        self._contributor = contributor
+
+    def __getattr__(self, name):
+        attr = getattr(self._navitia, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            start = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                NAVITIA_CALL_DURATION.labels(
+                    name, self._contributor.id, self._contributor.connector_type
+                ).observe(time.time() - start)
+
+        return call
+
+
+def instrument_navitia(navitia, contributor):
+    return _InstrumentedNavitia(navitia, contributor) if prometheus_client else navitia
+
+
+def generate_metrics():
+    """
+    :return: the metrics (of all processes sharing "prometheus_multiproc_dir" if set) and their content-type
+    """
+    if "prometheus_multiproc_dir" in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
@@ -40,7 +40,7 @@ from retrying import retry
 from kirin import task_pb2, gtfs_realtime_pb2
 from google.protobuf.message import DecodeError
 import socket
-from kirin.core.model import TripUpdate, db
+from kirin.core.model import TripUpdate, db, read_from_replica
 from kirin.core.populate_pb import convert_to_gtfsrt
 from kirin.utils import str_to_date, record_call
 from datetime import datetime
@@ -96,10 +96,11 @@ class RTReloader(ConsumerProducerMixin):
             if hasattr(task.load_realtime, "end_date"):
                 if task.load_realtime.end_date:
                     end_date = str_to_date(task.load_realtime.end_date)
-            feed = convert_to_gtfsrt(
-                TripUpdate.find_by_contributor_period(task.load_realtime.contributors, begin_date, end_date),
-                gtfs_realtime_pb2.FeedHeader.FULL_DATASET,
-            )
+            with read_from_replica():
+                feed = convert_to_gtfsrt(
+                    TripUpdate.find_by_contributor_period(task.load_realtime.contributors, begin_date, end_date),
+                    gtfs_realtime_pb2.FeedHeader.FULL_DATASET,
+                )
 
             feed_str = feed.SerializeToString()
             log.info(
@@ -32,5 +32,8 @@
 from __future__ import absolute_import, print_function, unicode_literals, division
 from kirin.resources.index import Index
 from kirin.resources.status import Status
-from kirin.resources.contributors import Contributors
+from kirin.resources.contributors import Contributors, ContributorProfiling
 from kirin.resources.health import Health
+from kirin.resources.real_time_updates import RealTimeUpdates
+from kirin.resources.gtfs_rt_feed import GtfsRTFeed
+from kirin.resources.metrics import Metrics
@@ -36,7 +36,8 @@ import sqlalchemy
 from flask_restful import Resource, marshal_with, fields, abort
 from kirin.core import model
 from kirin.core.types import ConnectorType
-from kirin.utils import db_commit
+from kirin.profiling import get_profiling, set_profiling, stop_profiling
+from kirin.utils import db_commit, bump_contributors_version
 
 contributor_fields = {
     "id": fields.String,
@@ -93,7 +94,8 @@ class Contributors(Resource):
             contrib = model.Contributor.query.get_or_404(id)
             return {"contributors": [contrib]}
 
-        return {"contributors": model.Contributor.query_existing().all()}
+        with model.read_from_replica():
+            return {"contributors": model.Contributor.query_existing().all()}
 
     @marshal_with(contributor_nested_fields)
     def post(self, id=None):
@@ -139,6 +141,7 @@ class Contributors(Resource):
                 nb_days_to_keep_rt_update,
             )
             db_commit(new_contrib)
+            bump_contributors_version()
             return {"contributor": new_contrib}, 201
         except KeyError as e:
             err_msg = "Missing attribute '{}' in input data to construct a contributor".format(e)
@@ -169,6 +172,7 @@ class Contributors(Resource):
 
             model.Contributor.query.filter(model.Contributor.id == id).update(data)
             model.db.session.commit()
+            bump_contributors_version()
             contributor = model.Contributor.query.get_or_404(id)
             return {"contributor": contributor}, 200
         except sqlalchemy.exc.SQLAlchemyError as e:
@@ -182,7 +186,50 @@ class Contributors(Resource):
         try:
             contributor.is_active = False
             model.db.session.commit()
+            bump_contributors_version()
         except sqlalchemy.exc.SQLAlchemyError as e:
             abort(400, message=e)
 
         return None, 204
+
+
+class ContributorProfiling(Resource):
+    """
+    Profile 1 in sample_rate processings of the contributor's feeds, for duration seconds
+    (profiles are written in PROFILING_DIR)
+    """
+
+    put_data_schema = {
+        "type": "object",
+        "properties": {
+            "sample_rate": {"type": "integer", "minimum": 1},
+            "duration": {"type": "integer", "minimum": 1},
+        },
+        "required": ["sample_rate"],
+    }
+
+    def get(self, id):
+        model.Contributor.query.get_or_404(id)
+        sample_rate, remaining_duration = get_profiling(id)
+        return {"profiling": {"sample_rate": sample_rate, "remaining_duration": remaining_duration}}, 200
+
+    def put(self, id):
+        model.Contributor.query.get_or_404(id)
+        data = flask.request.get_json()
+
+        if data is None:
+            abort(400, message="No Json data found to profile a contributor")
+
+        try:
+            jsonschema.validate(data, self.put_data_schema)
+        except jsonschema.exceptions.ValidationError as e:
+            abort(400, message="Failed to validate posted Json data. Error: {}".format(e))
+
+        duration = data.get("duration", flask.current_app.config[str("PROFILING_DEFAULT_DURATION")])
+        set_profiling(id, data["sample_rate"], duration)
+        return {"profiling": {"sample_rate": data["sample_rate"], "remaining_duration": duration}}, 200
+
+    def delete(self, id):
+        model.Contributor.query.get_or_404(id)
+        stop_profiling(id)
+        return None, 204
@@ -0,0 +1,148 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import gzip
+import hashlib
+import io
+import logging
+
+import flask
+from flask.globals import current_app
+from flask_restful import Resource, abort
+from redis.exceptions import RedisError
+
+from kirin import gtfs_realtime_pb2
+from kirin.core import model
+from kirin.core.populate_pb import convert_to_gtfsrt
+from kirin.core.realtime_versions import get_realtime_versions
+from kirin.utils import build_redis_gtfs_rt_feed_key, make_kirin_lock_name
+
+
+def _gzip(data):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode="wb", mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def _build_feed(contributor_ids):
+    """
+    :return: the current realtime of the contributors as a FULL_DATASET GTFS-RT feed (gzipped) and its ETag
+    """
+    trip_updates = model.TripUpdate.find_by_contributor_period(contributor_ids)
+    feed_str = convert_to_gtfsrt(trip_updates, gtfs_realtime_pb2.FeedHeader.FULL_DATASET).SerializeToString()
+    return _gzip(feed_str), hashlib.sha1(feed_str).hexdigest()
+
+
+def _cache_feed(key, version, data, etag):
+    from kirin import redis_client
+
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hmset(key, {"version": version, "data": data, "etag": etag})
+        pipe.expire(key, current_app.config[str("GTFS_RT_FEED_CACHE_TIMEOUT")])
+        pipe.execute()
+    except RedisError:
+        logging.getLogger(__name__).exception("Exception with redis while caching GTFS-RT feed")
+
+
+def get_gtfs_rt_feed(contributor_ids):
+    """
+    The feed is cached in redis and only rebuilt once the realtime of a contributor changed in db
+    (see bump_realtime_versions()).
+    Only one request rebuilds it at a time: meanwhile, other requests are served the previous feed.
+    :return: the FULL_DATASET GTFS-RT feed of the contributors (gzipped) and its ETag
+    """
+    from kirin import redis_client
+
+    key = build_redis_gtfs_rt_feed_key(contributor_ids)
+    lock = None
+    try:
+        version = ",".join(str(v) for v in get_realtime_versions(contributor_ids))
+        cached_version, data, etag = redis_client.hmget(key, "version", "data", "etag")
+        if cached_version is not None and cached_version.decode("utf-8") == version:
+            return data, etag.decode("utf-8")
+        lock = redis_client.lock(
+            make_kirin_lock_name(key),
+            timeout=current_app.config[str("GTFS_RT_FEED_REBUILD_LOCK_TIMEOUT")],
+        )
+        if not lock.acquire(blocking=False):
+            lock = None
+            if cached_version is not None:
+                return data, etag.decode("utf-8")  # being rebuilt by another request
+    except RedisError:
+        logging.getLogger(__name__).exception("Exception with redis while getting GTFS-RT feed")
+        return _build_feed(contributor_ids)
+
+    try:
+        # version is read before building the feed: a feed built during a change is rebuilt at next call
+        data, etag = _build_feed(contributor_ids)
+        _cache_feed(key, version, data, etag)
+        return data, etag
+    finally:
+        if lock is not None:
+            try:
+                lock.release()
+            except RedisError:
+                logging.getLogger(__name__).exception("Exception with redis while unlocking GTFS-RT feed")
+
+
+class GtfsRTFeed(Resource):
+    def get(self, id=None):
+        """
+        Current realtime of a contributor (or of the contributors requested with "contributor" parameters,
+        all of them by default) as a FULL_DATASET GTFS-RT feed.
+        Responses carry an ETag to be used for conditional requests, and are gzipped if accepted.
+        """
+        existing_ids = [c.id for c in model.Contributor.query_existing().all()]
+        if id is not None:
+            contributor_ids = [id]
+        else:
+            contributor_ids = flask.request.args.getlist("contributor") or existing_ids
+        unknown_ids = [c_id for c_id in contributor_ids if c_id not in existing_ids]
+        if unknown_ids:
+            abort(404, message="Contributor '{}' not found".format("', '".join(unknown_ids)))
+        contributor_ids = sorted(set(contributor_ids))
+
+        data, etag = get_gtfs_rt_feed(contributor_ids)
+        response = flask.Response(mimetype=str("application/x-protobuf"))
+        response.headers[str("Vary")] = str("Accept-Encoding")
+        response.headers[str("Cache-Control")] = str("no-cache")
+        if "gzip" in flask.request.accept_encodings:
+            response.data = data
+            response.headers[str("Content-Encoding")] = str("gzip")
+            # a strong ETag identifies a representation: gzipped content has its own
+            response.set_etag("{}-gzip".format(etag))
+        else:
+            response.data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+            response.set_etag(etag)
+        return response.make_conditional(flask.request)
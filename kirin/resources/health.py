@@ -31,16 +31,17 @@
 
 from __future__ import absolute_import, print_function, unicode_literals, division
 from flask_restful import Resource, abort
-from kirin.utils import can_connect_to_navitia, can_connect_to_database
+from kirin.health_sampler import get_health_sampler
 
 
 class Health(Resource):
     def get(self):
+        samples = get_health_sampler().get_samples()
         # Verify connection to navitia
-        if not can_connect_to_navitia():
+        if not samples["navitia"]["ok"]:
             abort(503, message="KO")
         # Verify connection to database
-        if not can_connect_to_database():
+        if not samples["database"]["ok"]:
             abort(503, message="KO")
 
         return {"message": "OK"}, 200
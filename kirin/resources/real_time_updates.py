@@ -0,0 +1,70 @@
+# coding=utf-8
+
+# Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import uuid
+
+from flask_restful import Resource, marshal_with, fields, abort, url_for
+from kirin.core import model
+
+real_time_update_fields = {
+    "id": fields.String,
+    "contributor_id": fields.String,
+    "connector": fields.String,
+    "status": fields.String,
+    "error": fields.String,
+    "created_at": fields.DateTime(dt_format=str("iso8601")),
+    "updated_at": fields.DateTime(dt_format=str("iso8601")),
+}
+
+real_time_update_nested_fields = {"real_time_update": fields.Nested(real_time_update_fields)}
+
+
+def accepted_response(message, rt_update):
+    """
+    Response to a feed stored to be processed asynchronously (see ASYNC_INGESTION):
+    the processing can be followed on the RealTimeUpdate's resource
+    """
+    href = url_for("real_time_updates", id=rt_update.id, _external=True)
+    return {"message": message, "real_time_update": {"id": rt_update.id, "href": href}}, 202, {"Location": href}
+
+
+class RealTimeUpdates(Resource):
+    @marshal_with(real_time_update_nested_fields)
+    def get(self, id):
+        try:
+            uuid.UUID(id)
+        except ValueError:
+            abort(404, message="RealTimeUpdate '{}' not found".format(id))
+        rt_update = model.RealTimeUpdate.query.get(id)
+        if rt_update is None:
+            abort(404, message="RealTimeUpdate '{}' not found".format(id))
+        return {"real_time_update": rt_update}
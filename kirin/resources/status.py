@@ -31,16 +31,10 @@
 
 from __future__ import absolute_import, print_function, unicode_literals, division
 from flask_restful import Resource
-import kirin
 from kirin.version import version
 from flask import current_app
-from kirin.utils import (
-    get_database_version,
-    get_database_info,
-    can_connect_to_navitia,
-    can_connect_to_database,
-    get_database_pool_status,
-)
+from kirin.health_sampler import get_health_sampler
+from kirin.utils import get_database_version, get_database_info, get_database_pool_status, get_http_pool_status
 
 
 class Status(Resource):
@@ -48,10 +42,14 @@ class Status(Resource):
         res = get_database_info()
         res["version"] = version
         res["db_pool_status"] = get_database_pool_status()
+        res["http_pool_status"] = get_http_pool_status()
         res["db_version"] = get_database_version()
         res["navitia_url"] = current_app.config[str("NAVITIA_URL")]
-        res["rabbitmq_info"] = kirin.rmq_handler.info()
-        res["navitia_connection"] = "OK" if can_connect_to_navitia() else "KO"
-        res["db_connection"] = "OK" if can_connect_to_database() else "KO"
+        health_sampler = get_health_sampler()
+        samples = health_sampler.get_samples()
+        res["rabbitmq_info"] = samples["rabbitmq"]["value"]
+        res["navitia_connection"] = "OK" if samples["navitia"]["ok"] else "KO"
+        res["db_connection"] = "OK" if samples["database"]["ok"] else "KO"
+        res["health_probes"] = health_sampler.get_history()
 
         return res, 200
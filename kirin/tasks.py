@@ -31,16 +31,28 @@
 
 from __future__ import absolute_import, print_function, unicode_literals, division
 import logging
+import calendar
 import datetime
+import time
 from celery.signals import task_postrun, setup_logging
+from sqlalchemy.exc import SQLAlchemyError
 from retrying import retry
 from kirin import app
 from kirin.core import model
-from kirin.core.model import TripUpdate, RealTimeUpdate, Contributor
+from kirin.archive import get_purge_archive
+from kirin.blob_store import get_blob_store
+from kirin.core.model import TripUpdate, RealTimeUpdate, Contributor, DEFAULT_DAYS_TO_KEEP_RT_UPDATE
+from kirin.core.build_wrapper import wrap_build_pending
+from kirin.core.realtime_versions import bump_realtime_versions
 from kirin.core.types import ConnectorType
-from kirin.gtfs_rt.gtfs_rt import get_gtfsrt_contributors
+from kirin import cots, piv
 from kirin.helper import make_celery
-from kirin.utils import should_retry_exception, make_kirin_lock_name, get_lock
+from kirin.utils import (
+    should_retry_exception,
+    make_kirin_lock_name,
+    get_lock,
+    record_purge,
+)
 
 
 TASK_STOP_MAX_DELAY = app.config[str("TASK_STOP_MAX_DELAY")]
@@ -66,23 +78,93 @@ def close_session(*args, **kwargs):
 
 
 from kirin.gtfs_rt.tasks import gtfs_poller
+from kirin.gtfs_rt.scheduler import get_gtfsrt_poll_configs, pop_due_poll_configs, DEFAULT_RETRIEVAL_INTERVAL
 
 
 @celery.task(bind=True)
 def poller(self):
-    for contributor in get_gtfsrt_contributors():
-        config = {
-            "contributor": contributor.id,
-            "navitia_url": app.config.get(str("NAVITIA_URL")),
-            "token": contributor.navitia_token,
-            "coverage": contributor.navitia_coverage,
-            "feed_url": contributor.feed_url,
-            "retrieval_interval": contributor.retrieval_interval,
-            "timeout": app.config.get(str("GTFS_RT_TIMEOUT"), 1),
-        }  # WARNING: cleanup might be done here, but be cautious when removing.
-        # Keep in mind that during deployment, workers from version n and n+1 are present
-        # (so no remove before both version stop using what's removed).
-        gtfs_poller.delay(config)
+    func_name = "poller"
+    logger = logging.getLogger(__name__)
+
+    lock_name = make_kirin_lock_name(func_name)
+    with get_lock(logger, lock_name, app.config[str("REDIS_LOCK_TIMEOUT_POLLER")]) as locked:
+        if not locked:
+            return
+        for config, lag in pop_due_poll_configs(get_gtfsrt_poll_configs()):
+            # a polling that could not start before the next one is due is useless
+            interval = config.get("retrieval_interval") or DEFAULT_RETRIEVAL_INTERVAL
+            gtfs_poller.apply_async(args=[config], expires=interval)
+
+
+# builders of the connectors accepting feeds asynchronously (see ASYNC_INGESTION)
+PENDING_RT_UPDATE_BUILDERS = {
+    ConnectorType.cots.value: cots.KirinModelBuilder,
+    ConnectorType.piv.value: piv.KirinModelBuilder,
+}
+
+
+def _retry_pending_rt_updates(task, e):
+    """
+    Retry later (exponential backoff) the processing of pending RealTimeUpdates failing in db:
+    no other task is triggered before the next feed of the contributor
+    """
+    countdown = min(2 ** task.request.retries, app.config[str("PENDING_RT_UPDATE_MAX_RETRY_DELAY")])
+    return task.retry(exc=e, countdown=countdown, max_retries=None)
+
+
+@celery.task(bind=True)
+def process_pending_rt_updates(self, contributor_id):
+    """
+    Process the feeds of the contributor stored as "pending" RealTimeUpdates (see enqueue_build()),
+    one at a time and in the order they were received: a single worker processes a contributor at once,
+    so successive feeds about the same train are applied in order.
+    """
+    try:
+        _process_pending_rt_updates(self, contributor_id)
+    except SQLAlchemyError as e:
+        # db is failing while looking for pending RealTimeUpdates
+        raise _retry_pending_rt_updates(self, e)
+
+
+def _process_pending_rt_updates(task, contributor_id):
+    func_name = "process_pending_rt_updates"
+    logger = logging.LoggerAdapter(logging.getLogger(__name__), extra={str("contributor"): contributor_id})
+    lock_name = make_kirin_lock_name(func_name, contributor_id)
+
+    while True:
+        with get_lock(logger, lock_name, app.config[str("REDIS_LOCK_TIMEOUT_POLLER")]) as lock:
+            if not lock:
+                # the worker holding the lock looks for pending RealTimeUpdates again after releasing it
+                logger.debug("%s for %s is already in progress", func_name, contributor_id)
+                return
+            contributor = Contributor.query.get(contributor_id)
+            if contributor is None:
+                logger.warning("%s: contributor %s not found", func_name, contributor_id)
+                return
+            builder = PENDING_RT_UPDATE_BUILDERS[contributor.connector_type](contributor)
+
+            while True:
+                rt_update = RealTimeUpdate.get_next_pending(contributor_id)
+                if rt_update is None:
+                    break
+                start = time.time()
+                try:
+                    wrap_build_pending(builder, rt_update)
+                except Exception as e:
+                    # already logged, and the RealTimeUpdate is set KO unless db itself is failing
+                    try:
+                        model.db.session.rollback()
+                        still_pending = rt_update.status == "pending"  # reloaded from db
+                    except Exception:
+                        still_pending = True  # db is failing
+                    if still_pending:
+                        raise _retry_pending_rt_updates(task, e)
+                # keep the lock as long as feeds are processed
+                lock.extend(time.time() - start)
+
+        # a feed may have been stored (and its task dropped) just before the lock was released
+        if RealTimeUpdate.get_next_pending(contributor_id) is None:
+            return
 
 
 @celery.task(bind=True)
@@ -94,14 +176,36 @@ def purge_trip_update(self, config):
     logger.debug("purge trip update for %s", contributor)
 
     lock_name = make_kirin_lock_name(func_name, contributor)
-    with get_lock(logger, lock_name, app.config[str("REDIS_LOCK_TIMEOUT_PURGE")]) as locked:
-        if not locked:
+    with get_lock(logger, lock_name, app.config[str("REDIS_LOCK_TIMEOUT_PURGE")]) as lock:
+        if not lock:
             logger.warning("%s for %s is already in progress", func_name, contributor)
             return
         until = datetime.date.today() - datetime.timedelta(days=int(config["nb_days_to_keep"]))
         logger.info("purge trip update for {} until {}".format(contributor, until))
 
-        TripUpdate.remove_by_contributors_and_period(contributors=[contributor], start_date=None, end_date=until)
+        def on_chunk_deleted(nb_deleted, duration):
+            # keep the lock as long as the purge is making progress
+            lock.extend(duration)
+            logger.debug("%s trip updates purged for %s in %.3fs", nb_deleted, contributor, duration)
+
+        archive = get_purge_archive()
+        nb_archived = [0]
+
+        def before_chunk_deleted(filters):
+            nb_archived[0] += archive.archive_trip_updates(filters)
+
+        start = time.time()
+        nb_deleted = TripUpdate.remove_by_contributors_and_period(
+            contributors=[contributor],
+            start_date=None,
+            end_date=until,
+            chunk_size=app.config[str("PURGE_CHUNK_SIZE")],
+            on_chunk_deleted=on_chunk_deleted,
+            before_chunk_deleted=before_chunk_deleted if archive else None,
+        )
+        if nb_deleted:
+            bump_realtime_versions([contributor])
+        record_purge(contributor, "trip_update", nb_deleted, time.time() - start, nb_archived=nb_archived[0])
         logger.info("%s for %s is finished", func_name, contributor)
 
 
@@ -115,18 +219,73 @@ def purge_rt_update(self, config):
     logger.debug("purge realtime update for %s", contributor)
 
     lock_name = make_kirin_lock_name(func_name, contributor)
-    with get_lock(logger, lock_name, app.config[str("REDIS_LOCK_TIMEOUT_PURGE")]) as locked:
-        if not locked:
+    with get_lock(logger, lock_name, app.config[str("REDIS_LOCK_TIMEOUT_PURGE")]) as lock:
+        if not lock:
             logger.warning("%s for %s is already in progress", func_name, contributor)
             return
 
         until = datetime.date.today() - datetime.timedelta(days=int(config["nb_days_to_keep"]))
         logger.info("purge realtime update for {} until {}".format(contributor, until))
 
-        RealTimeUpdate.remove_by_contributors_until(contributors=[contributor], until=until)
+        def on_chunk_deleted(nb_deleted, duration):
+            # keep the lock as long as the purge is making progress
+            lock.extend(duration)
+            logger.debug("%s realtime updates purged for %s in %.3fs", nb_deleted, contributor, duration)
+
+        archive = get_purge_archive()
+        nb_archived = [0]
+
+        def before_chunk_deleted(filters):
+            nb_archived[0] += archive.archive_rt_updates(filters)
+
+        start = time.time()
+        nb_deleted = RealTimeUpdate.remove_by_contributors_until(
+            contributors=[contributor],
+            until=until,
+            chunk_size=app.config[str("PURGE_CHUNK_SIZE")],
+            on_chunk_deleted=on_chunk_deleted,
+            before_chunk_deleted=before_chunk_deleted if archive else None,
+        )
+        record_purge(
+            contributor, "real_time_update", nb_deleted, time.time() - start, nb_archived=nb_archived[0]
+        )
         logger.info("%s for %s is finished", func_name, contributor)
 
 
+@celery.task(bind=True)
+def purge_raw_data(self):
+    """
+    This task will remove the raw data (stored outside db) that are not used anymore by any RealTimeUpdate:
+    a raw data is kept as long as the most retentive contributor keeps its RealTimeUpdates,
+    and as long as a RealTimeUpdate references it (RealTimeUpdates still used by a TripUpdate are not purged)
+    """
+    func_name = "purge_raw_data"
+    logger = logging.getLogger(__name__)
+    blob_store = get_blob_store()
+    if blob_store is None:
+        return
+
+    lock_name = make_kirin_lock_name(func_name)
+    with get_lock(logger, lock_name, app.config[str("REDIS_LOCK_TIMEOUT_PURGE")]) as lock:
+        if not lock:
+            logger.warning("%s is already in progress", func_name)
+            return
+        nb_days_to_keep = max(
+            [c.nb_days_to_keep_rt_update for c in Contributor.query.all()] or [DEFAULT_DAYS_TO_KEEP_RT_UPDATE]
+        )
+        until = datetime.date.today() - datetime.timedelta(days=nb_days_to_keep)
+        logger.info("purge raw data until {}".format(until))
+
+        start = time.time()
+        nb_deleted = blob_store.remove_older_than(
+            calendar.timegm(until.timetuple()),
+            get_used_keys=RealTimeUpdate.find_used_raw_data_hashes,
+            chunk_size=app.config[str("PURGE_CHUNK_SIZE")],
+        )
+        record_purge(None, "raw_data", nb_deleted, time.time() - start)
+        logger.info("%s is finished", func_name)
+
+
 @celery.task(bind=True)
 def purge_trip_update_by_connector_type(self, connector_type):
     """
@@ -11,3 +11,8 @@ COTS_PAR_IV_CLIENT_ID = "tchoutchou_id"
 COTS_PAR_IV_CLIENT_SECRET = "tchoutchou_secret"
 
 BROKER_CONSUMER_CONFIGURATION_RELOAD_INTERVAL = 1  # in seconds
+
+# dependencies are probed on each call of /health and /status
+HEALTH_SAMPLING_INTERVAL = 0
+# profiling of contributors is read on each feed
+PROFILING_CACHE_TIMEOUT = 0
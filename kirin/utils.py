@@ -31,7 +31,9 @@
 
 from __future__ import absolute_import, print_function, unicode_literals, division
 import logging
-from datetime import datetime
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
 
 import six
 import ujson
@@ -41,13 +43,13 @@ from pythonjsonlogger import jsonlogger
 from flask.globals import current_app
 from pytz import utc
 
-from kirin import new_relic
+from kirin import new_relic, http_client
+from kirin.blob_store import save_raw_data, load_raw_data, has_raw_data
 from redis.exceptions import ConnectionError
 from contextlib import contextmanager
 from kirin.core import model
 from kirin.core.model import RealTimeUpdate
 from kirin.exceptions import InternalException, InvalidArguments
-import requests
 
 from kirin.new_relic import allow_apm_logging, must_never_log, record_exception
 
@@ -66,7 +68,81 @@ def str_to_date(value):
         return None
 
 
+# Strict ISO-8601 format of datetimes in PIV and COTS feeds (ex: "2020-10-22T22:34:00+02:00")
+_ISO_DATETIME_RE = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?(Z|[+-]\d{2}:?\d{2})\Z"
+)
+_utc_offsets = {"Z": timedelta(0)}  # cache of UTC offsets, few different ones are found in feeds
+
+
+def _get_utc_offset(str_offset):
+    offset = _utc_offsets.get(str_offset)
+    if offset is None:
+        hours, minutes = int(str_offset[1:3]), int(str_offset[-2:])
+        if hours > 23 or minutes > 59:
+            raise ValueError("invalid UTC offset {}".format(str_offset))
+        offset = timedelta(hours=hours, minutes=minutes)
+        if str_offset[0] == "-":
+            offset = -offset
+        _utc_offsets[str_offset] = offset
+    return offset
+
+
+def _parse_iso_datetime(str_time):
+    """
+    :return: the naive UTC datetime of a strict ISO-8601 timezoned datetime, None if not in this format
+
+    >>> _parse_iso_datetime("2020-10-22T22:34:00+02:00")
+    datetime.datetime(2020, 10, 22, 20, 34)
+    >>> _parse_iso_datetime("2020-10-22T22:34:00+02:00\\n") is None
+    True
+    >>> _parse_iso_datetime("0001-01-01T00:00:00+01:00") is None  # out of datetime's range once in UTC
+    True
+    """
+    if not isinstance(str_time, six.string_types):
+        return None
+    match = _ISO_DATETIME_RE.match(str_time)
+    if not match:
+        return None
+    year, month, day, hour, minute, second, fraction, str_offset = match.groups()
+    try:
+        dt = datetime(
+            int(year),
+            int(month),
+            int(day),
+            int(hour),
+            int(minute),
+            int(second),
+            int(fraction.ljust(6, "0")) if fraction else 0,
+        )
+        return dt - _get_utc_offset(str_offset)
+    except (ValueError, OverflowError):
+        return None
+
+
 def as_utc_naive_dt(str_time):
+    """
+    Parse a timezoned datetime and convert it to a naive UTC datetime
+    Usual ISO-8601 format is parsed directly, others are parsed by dateutil
+
+    >>> as_utc_naive_dt("2020-10-22T22:34:00+02:00")
+    datetime.datetime(2020, 10, 22, 20, 34)
+    >>> as_utc_naive_dt("2012-11-19T21:30:00-0130")
+    datetime.datetime(2012, 11, 19, 23, 0)
+    >>> as_utc_naive_dt("2020-10-08T15:44:13.5Z")
+    datetime.datetime(2020, 10, 8, 15, 44, 13, 500000)
+    >>> as_utc_naive_dt("2020-10-22 22:34+02:00")
+    datetime.datetime(2020, 10, 22, 20, 34)
+    >>> as_utc_naive_dt("2015-09-21T14:30:00")  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    InvalidArguments: Impossible to parse timezoned datetime
+    >>> as_utc_naive_dt(20151104073200)  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    InvalidArguments: Impossible to parse timezoned datetime
+    """
+    dt = _parse_iso_datetime(str_time)
+    if dt is not None:
+        return dt
     try:
         return (
             parser.parse(str_time, dayfirst=False, yearfirst=True, ignoretz=False)
@@ -149,17 +225,67 @@ def db_commit(orm_object):
 
 def make_rt_update(raw_data, connector_type, contributor_id, status="OK"):
     """
-    Create an RealTimeUpdate object for the query and persist it
+    Create an RealTimeUpdate object for the query, to be persisted with the next commit
+    (along with the result of its processing)
+    :param raw_data: the raw input, possibly already parsed (JsonInput)
     """
     rt_update = model.RealTimeUpdate(
-        raw_data, connector_type=connector_type, contributor_id=contributor_id, status=status
+        None, connector_type=connector_type, contributor_id=contributor_id, status=status
     )
+    save_raw_data(rt_update, get_raw_input(raw_data))
     new_relic.record_custom_parameter("real_time_update_id", rt_update.id)
 
-    db_commit(rt_update)
+    model.db.session.add(rt_update)
     return rt_update
 
 
+# json input along with its document (None if invalid json), parsed once for all when received
+JsonInput = namedtuple("JsonInput", ["raw", "json_data"])
+
+
+def parse_json_input(input_raw):
+    """
+    Parse a json input when it is received, so that its document can be used before building
+    the RealTimeUpdate (to coalesce or dispatch inputs) without parsing it again (see attach_json())
+    """
+    try:
+        return JsonInput(input_raw, ujson.loads(input_raw))
+    except ValueError:
+        return JsonInput(input_raw, None)  # reported by get_rtu_json() when interpreting the input
+
+
+def get_raw_input(input_raw):
+    """
+    :return: the raw input (as received), whether it is already parsed (JsonInput) or not
+    """
+    return input_raw.raw if isinstance(input_raw, JsonInput) else input_raw
+
+
+def attach_json(rt_update, input_raw):
+    """
+    Parse the json input once for all (unless already parsed: JsonInput) and attach it to the RealTimeUpdate
+    storing it (as done with the protobuf of GTFS-RT), to be interpreted using get_rtu_json()
+    """
+    if not isinstance(input_raw, JsonInput):
+        input_raw = parse_json_input(input_raw)
+    if input_raw.json_data is not None:
+        rt_update.json_data = input_raw.json_data
+
+
+def get_rtu_json(rt_update):
+    """
+    :return: the json document stored in the RealTimeUpdate (only parsed if not attached yet)
+    """
+    json_data = getattr(rt_update, "json_data", None)
+    if json_data is None:
+        try:
+            json_data = ujson.loads(load_raw_data(rt_update))
+        except ValueError as e:
+            raise InvalidArguments("invalid json: {}".format(e.message))
+        rt_update.json_data = json_data
+    return json_data
+
+
 def record_input_retrieval(contributor, duration_ms, **kwargs):
     params = {"duration": duration_ms, "contributor": contributor}
     params.update(kwargs)
@@ -183,6 +309,44 @@ def record_call(status, **kwargs):
     new_relic.record_custom_event("kirin_status", params)
 
 
+def record_poll_schedule(contributor, lag, **kwargs):
+    """
+    lag is the delay (seconds) between the time a polling was due and the time it was launched
+    """
+    params = {"contributor": contributor, "lag": lag}
+    params.update(kwargs)
+    logging.getLogger(__name__).debug("Poll scheduled", extra=params)
+    new_relic.record_custom_event("kirin_poll_schedule", params)
+
+
+def record_consumer_activity(contributor, message_count, duration, **kwargs):
+    """
+    duration is the time (seconds) it took to consume message_count messages
+    parameters: lag, queue_depth...
+    """
+    params = {"contributor": contributor, "message_count": message_count, "duration": duration}
+    params["throughput"] = message_count / duration if duration else None
+    params.update(kwargs)
+    logging.getLogger(__name__).info("Consumer activity", extra=params)
+    new_relic.record_custom_event("kirin_consumer_activity", params)
+
+
+def record_purge(contributor, purged_type, nb_deleted, duration, **kwargs):
+    """
+    duration is the time (seconds) it took to delete nb_deleted objects of purged_type
+    """
+    params = {
+        "contributor": contributor,
+        "purged_type": purged_type,
+        "nb_deleted": nb_deleted,
+        "duration": duration,
+    }
+    params["throughput"] = nb_deleted / duration if duration else None
+    params.update(kwargs)
+    logging.getLogger(__name__).info("Purge", extra=params)
+    new_relic.record_custom_event("kirin_purge", params)
+
+
 def should_retry_exception(exception):
     return isinstance(exception, ConnectionError)
 
@@ -204,11 +368,87 @@ def build_redis_etag_key(contributor):
     return "|".join([contributor, "polling_HEAD"])
 
 
+def build_redis_last_modified_key(contributor):
+    # type: (unicode) -> unicode
+    return "|".join([contributor, "polling_last_modified"])
+
+
+def build_redis_content_hash_key(contributor):
+    # type: (unicode) -> unicode
+    return "|".join([contributor, "polling_content_hash"])
+
+
+def build_redis_entity_hashes_key(contributor):
+    # type: (unicode) -> unicode
+    return "|".join([contributor, "entity_hashes"])
+
+
+def build_redis_piv_shard_count_key(contributor):
+    # type: (unicode) -> unicode
+    return "|".join([contributor, "piv_shard_count"])
+
+
+def build_redis_piv_shard_barrier_key(contributor, shard):
+    # type: (unicode, int) -> unicode
+    return "|".join([contributor, "piv_shard_barrier", six.text_type(shard)])
+
+
+def build_redis_probes_key(contributor):
+    # type: (unicode) -> unicode
+    return "|".join([contributor, "probes"])
+
+
+def build_redis_profiling_key(contributor):
+    # type: (unicode) -> unicode
+    return "|".join([contributor, "profiling_sample_rate"])
+
+
+def build_redis_realtime_version_key(contributor):
+    # type: (unicode) -> unicode
+    return "|".join([contributor, "realtime_version"])
+
+
+def build_redis_gtfs_rt_feed_key(contributors):
+    return "|".join([",".join(sorted(contributors)), "gtfs_rt_feed"])
+
+
 def allow_reprocess_same_data(contributor_id):
     # type: (unicode) -> None
     from kirin import redis_client
 
-    redis_client.delete(build_redis_etag_key(contributor_id))  # wipe previous' ETag memory
+    # wipe previous' ETag, Last-Modified, content-hash and entity-hashes memory
+    redis_client.delete(
+        build_redis_etag_key(contributor_id),
+        build_redis_last_modified_key(contributor_id),
+        build_redis_content_hash_key(contributor_id),
+        build_redis_entity_hashes_key(contributor_id),
+    )
+
+
+def get_contributors_version():
+    """
+    :return: version of contributors' configuration, changed every time a contributor is modified
+    (None if unknown)
+    """
+    from kirin import app, redis_client
+
+    try:
+        return redis_client.get(app.config[str("CONTRIBUTORS_VERSION_KEY")])
+    except ConnectionError:
+        logging.getLogger(__name__).exception("Exception with redis while getting contributors version")
+        return None
+
+
+def bump_contributors_version():
+    """
+    Notify that contributors' configuration changed (so that caches can be refreshed)
+    """
+    from kirin import app, redis_client
+
+    try:
+        redis_client.incr(app.config[str("CONTRIBUTORS_VERSION_KEY")])
+    except ConnectionError:
+        logging.getLogger(__name__).exception("Exception with redis while bumping contributors version")
 
 
 def set_rtu_status_ko(rtu, error, is_reprocess_same_data_allowed):
@@ -268,7 +508,7 @@ def manage_db_error(data, connector_type, contributor_id, error, is_reprocess_sa
     reprocess it (hoping a happier ending)
     """
     last = model.RealTimeUpdate.get_last_rtu(connector_type, contributor_id)
-    if last and last.status == "KO" and last.error == error and last.raw_data == six.binary_type(data):
+    if last and last.status == "KO" and last.error == error and has_raw_data(last, six.binary_type(data)):
         poke_updated_at(last)
         if is_reprocess_same_data_allowed:
             allow_reprocess_same_data(contributor_id)
@@ -286,7 +526,7 @@ def manage_db_no_new(connector_type, contributor_id):
 
 def can_connect_to_navitia():
     try:
-        response = requests.head(current_app.config[str("NAVITIA_URL")], timeout=1)
+        response = http_client.head(current_app.config[str("NAVITIA_URL")], timeout=1)
         return response.status_code == 200
     except Exception:
         return False
@@ -310,12 +550,26 @@ def get_database_version():
 
 
 def get_database_info():
+    from kirin.core.probes import get_contributors_probes
+
+    try:
+        return get_contributors_probes()
+    except Exception:
+        logging.getLogger(__name__).exception("Exception with redis while getting contributors probes")
     try:
-        return model.RealTimeUpdate.get_probes_by_contributor()
+        with model.read_from_replica():
+            return model.RealTimeUpdate.get_probes_by_contributor()
     except Exception:
         return {"last_update": {}, "last_valid_update": {}, "last_update_error": {}}
 
 
+def get_http_pool_status():
+    try:
+        return http_client.get_http_pool_status()
+    except Exception:
+        return None
+
+
 def get_database_pool_status():
     try:
         return model.db.engine.pool.status()
@@ -336,7 +590,8 @@ def get_lock(logger, lock_name, lock_timeout):
         raise
 
     try:
-        yield locked
+        # the lock itself is provided (when acquired) so that long tasks can extend it
+        yield lock if locked else None
     finally:
         if locked:
             logger.debug("releasing lock %s", lock_name)
@@ -37,6 +37,9 @@ from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 from kirin import manager
 import kirin.command.purge_rt
+import kirin.command.gtfs_rt_poller
+import kirin.command.raw_data
+import kirin.command.replay_rt
 
 migrate = Migrate(app, db)
 manager.add_command("db", MigrateCommand)
@@ -0,0 +1,44 @@
+"""
+Vacuum more often the tables emptied by the daily purges
+
+Purges delete a large part of those tables every day, so the default thresholds
+(20% of dead rows to vacuum, 10% of changed rows to analyze) are reached late and
+let the tables and their indexes bloat.
+
+Revision ID: 0a507767b1cb
+Revises: 7bfe6fc8271d
+Create Date: 2026-10-19 10:12:31.418207
+
+"""
+from __future__ import absolute_import, print_function, unicode_literals, division
+
+# revision identifiers, used by Alembic.
+revision = "0a507767b1cb"
+down_revision = "7bfe6fc8271d"
+
+from alembic import op
+
+PURGED_TABLES = [
+    "real_time_update",
+    "associate_realtimeupdate_tripupdate",
+    "trip_update",
+    "stop_time_update",
+    "vehicle_journey",
+]
+
+
+def upgrade():
+    for table in PURGED_TABLES:
+        op.execute(
+            "ALTER TABLE {} SET (autovacuum_vacuum_scale_factor = 0.01, "
+            "autovacuum_analyze_scale_factor = 0.01);".format(table)
+        )
+
+
+def downgrade():
+    for table in PURGED_TABLES:
+        op.execute(
+            "ALTER TABLE {} RESET (autovacuum_vacuum_scale_factor, autovacuum_analyze_scale_factor);".format(
+                table
+            )
+        )
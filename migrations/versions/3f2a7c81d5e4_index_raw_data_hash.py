@@ -0,0 +1,23 @@
+"""
+Add an index on raw_data_hash of real_time_update, to know which raw data stored outside db are still used
+
+Revision ID: 3f2a7c81d5e4
+Revises: 491071e28a50
+Create Date: 2026-10-19 18:12:45.831204
+
+"""
+from __future__ import absolute_import, print_function, unicode_literals, division
+
+# revision identifiers, used by Alembic.
+revision = "3f2a7c81d5e4"
+down_revision = "491071e28a50"
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index("realtime_update_raw_data_hash", "real_time_update", ["raw_data_hash"], unique=False)
+
+
+def downgrade():
+    op.drop_index("realtime_update_raw_data_hash", table_name="real_time_update")
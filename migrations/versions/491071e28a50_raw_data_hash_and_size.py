@@ -0,0 +1,26 @@
+"""
+Add raw_data_hash and raw_data_size to real_time_update, for raw data stored outside db
+
+Revision ID: 491071e28a50
+Revises: 0a507767b1cb
+Create Date: 2026-10-19 14:41:07.302115
+
+"""
+from __future__ import absolute_import, print_function, unicode_literals, division
+
+# revision identifiers, used by Alembic.
+revision = "491071e28a50"
+down_revision = "0a507767b1cb"
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column("real_time_update", sa.Column("raw_data_hash", sa.Text(), nullable=True))
+    op.add_column("real_time_update", sa.Column("raw_data_size", sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("real_time_update", "raw_data_size")
+    op.drop_column("real_time_update", "raw_data_hash")
@@ -0,0 +1,86 @@
+# coding=utf-8
+
+#  Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import glob
+import os
+import re
+import timeit
+
+from dateutil import parser
+from pytz import utc
+
+from kirin.utils import as_utc_naive_dt
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "..", "fixtures")
+
+
+def _dateutil_as_utc_naive_dt(str_time):
+    return (
+        parser.parse(str_time, dayfirst=False, yearfirst=True, ignoretz=False)
+        .astimezone(utc)
+        .replace(tzinfo=None)
+    )
+
+
+def get_fixtures_datetimes(pattern):
+    """
+    :return: all stop events' datetimes (timezoned) found in fixtures
+    """
+    str_datetimes = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, pattern))):
+        with open(path, "r") as f:
+            content = f.read().decode("utf_8")
+        str_datetimes.extend(re.findall(r'"dateHeure[A-Za-z]*": *"([^"]+(?:Z|[+-]\d{2}:?\d{2}))"', content))
+    return str_datetimes
+
+
+def main(number=20):
+    """
+    Compare the parsing of stop events' datetimes in PIV and COTS fixtures by kirin and by dateutil
+    """
+    for name, pattern in [("PIV", "piv/*.json"), ("COTS", "cots_*.json")]:
+        str_datetimes = get_fixtures_datetimes(pattern)
+        assert [as_utc_naive_dt(s) for s in str_datetimes] == [
+            _dateutil_as_utc_naive_dt(s) for s in str_datetimes
+        ]
+        for func in (as_utc_naive_dt, _dateutil_as_utc_naive_dt):
+            duration = min(timeit.repeat(lambda: [func(s) for s in str_datetimes], number=number, repeat=5))
+            print(
+                "{:<5} {:<27} {:>5} datetimes: {:>8.2f} us/datetime".format(
+                    name, func.__name__, len(str_datetimes), duration / number / len(str_datetimes) * 1e6
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
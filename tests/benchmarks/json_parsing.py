@@ -0,0 +1,99 @@
+# coding=utf-8
+
+#  Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import glob
+import os
+import sys
+import timeit
+
+import ujson
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "..", "fixtures")
+
+
+def _deep_size(obj):
+    """
+    :return: memory (bytes) allocated for a parsed json document
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(k) + _deep_size(v) for k, v in obj.items())
+    elif isinstance(obj, list):
+        size += sum(_deep_size(v) for v in obj)
+    return size
+
+
+def _best_duration_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def bench_fixture(path, number):
+    with open(path, "r") as f:
+        raw = f.read().decode("utf_8")
+    parse = lambda: ujson.loads(raw)
+    return {
+        "fixture": os.path.relpath(path, FIXTURES_DIR),
+        "size": len(raw),
+        "parse_us": _best_duration_us(parse, number),
+        "allocated": _deep_size(parse()),
+    }
+
+
+def bench_constant_literal(number):
+    return {
+        "ujson.loads(literal)_us": _best_duration_us(
+            lambda: ujson.loads('{"type": "UNDEFINED", "texte": ""}'), number
+        ),
+        "dict literal_us": _best_duration_us(lambda: {"type": "UNDEFINED", "texte": ""}, number),
+    }
+
+
+def main(number=1000):
+    """
+    Measure the cost of parsing the PIV and COTS fixtures:
+    each parse avoided per input (parse once when received instead of once more when interpreted) saves
+    the time and memory allocation displayed.
+    """
+    paths = sorted(glob.glob(os.path.join(FIXTURES_DIR, "piv", "*.json")))
+    paths += sorted(glob.glob(os.path.join(FIXTURES_DIR, "cots_*.json")))
+    print("{:<70} {:>8} {:>10} {:>15}".format("fixture", "size", "parse (us)", "allocated (B)"))
+    for path in paths:
+        res = bench_fixture(path, number)
+        print("{fixture:<70} {size:>8} {parse_us:>10.1f} {allocated:>15}".format(**res))
+    print()
+    for name, duration in sorted(bench_constant_literal(number * 100).items()):
+        print("{:<30} {:>10.3f}".format(name, duration))
+
+
+if __name__ == "__main__":
+    main()
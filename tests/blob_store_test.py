@@ -0,0 +1,77 @@
+# coding=utf-8
+
+#  Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+from __future__ import absolute_import, print_function, unicode_literals, division
+import os
+import time
+
+from kirin.blob_store import FileSystemBlobStore
+
+
+def test_filesystem_blob_store(tmpdir):
+    store = FileSystemBlobStore(str(tmpdir))
+    store.put("abcdef", b"some payload")
+    store.put("abcdef", b"some payload")  # already stored
+    store.put("012345", b"another payload")
+
+    assert store.get("abcdef") == b"some payload"
+    assert store.get("012345") == b"another payload"
+    assert sorted(os.listdir(str(tmpdir.join("ab")))) == ["abcdef.gz"]
+
+    # blobs not stored since given time are removed
+    old_time = time.time() - 3600
+    os.utime(str(tmpdir.join("01", "012345.gz")), (old_time, old_time))
+    assert store.remove_older_than(time.time() - 60) == 1
+    assert not tmpdir.join("01", "012345.gz").exists()
+    assert store.get("abcdef") == b"some payload"
+
+
+def test_filesystem_blob_store_keeps_used_blobs(tmpdir):
+    store = FileSystemBlobStore(str(tmpdir))
+    for key in ["aa0001", "aa0002", "bb0001"]:
+        store.put(key, b"payload")
+    old_time = time.time() - 3600
+    for directory, _, file_names in os.walk(str(tmpdir)):
+        for file_name in file_names:
+            os.utime(os.path.join(directory, file_name), (old_time, old_time))
+
+    # blobs still used are kept, whatever the chunk of keys they are checked in
+    checked_keys = []
+
+    def get_used_keys(keys):
+        checked_keys.append(sorted(keys))
+        return {"aa0002"} & set(keys)
+
+    assert store.remove_older_than(time.time() - 60, get_used_keys=get_used_keys, chunk_size=2) == 2
+    assert sorted(k for keys in checked_keys for k in keys) == ["aa0001", "aa0002", "bb0001"]
+    assert all(len(keys) <= 2 for keys in checked_keys)
+    assert store.get("aa0002") == b"payload"
+    assert not tmpdir.join("aa", "aa0001.gz").exists()
+    assert not tmpdir.join("bb", "bb0001.gz").exists()
@@ -33,7 +33,7 @@ import os
 
 import six
 
-from kirin import app, db
+from kirin import app, db, redis_client
 from kirin.core import model
 import pytest
 import flask_migrate
@@ -73,8 +73,9 @@ def bdd(init_flask_db):
 @pytest.fixture(scope="function", autouse=True)
 def clean_db(rabbitmq_docker_fixture):
     """
-    before all tests the database is cleared
+    before all tests the database (and redis memory of previous feeds) is cleared
     """
+    redis_client.flushdb()
     with app.app_context():
         tables = [six.text_type(table) for table in db.metadata.sorted_tables]
         db.session.execute("TRUNCATE {} CASCADE;".format(", ".join(tables)))
@@ -568,3 +568,24 @@ def test_piv_contributor(test_client):
     assert contrib.navitia_token == "blablablabla"
     assert contrib.feed_url == "no_url"
     assert contrib.retrieval_interval == 30
+
+
+def test_contributor_profiling(test_client):
+    resp = test_client.get("/contributors/rt.tchoutchou/profiling")
+    assert resp.status_code == 200
+    assert json.loads(resp.data)["profiling"]["sample_rate"] is None
+
+    resp = test_client.put("/contributors/rt.tchoutchou/profiling", json={"sample_rate": 10, "duration": 60})
+    assert resp.status_code == 200
+
+    resp = test_client.get("/contributors/rt.tchoutchou/profiling")
+    profiling = json.loads(resp.data)["profiling"]
+    assert profiling["sample_rate"] == 10
+    assert 0 < profiling["remaining_duration"] <= 60
+
+    assert test_client.put("/contributors/rt.tchoutchou/profiling", json={"sample_rate": 0}).status_code == 400
+    assert test_client.put("/contributors/unknown/profiling", json={"sample_rate": 1}).status_code == 404
+
+    assert test_client.delete("/contributors/rt.tchoutchou/profiling").status_code == 204
+    resp = test_client.get("/contributors/rt.tchoutchou/profiling")
+    assert json.loads(resp.data)["profiling"]["sample_rate"] is None
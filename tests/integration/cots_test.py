@@ -130,6 +130,50 @@ def test_cots_simple_post(mock_rabbitmq):
     assert mock_rabbitmq.call_count == 1
 
 
+def test_cots_post_raw_data_in_blob_store(mock_rabbitmq, monkeypatch, tmpdir):
+    """
+    with a blob store, the raw COTS is stored outside db (gzipped, once per content)
+    """
+    from kirin import blob_store
+
+    monkeypatch.setitem(app.config, str("RAW_DATA_STORE"), "filesystem")
+    monkeypatch.setitem(app.config, str("RAW_DATA_STORE_PATH"), str(tmpdir))
+    monkeypatch.setattr(blob_store, "_blob_store", {})
+    cots_file = get_fixture_data("cots_train_96231_delayed.json")
+    assert api_post("/cots", data=cots_file) == "OK"
+    assert api_post("/cots", data=cots_file) == "OK"
+
+    with app.app_context():
+        rtus = RealTimeUpdate.query.all()
+        assert len(rtus) == 2
+        assert all(rtu.raw_data is None for rtu in rtus)
+        assert rtus[0].raw_data_hash == rtus[1].raw_data_hash
+        assert rtus[0].raw_data_size == len(cots_file.encode("utf-8"))
+        assert blob_store.load_raw_data(rtus[0]) == cots_file
+        assert len(tmpdir.listdir()) == 1  # stored once
+
+
+def test_manage_db_error_raw_data_in_blob_store(monkeypatch, tmpdir):
+    """
+    the same error on the same data only updates the last RealTimeUpdate, without reading its raw data
+    (which may not be in the blob store anymore)
+    """
+    from kirin import blob_store
+    from kirin.utils import manage_db_error
+
+    monkeypatch.setitem(app.config, str("RAW_DATA_STORE"), "filesystem")
+    monkeypatch.setitem(app.config, str("RAW_DATA_STORE_PATH"), str(tmpdir))
+    monkeypatch.setattr(blob_store, "_blob_store", {})
+    with app.app_context():
+        manage_db_error("bad data", ConnectorType.cots.value, COTS_CONTRIBUTOR_ID, "boom", False)
+        tmpdir.remove()
+        manage_db_error("bad data", ConnectorType.cots.value, COTS_CONTRIBUTOR_ID, "boom", False)
+        assert RealTimeUpdate.query.count() == 1
+
+        manage_db_error("other bad data", ConnectorType.cots.value, COTS_CONTRIBUTOR_ID, "boom", False)
+        assert RealTimeUpdate.query.count() == 2
+
+
 def test_save_bad_raw_cots():
     """
     send a bad formatted COTS, the bad raw COTS should be saved in db
@@ -53,8 +53,9 @@ from kirin.gtfs_rt import KirinModelBuilder
 from kirin.tasks import purge_trip_update, purge_rt_update
 from tests import mock_navitia
 from tests.check_utils import api_post, api_get
-from kirin import gtfs_realtime_pb2, app
-from kirin.utils import save_rt_data_with_error, manage_db_error, build_redis_etag_key
+from kirin import gtfs_realtime_pb2, app, http_client
+from kirin.gtfs_rt.tasks import _retrieve_gtfsrt, _is_newer, poll_gtfsrt
+from kirin.utils import save_rt_data_with_error, manage_db_error, build_redis_etag_key, allow_reprocess_same_data
 from tests.integration.conftest import GTFS_CONTRIBUTOR_ID
 import time
 from sqlalchemy import desc
@@ -2029,3 +2030,142 @@ def test_gtfs_pass_midnight_negative_delay_utc_model_builder(pass_midnight_negat
 
         feed = convert_to_gtfsrt(trip_updates)
         assert feed.entity[0].trip_update.trip.start_date == "20120615"  # must be UTC start date
+
+
+GTFS_FEED_URL = "http://gtfs-rt.feed/"
+
+
+def test_gtfs_rt_conditional_get(requests_mock):
+    """
+    validators received with the feed are sent back on next polling, and a 304 is not new data
+    """
+    allow_reprocess_same_data(GTFS_CONTRIBUTOR_ID)
+    config = {"contributor": GTFS_CONTRIBUTOR_ID, "feed_url": GTFS_FEED_URL, "timeout": 1}
+    last_modified = "Fri, 15 Jun 2012 15:00:00 GMT"
+    requests_mock.get(
+        GTFS_FEED_URL, content=b"feed", headers={"ETag": "firstETag", "Last-Modified": last_modified}
+    )
+
+    response = _retrieve_gtfsrt(config)
+    assert "If-None-Match" not in requests_mock.last_request.headers
+    assert "If-Modified-Since" not in requests_mock.last_request.headers
+    assert _is_newer(config, response)
+
+    requests_mock.get(GTFS_FEED_URL, status_code=304)
+    response = _retrieve_gtfsrt(config)
+    assert requests_mock.last_request.headers["If-None-Match"] == "firstETag"
+    assert requests_mock.last_request.headers["If-Modified-Since"] == last_modified
+    assert response.status_code == 304
+
+    # a failure in processing allows to get the same feed again
+    allow_reprocess_same_data(GTFS_CONTRIBUTOR_ID)
+    _retrieve_gtfsrt(config)
+    assert "If-None-Match" not in requests_mock.last_request.headers
+    assert "If-Modified-Since" not in requests_mock.last_request.headers
+
+
+def test_gtfs_rt_retrieval_shared_session(requests_mock):
+    """
+    successive retrievals of a feed go through the same session (keeping its connections alive)
+    """
+    allow_reprocess_same_data(GTFS_CONTRIBUTOR_ID)
+    config = {"contributor": GTFS_CONTRIBUTOR_ID, "feed_url": GTFS_FEED_URL, "timeout": 1}
+    requests_mock.get(GTFS_FEED_URL, content=b"feed")
+    nb_requests = http_client.get_http_pool_status().get("gtfs-rt.feed", {}).get("requests", 0)
+
+    _retrieve_gtfsrt(config)
+    session = http_client.get_session(GTFS_FEED_URL)
+    _retrieve_gtfsrt(config)
+    assert http_client.get_session(GTFS_FEED_URL) is session
+    assert http_client.get_session("http://other.host/") is not session
+    assert requests_mock.last_request.headers["Accept-Encoding"] == "gzip, deflate"
+    assert http_client.get_http_pool_status()["gtfs-rt.feed"]["requests"] == nb_requests + 2
+
+
+def test_gtfs_rt_is_newer_without_validators(requests_mock):
+    """
+    if the server doesn't provide any validator, the content itself is compared
+    """
+    allow_reprocess_same_data(GTFS_CONTRIBUTOR_ID)
+    config = {"contributor": GTFS_CONTRIBUTOR_ID, "feed_url": GTFS_FEED_URL, "timeout": 1}
+    requests_mock.get(GTFS_FEED_URL, content=b"feed")
+
+    assert _is_newer(config, _retrieve_gtfsrt(config))
+    assert not _is_newer(config, _retrieve_gtfsrt(config))
+    assert "If-None-Match" not in requests_mock.last_request.headers
+
+    requests_mock.get(GTFS_FEED_URL, content=b"new feed")
+    assert _is_newer(config, _retrieve_gtfsrt(config))
+
+
+def test_poll_gtfsrt_processing_slot(requests_mock, basic_gtfs_rt_data, mock_rabbitmq):
+    """
+    the processing slot is only held while processing a new feed
+    """
+    from mock import MagicMock
+
+    allow_reprocess_same_data(GTFS_CONTRIBUTOR_ID)
+    config = {"contributor": GTFS_CONTRIBUTOR_ID, "feed_url": GTFS_FEED_URL, "timeout": 1, "is_scheduled": True}
+    processing_slot = MagicMock()
+    requests_mock.get(GTFS_FEED_URL, content=basic_gtfs_rt_data, headers={"ETag": "1"})
+
+    with app.app_context():
+        poll_gtfsrt(config, processing_slot=processing_slot)
+        assert processing_slot.__enter__.call_count == 1
+        assert processing_slot.__exit__.call_count == 1
+        assert len(RealTimeUpdate.query.all()) == 1
+        assert len(TripUpdate.query.all()) == 1
+
+        requests_mock.get(GTFS_FEED_URL, status_code=304)
+        poll_gtfsrt(config, processing_slot=processing_slot)
+        assert processing_slot.__enter__.call_count == 1
+        assert len(RealTimeUpdate.query.all()) == 1
+
+
+def test_gtfs_rt_entity_diff(basic_gtfs_rt_data, basic_gtfs_rt_data_without_delays):
+    """
+    only entities that changed since previous feed are processed
+    """
+    with app.app_context():
+        contributor = model.Contributor(
+            id=GTFS_CONTRIBUTOR_ID, navitia_coverage=None, connector_type=ConnectorType.gtfs_rt.value
+        )
+        builder = KirinModelBuilder(contributor)
+
+        rt_update, _ = builder.build_rt_update(basic_gtfs_rt_data)
+        trip_updates, log_dict = builder.build_trip_updates(rt_update)
+        assert len(trip_updates) == 1
+        assert log_dict["unchanged_entity_count"] == 0
+        assert log_dict["vanished_entity_count"] == 0
+
+        # same entity again: nothing to process, but nothing wrong with the feed
+        rt_update, _ = builder.build_rt_update(basic_gtfs_rt_data)
+        trip_updates, log_dict = builder.build_trip_updates(rt_update)
+        assert len(trip_updates) == 0
+        assert log_dict["unchanged_entity_count"] == 1
+        assert rt_update.status == "OK"
+
+        # entity changed: it is processed
+        rt_update, _ = builder.build_rt_update(basic_gtfs_rt_data_without_delays)
+        trip_updates, log_dict = builder.build_trip_updates(rt_update)
+        assert len(trip_updates) == 1
+        assert log_dict["unchanged_entity_count"] == 0
+
+        # entity vanished from the feed
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.header.gtfs_realtime_version = "1.0"
+        feed.header.incrementality = gtfs_realtime_pb2.FeedHeader.FULL_DATASET
+        feed.header.timestamp = to_posix_time(datetime.datetime(year=2012, month=6, day=15, hour=15))
+        rt_update, _ = builder.build_rt_update(feed.SerializeToString())
+        trip_updates, log_dict = builder.build_trip_updates(rt_update)
+        assert len(trip_updates) == 0
+        assert log_dict["vanished_entity_count"] == 1
+        assert rt_update.status == "KO"
+
+        # a processing failure allows to process the same entities again
+        rt_update, _ = builder.build_rt_update(basic_gtfs_rt_data)
+        builder.build_trip_updates(rt_update)
+        allow_reprocess_same_data(GTFS_CONTRIBUTOR_ID)
+        rt_update, _ = builder.build_rt_update(basic_gtfs_rt_data)
+        trip_updates, log_dict = builder.build_trip_updates(rt_update)
+        assert len(trip_updates) == 1
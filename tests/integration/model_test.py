@@ -444,3 +444,39 @@ def test_contributor_creation():
             Adding a second contributor with the same id should fail
             """
             db_commit(contrib_with_same_id)
+
+
+def test_read_from_replica(monkeypatch):
+    from kirin.core import model
+
+    # the replica is the test database itself (not in recovery, so never lagging)
+    binds = {model.REPLICA_BIND: app.config[str("SQLALCHEMY_DATABASE_URI")]}
+    monkeypatch.setitem(app.config, str("SQLALCHEMY_BINDS"), binds)
+    monkeypatch.setattr(model, "_replica_status", {"checked_at": None, "usable": False})
+    with app.app_context():
+        replica_engine = db.get_engine(app, bind=model.REPLICA_BIND)
+        with model.read_from_replica():
+            assert db.session.get_bind() is replica_engine
+            assert Contributor.query.filter_by(id=COTS_CONTRIBUTOR_ID).count() == 1
+        assert db.session.get_bind() is db.engine
+
+        # too late replica is not used
+        monkeypatch.setitem(app.config, str("REPLICA_MAX_LAG"), -1)
+        monkeypatch.setattr(model, "_replica_status", {"checked_at": None, "usable": False})
+        with model.read_from_replica():
+            assert db.session.get_bind() is db.engine
+
+
+def test_sql_accounting():
+    from kirin.core.sql_stats import sql_accounting
+
+    with app.app_context():
+        with sql_accounting() as stats:
+            assert Contributor.query.filter_by(id=COTS_CONTRIBUTOR_ID).count() == 1
+            with sql_accounting() as nested_stats:
+                db.session.commit()
+
+        assert nested_stats == {"sql_statements": 0, "sql_round_trips": 1, "sql_duration": 0.0}
+        assert stats["sql_statements"] == 1
+        assert stats["sql_round_trips"] == 2
+        assert stats["sql_duration"] > 0
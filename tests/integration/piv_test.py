@@ -47,7 +47,8 @@ from kirin.core.model import (
     DEFAULT_DAYS_TO_KEEP_RT_UPDATE,
 )
 from kirin.core.types import ConnectorType, TripEffect, ModificationType
-from kirin.tasks import purge_trip_update, purge_rt_update
+from kirin.exceptions import InvalidArguments
+from kirin.tasks import purge_trip_update, purge_rt_update, process_pending_rt_updates
 from tests.check_utils import api_post, api_get, get_fixture_data_as_dict
 from tests import mock_navitia
 from tests.integration.conftest import PIV_CONTRIBUTOR_ID
@@ -535,6 +536,355 @@ def test_piv_simple_post(mock_rabbitmq):
     assert mock_rabbitmq.call_count == 1
 
 
+def test_piv_async_post(mock_rabbitmq, monkeypatch):
+    """
+    with ASYNC_INGESTION, PIV post is only stored as a pending RealTimeUpdate, processed later by a worker
+    """
+    from mock import MagicMock
+
+    monkeypatch.setitem(app.config, str("ASYNC_INGESTION"), True)
+    mock_delay = MagicMock()
+    monkeypatch.setattr(process_pending_rt_updates, "delay", mock_delay)
+
+    piv_str = ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())
+    res, status = api_post("/piv/{}".format(PIV_CONTRIBUTOR_ID), data=piv_str, check=False)
+    assert status == 202
+    assert "PIV feed accepted" in res.get("message")
+    rtu_id = res["real_time_update"]["id"]
+    mock_delay.assert_called_once_with(PIV_CONTRIBUTOR_ID)
+    assert mock_rabbitmq.call_count == 0
+
+    res = api_get("/real_time_updates/{}".format(rtu_id))
+    assert res["real_time_update"]["status"] == "pending"
+    assert res["real_time_update"]["contributor_id"] == PIV_CONTRIBUTOR_ID
+
+    with app.app_context():
+        process_pending_rt_updates(PIV_CONTRIBUTOR_ID)
+        assert RealTimeUpdate.query.count() == 1
+        assert TripUpdate.query.count() == 1
+    assert mock_rabbitmq.call_count == 1
+
+    res = api_get("/real_time_updates/{}".format(rtu_id))
+    assert res["real_time_update"]["status"] == "OK"
+    assert res["real_time_update"]["error"] is None
+
+    _, status = api_get("/real_time_updates/unknown", check=False)
+    assert status == 404
+
+
+def test_piv_pending_retried_on_db_error(mock_rabbitmq, monkeypatch):
+    """
+    if a pending RealTimeUpdate can't be processed nor set KO, its processing is retried later
+    """
+    from mock import MagicMock
+    from kirin.utils import make_rt_update, db_commit
+
+    def failing_wrap_build_pending(builder, rt_update):
+        raise Exception("db is failing")
+
+    monkeypatch.setattr("kirin.tasks.wrap_build_pending", failing_wrap_build_pending)
+    mock_retry = MagicMock(return_value=RuntimeError("retried"))
+    monkeypatch.setattr(process_pending_rt_updates, "retry", mock_retry)
+
+    piv_str = ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())
+    with app.app_context():
+        db_commit(make_rt_update(piv_str, ConnectorType.piv.value, PIV_CONTRIBUTOR_ID, status="pending"))
+        with pytest.raises(RuntimeError):
+            process_pending_rt_updates(PIV_CONTRIBUTOR_ID)
+        assert mock_retry.call_count == 1
+        assert mock_retry.call_args[1]["countdown"] == 1
+        assert mock_retry.call_args[1]["max_retries"] is None
+        assert RealTimeUpdate.query.one().status == "pending"
+    assert mock_rabbitmq.call_count == 0
+
+
+def test_piv_pending_retried_on_db_failure(mock_rabbitmq, monkeypatch):
+    """
+    if db is not reachable anymore (status of the RealTimeUpdate can't be checked, or pending RealTimeUpdates
+    can't be searched), the processing of pending RealTimeUpdates is retried later
+    """
+    from mock import MagicMock
+    from sqlalchemy.exc import OperationalError
+    from kirin.utils import make_rt_update, db_commit
+
+    db_failure = OperationalError("SELECT 1", {}, Exception("server closed the connection unexpectedly"))
+
+    def failing_wrap_build_pending(builder, rt_update):
+        raise Exception("db is failing")
+
+    def failing_rollback():
+        raise db_failure
+
+    monkeypatch.setattr("kirin.tasks.wrap_build_pending", failing_wrap_build_pending)
+    mock_retry = MagicMock(return_value=RuntimeError("retried"))
+    monkeypatch.setattr(process_pending_rt_updates, "retry", mock_retry)
+
+    piv_str = ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())
+    with app.app_context():
+        db_commit(make_rt_update(piv_str, ConnectorType.piv.value, PIV_CONTRIBUTOR_ID, status="pending"))
+        db.session.rollback = failing_rollback
+        try:
+            with pytest.raises(RuntimeError):
+                process_pending_rt_updates(PIV_CONTRIBUTOR_ID)
+        finally:
+            del db.session.rollback
+        assert mock_retry.call_count == 1
+
+        def failing_get_next_pending(contributor_id):
+            raise db_failure
+
+        monkeypatch.setattr(RealTimeUpdate, "get_next_pending", failing_get_next_pending)
+        with pytest.raises(RuntimeError):
+            process_pending_rt_updates(PIV_CONTRIBUTOR_ID)
+        assert mock_retry.call_count == 2
+        assert mock_retry.call_args[1]["exc"] is db_failure
+
+
+def test_piv_realtime_version_redis_error(mock_rabbitmq, monkeypatch):
+    """
+    an error with redis when bumping the realtime version doesn't fail the (committed) processing
+    """
+    from redis.exceptions import ResponseError
+
+    def raise_response_error(*args, **kwargs):
+        raise ResponseError()
+
+    monkeypatch.setattr("kirin.core.realtime_versions.bump_realtime_versions", raise_response_error)
+    res = api_post(
+        "/piv/{}".format(PIV_CONTRIBUTOR_ID), data=ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())
+    )
+    assert "PIV feed processed" in res.get("message")
+    with app.app_context():
+        assert RealTimeUpdate.query.one().status == "OK"
+    assert mock_rabbitmq.call_count == 1
+
+
+def test_piv_gtfs_rt_feed_export(mock_rabbitmq):
+    """
+    the realtime of a contributor is exported as a FULL_DATASET GTFS-RT feed, with conditional responses
+    """
+    from kirin import gtfs_realtime_pb2
+
+    piv_str = ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())
+    api_post("/piv/{}".format(PIV_CONTRIBUTOR_ID), data=piv_str)
+
+    tester = app.test_client()
+    resp = tester.get("/gtfs_rt/{}/feed.pb".format(PIV_CONTRIBUTOR_ID))
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/x-protobuf"
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(resp.data)
+    assert feed.header.incrementality == gtfs_realtime_pb2.FeedHeader.FULL_DATASET
+    assert len(feed.entity) == 1
+    etag = resp.headers["ETag"]
+
+    # feed is not rebuilt while the realtime does not change
+    resp = tester.get("/gtfs_rt/{}/feed.pb".format(PIV_CONTRIBUTOR_ID), headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+    resp = tester.get("/gtfs_rt/{}/feed.pb".format(PIV_CONTRIBUTOR_ID), headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert resp.headers["ETag"] != etag
+
+    # multi-contributor variant
+    resp = tester.get(
+        "/gtfs_rt/feed.pb?contributor={}".format(PIV_CONTRIBUTOR_ID), headers={"If-None-Match": etag}
+    )
+    assert resp.status_code == 304
+    resp = tester.get("/gtfs_rt/feed.pb")
+    assert resp.status_code == 200
+    assert tester.get("/gtfs_rt/feed.pb?contributor=unknown").status_code == 404
+
+    piv_str = ujson.dumps(_get_stomp_20201022_23187_partial_delayed_fixture())
+    api_post("/piv/{}".format(PIV_CONTRIBUTOR_ID), data=piv_str)
+    resp = tester.get("/gtfs_rt/{}/feed.pb".format(PIV_CONTRIBUTOR_ID), headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+
+
+def test_piv_gtfs_rt_feed_export_rebuilt_once(mock_rabbitmq, monkeypatch):
+    """
+    while a request rebuilds the GTFS-RT feed, other requests are served the previous feed,
+    and the feed is still provided if redis fails
+    """
+    from redis.exceptions import ResponseError
+    from kirin import redis_client
+    from kirin.utils import build_redis_gtfs_rt_feed_key, make_kirin_lock_name
+
+    tester = app.test_client()
+    feed_url = "/gtfs_rt/{}/feed.pb".format(PIV_CONTRIBUTOR_ID)
+    api_post(
+        "/piv/{}".format(PIV_CONTRIBUTOR_ID), data=ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())
+    )
+    etag = tester.get(feed_url).headers["ETag"]
+
+    api_post(
+        "/piv/{}".format(PIV_CONTRIBUTOR_ID),
+        data=ujson.dumps(_get_stomp_20201022_23187_partial_delayed_fixture()),
+    )
+    with app.app_context():
+        lock = redis_client.lock(make_kirin_lock_name(build_redis_gtfs_rt_feed_key([PIV_CONTRIBUTOR_ID])))
+    assert lock.acquire(blocking=False)
+    try:
+        # being rebuilt by another request
+        assert tester.get(feed_url, headers={"If-None-Match": etag}).status_code == 304
+    finally:
+        lock.release()
+    resp = tester.get(feed_url, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    new_etag = resp.headers["ETag"]
+    assert new_etag != etag
+
+    def raise_response_error(*args, **kwargs):
+        raise ResponseError()
+
+    monkeypatch.setattr("kirin.resources.gtfs_rt_feed.get_realtime_versions", raise_response_error)
+    resp = tester.get(feed_url)
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] == new_etag
+
+
+@pytest.yield_fixture
+def replay_source_db():
+    """
+    a source database (besides Kirin's one, on the same server) to replay RealTimeUpdates from
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.engine.url import make_url
+
+    url = make_url(app.config[str("SQLALCHEMY_DATABASE_URI")])
+    server = create_engine(url).execution_options(isolation_level="AUTOCOMMIT")
+    server.execute("DROP DATABASE IF EXISTS kirin_replay_source")
+    server.execute("CREATE DATABASE kirin_replay_source")
+    server.dispose()
+    url.database = "kirin_replay_source"
+    source = create_engine(url)
+    db.metadata.create_all(source)
+    yield str(url), source
+    source.dispose()
+
+
+def test_piv_replay_rt(mock_rabbitmq, replay_source_db):
+    """
+    PIV RealTimeUpdates stored in a source database are replayed (in order) in Kirin database
+    """
+    from kirin.command.replay_rt import replay_rt
+    from kirin.core.model import Contributor, gen_uuid
+
+    source_db, source = replay_source_db
+    contributor_table, rtu_table = Contributor.__table__, RealTimeUpdate.__table__
+    with app.app_context():
+        contributor = db.session.execute(
+            contributor_table.select().where(contributor_table.c.id == PIV_CONTRIBUTOR_ID)
+        ).first()
+    source.execute(contributor_table.insert().values(**dict(contributor)))
+    fixtures = [
+        _get_stomp_20201022_23187_partial_delayed_fixture(),
+        _get_stomp_20201022_23187_delayed_5min_fixture(),
+    ]
+    for minute, fixture in enumerate(fixtures):
+        source.execute(
+            rtu_table.insert().values(
+                id=gen_uuid(),
+                connector=ConnectorType.piv.value,
+                status="OK",
+                raw_data=ujson.dumps(fixture),
+                contributor_id=PIV_CONTRIBUTOR_ID,
+                created_at=datetime(2020, 10, 22, 20, minute),
+            )
+        )
+
+    with app.app_context():
+        # source redis is only checked not to be Kirin's one
+        replay_rt(
+            PIV_CONTRIBUTOR_ID,
+            "2020-10-22T20:00:00Z",
+            "2020-10-22T21:00:00Z",
+            source_db,
+            "redis://replay-source-redis:6379/0",
+            no_publish=True,
+        )
+        assert RealTimeUpdate.query.count() == 2
+        assert RealTimeUpdate.query.filter_by(status="OK").count() == 2
+    _assert_db_stomp_20201022_23187_delayed_5min()
+    assert mock_rabbitmq.call_count == 0
+
+    with app.app_context():
+        # never replayed in the database storing the RealTimeUpdates
+        replay_rt(
+            PIV_CONTRIBUTOR_ID,
+            "2020-10-22T20:00:00Z",
+            "2020-10-22T21:00:00Z",
+            app.config[str("SQLALCHEMY_DATABASE_URI")],
+            "redis://replay-source-redis:6379/0",
+        )
+        assert RealTimeUpdate.query.count() == 2
+
+
+def test_piv_metrics(mock_rabbitmq):
+    prometheus_parser = pytest.importorskip("prometheus_client.parser")
+
+    piv_str = ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())
+    api_post("/piv/{}".format(PIV_CONTRIBUTOR_ID), data=piv_str)
+
+    resp = app.test_client().get("/metrics")
+    assert resp.status_code == 200
+    samples = [
+        (sample[0], sample[1])
+        for family in prometheus_parser.text_string_to_metric_families(resp.data.decode("utf-8"))
+        for sample in family.samples
+    ]
+    labels = {"contributor": PIV_CONTRIBUTOR_ID, "connector": "piv"}
+    for stage in ["build_rt_update", "build_trip_updates", "merge", "db_commit", "publish"]:
+        assert ("kirin_stage_duration_seconds_count", dict(labels, stage=stage)) in samples
+    assert ("kirin_navitia_call_duration_seconds_count", dict(labels, call="vehicle_journeys")) in samples
+    assert ("kirin_trip_updates_total", dict(labels, result="merged")) in samples
+    assert ("kirin_feed_size_bytes_count", dict(labels, feed="received")) in samples
+
+
+def test_piv_profiling(mock_rabbitmq, monkeypatch, tmpdir):
+    import pstats
+    from kirin.profiling import set_profiling
+
+    monkeypatch.setitem(app.config, str("PROFILING_DIR"), str(tmpdir))
+    with app.app_context():
+        set_profiling(PIV_CONTRIBUTOR_ID, 1, 60)
+
+    piv_str = ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())
+    api_post("/piv/{}".format(PIV_CONTRIBUTOR_ID), data=piv_str)
+
+    with app.app_context():
+        rtu = RealTimeUpdate.query.first()
+    profiles = tmpdir.join(PIV_CONTRIBUTOR_ID).listdir()
+    assert len(profiles) == 1
+    assert profiles[0].basename.endswith("_{}.pstats".format(rtu.id))
+    assert pstats.Stats(str(profiles[0])).total_calls > 0
+
+
+def test_piv_profiling_redis_error(mock_rabbitmq, monkeypatch):
+    """
+    an error with redis when reading the profiling doesn't fail the processing
+    """
+    from redis.exceptions import TimeoutError
+    from kirin import redis_client
+    from kirin.utils import build_redis_profiling_key
+
+    redis_get = redis_client.get
+
+    def get(key):
+        if key == build_redis_profiling_key(PIV_CONTRIBUTOR_ID):
+            raise TimeoutError()
+        return redis_get(key)
+
+    monkeypatch.setattr(redis_client, "get", get)
+    piv_str = ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())
+    res = api_post("/piv/{}".format(PIV_CONTRIBUTOR_ID), data=piv_str)
+    assert "PIV feed processed" in res.get("message")
+    with app.app_context():
+        assert RealTimeUpdate.query.one().status == "OK"
+
+
 def test_piv_purge(mock_rabbitmq):
     """
     Simple PIV post, then test the purge
@@ -972,6 +1322,209 @@ def test_piv_partial_delayed_then_delayed(mock_rabbitmq):
     assert mock_rabbitmq.call_count == 2
 
 
+def test_piv_json_parsed_once():
+    """
+    the json is parsed when received, then attached to the rt_update to be interpreted
+    """
+    from kirin.piv import KirinModelBuilder
+    from kirin.piv.piv import get_piv_contributor
+
+    piv_str = ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())
+    with app.app_context():
+        builder = KirinModelBuilder(get_piv_contributor(PIV_CONTRIBUTOR_ID))
+        rt_update, _ = builder.build_rt_update(piv_str)
+        assert rt_update.json_data == ujson.loads(piv_str)
+
+        rt_update.raw_data = "not parsed again"
+        trip_updates, _ = builder.build_trip_updates(rt_update)
+        assert len(trip_updates) == 1
+
+        # invalid json is reported when interpreted
+        rt_update, _ = builder.build_rt_update("invalid json")
+        with pytest.raises(InvalidArguments):
+            builder.build_trip_updates(rt_update)
+
+
+def test_piv_batch(mock_rabbitmq):
+    """
+    only the last message of a train is processed in a batch, and the batch is published once
+    """
+    from kirin.command.piv_worker import coalesce_messages
+    from kirin.core.build_wrapper import wrap_build_batch
+    from kirin.piv import KirinModelBuilder
+    from kirin.piv.piv import get_piv_contributor
+
+    messages = [
+        (ujson.dumps(_get_stomp_20201022_23187_partial_delayed_fixture()), "partial_delayed"),
+        ("{}", "invalid"),
+        (ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture()), "delayed_5min"),
+    ]
+    kept_messages = coalesce_messages(messages)
+    assert [m for _, m in kept_messages] == ["invalid", "delayed_5min"]
+
+    with app.app_context():
+        builder = KirinModelBuilder(get_piv_contributor(PIV_CONTRIBUTOR_ID))
+        wrap_build_batch(builder, [body for body, _ in kept_messages])
+
+        assert RealTimeUpdate.query.count() == 2
+        assert RealTimeUpdate.query.filter_by(status="KO").count() == 1
+    _assert_db_stomp_20201022_23187_delayed_5min()
+    assert mock_rabbitmq.call_count == 1
+
+
+def test_piv_batch_parsed_once(mock_rabbitmq, monkeypatch):
+    """
+    PIV messages parsed when received are coalesced and built without being parsed again
+    """
+    from kirin.command.piv_worker import coalesce_messages
+    from kirin.core.build_wrapper import wrap_build_batch
+    from kirin.piv import KirinModelBuilder
+    from kirin.piv.piv import get_piv_contributor
+    from kirin.utils import parse_json_input
+
+    messages = [
+        (parse_json_input(ujson.dumps(_get_stomp_20201022_23187_partial_delayed_fixture())), "partial_delayed"),
+        (parse_json_input(ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())), "delayed_5min"),
+    ]
+
+    def fail_loads(*args, **kwargs):
+        raise AssertionError("PIV message parsed again")
+
+    monkeypatch.setattr(ujson, "loads", fail_loads)
+    kept_messages = coalesce_messages(messages)
+    assert [m for _, m in kept_messages] == ["delayed_5min"]
+
+    with app.app_context():
+        builder = KirinModelBuilder(get_piv_contributor(PIV_CONTRIBUTOR_ID))
+        wrap_build_batch(builder, [body for body, _ in kept_messages])
+        monkeypatch.undo()
+
+        assert RealTimeUpdate.query.count() == 1
+        assert RealTimeUpdate.query.filter_by(status="OK").count() == 1
+    _assert_db_stomp_20201022_23187_delayed_5min()
+    assert mock_rabbitmq.call_count == 1
+
+
+def test_piv_db_error_while_handled(mock_rabbitmq, monkeypatch):
+    """
+    if the processing fails in db, the RealTimeUpdate is still stored as KO (with its raw data)
+    """
+    from kirin.core import build_wrapper
+    from kirin.piv import KirinModelBuilder
+    from kirin.piv.piv import get_piv_contributor
+
+    db_commit = build_wrapper.db_commit
+    calls = []
+
+    def failing_db_commit(orm_object):
+        # the first commit (in handle()) fails after the result of the processing is flushed
+        calls.append(orm_object)
+        if len(calls) > 1:
+            return db_commit(orm_object)
+        db.session.add(orm_object)
+        db.session.flush()
+        db.session.execute("SELECT 1/0")
+
+    monkeypatch.setattr(build_wrapper, "db_commit", failing_db_commit)
+
+    piv_str = ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())
+    with app.app_context():
+        builder = KirinModelBuilder(get_piv_contributor(PIV_CONTRIBUTOR_ID))
+        with pytest.raises(Exception):
+            build_wrapper.wrap_build(builder, piv_str)
+
+        assert len(calls) == 2
+        rtu = RealTimeUpdate.query.one()
+        assert rtu.status == "KO"
+        assert rtu.error
+        assert rtu.raw_data == piv_str
+        assert rtu.trip_updates == []
+        assert TripUpdate.query.count() == 0
+    assert mock_rabbitmq.call_count == 0
+
+
+def test_piv_batch_db_error_while_built(mock_rabbitmq, monkeypatch):
+    """
+    if an input of a batch fails in db, it is KO and the rest of the batch is processed (in one transaction)
+    """
+    from kirin.core.build_wrapper import wrap_build_batch
+    from kirin.piv import KirinModelBuilder
+    from kirin.piv.piv import get_piv_contributor
+
+    piv_str = ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())
+    with app.app_context():
+        builder = KirinModelBuilder(get_piv_contributor(PIV_CONTRIBUTOR_ID))
+        build_trip_updates = builder.build_trip_updates
+
+        def failing_build_trip_updates(rt_update):
+            if rt_update.raw_data == "fail in db":
+                db.session.execute("SELECT 1/0")
+            return build_trip_updates(rt_update)
+
+        monkeypatch.setattr(builder, "build_trip_updates", failing_build_trip_updates)
+        rt_updates = wrap_build_batch(builder, [piv_str, "fail in db"])
+
+        assert RealTimeUpdate.query.count() == 2
+        assert RealTimeUpdate.query.get(rt_updates[0].id).status == "OK"
+        failed_rtu = RealTimeUpdate.query.get(rt_updates[1].id)
+        assert failed_rtu.status == "KO"
+        assert failed_rtu.error
+    _assert_db_stomp_20201022_23187_delayed_5min()
+    assert mock_rabbitmq.call_count == 1
+
+
+def test_piv_batch_publish_error(mock_rabbitmq):
+    """
+    if the publication of a batch fails, its RealTimeUpdates are KO but keep the result of their processing
+    """
+    import socket
+    from kirin.core.build_wrapper import wrap_build_batch
+    from kirin.exceptions import MessageNotPublished
+    from kirin.piv import KirinModelBuilder
+    from kirin.piv.piv import get_piv_contributor
+
+    mock_rabbitmq.side_effect = socket.error()
+    with app.app_context():
+        builder = KirinModelBuilder(get_piv_contributor(PIV_CONTRIBUTOR_ID))
+        with pytest.raises(MessageNotPublished):
+            wrap_build_batch(builder, [ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture())])
+
+        rtu = RealTimeUpdate.query.one()
+        assert rtu.status == "KO"
+        assert len(rtu.trip_updates) == 1
+    _assert_db_stomp_20201022_23187_delayed_5min()
+
+
+def test_piv_bulk_post(mock_rabbitmq):
+    """
+    messages of a backlog are processed in order, only the last message of a train is processed,
+    and the batch is published once
+    """
+    lines = [
+        ujson.dumps(_get_stomp_20201022_23187_partial_delayed_fixture()),
+        "{}",
+        "",
+        ujson.dumps(_get_stomp_20201022_23187_delayed_5min_fixture()),
+    ]
+    res = api_post("/piv/{}/bulk".format(PIV_CONTRIBUTOR_ID), data="\n".join(lines))
+    assert "PIV bulk processed" in res.get("message")
+
+    results = res["results"]
+    assert [r["line"] for r in results] == [1, 2, 4]
+    assert [r["status"] for r in results] == ["coalesced", "KO", "OK"]
+    assert "real_time_update_id" not in results[0]
+    assert results[1]["error"]
+
+    with app.app_context():
+        assert RealTimeUpdate.query.count() == 2
+        assert RealTimeUpdate.query.get(results[2]["real_time_update_id"]).status == "OK"
+    _assert_db_stomp_20201022_23187_delayed_5min()
+    assert mock_rabbitmq.call_count == 1
+
+    _, status = api_post("/piv/{}/bulk".format(PIV_CONTRIBUTOR_ID), data="\n", check=False)
+    assert status == 400
+
+
 def test_piv_trip_removal_simple_post(mock_rabbitmq):
     """
     simple trip removal post
@@ -31,7 +31,7 @@
 from __future__ import absolute_import, print_function, unicode_literals, division
 
 from kirin import app, db
-from kirin.command.piv_worker import PivWorker
+from kirin.command.piv_worker import PivWorker, _get_message_lag, _run_consumer
 from kirin.core.model import RealTimeUpdate
 from kirin.core.types import ConnectorType
 from kirin.piv.piv import get_piv_contributor
@@ -147,3 +147,102 @@ def test_mq_message_received_and_stored(
         # Check that MQ message is received and stored in DB
         mq_handler.publish(str('{"key": "Some valid JSON"}'), PIV_CONTRIBUTOR_ID)
         wait_until(lambda: RealTimeUpdate.query.count() == 1)
+
+
+def test_message_lag():
+    from datetime import datetime, timedelta
+    from mock import MagicMock
+
+    message = MagicMock(properties={})
+    assert _get_message_lag(message) is None
+
+    message = MagicMock(properties={"timestamp": datetime.utcnow() - timedelta(seconds=30)})
+    assert 30 <= _get_message_lag(message) < 40
+
+
+def test_piv_worker_of_unknown_contributor():
+    # returns directly (instead of consuming forever) as the contributor doesn't exist
+    _run_consumer("unknown_contributor", PivWorker)
+
+
+def test_piv_consumers_without_gevent(monkeypatch):
+    """
+    without gevent, each contributor is consumed in its own thread (consuming blocks in kombu's drain_events())
+    """
+    from kirin.command import piv_worker
+
+    stop = threading.Event()
+    running = set()
+
+    class BlockingConsumer(object):
+        def __init__(self, contributor):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def run(self):
+            running.add(threading.current_thread().name)
+            stop.wait(20)
+
+    # any contributor id is consumed (as PIV_CONTRIBUTOR_ID) until the test stops
+    monkeypatch.setattr(
+        piv_worker,
+        "get_piv_contributor",
+        lambda contributor_id: None if stop.is_set() else get_piv_contributor(PIV_CONTRIBUTOR_ID),
+    )
+    monkeypatch.setitem(app.config, str("USE_GEVENT"), False)
+    consumers = [piv_worker._spawn_consumer(c_id, BlockingConsumer) for c_id in ("piv_1", "piv_2")]
+    try:
+        wait_until(lambda: running == {"piv_consumer-piv_1", "piv_consumer-piv_2"})
+        assert all(piv_worker._is_consumer_running(consumer) for consumer in consumers)
+    finally:
+        stop.set()
+    for consumer in consumers:
+        consumer.join(20)
+        assert not piv_worker._is_consumer_running(consumer)
+
+
+def test_piv_router_reshard(monkeypatch):
+    """
+    when the nb of shards changes, the router waits for the PivWorkers of previous shards to process their
+    messages (barrier), and keeps the previous nb of shards if they don't in time
+    """
+    from collections import namedtuple
+    from mock import MagicMock
+    from kirin import redis_client
+    from kirin.command.piv_router import PivRouter
+    from kirin.piv.sharding import SHARD_BARRIER_HEADER
+    from kirin.utils import build_redis_piv_shard_count_key, build_redis_piv_shard_barrier_key
+
+    QueueState = namedtuple("QueueState", ["message_count", "consumer_count"])
+    # shard 0 is processed by a PivWorker, shard 1 has messages but no PivWorker (not waited)
+    queue_states = {0: QueueState(0, 1), 1: QueueState(5, 0)}
+    monkeypatch.setitem(app.config, str("PIV_ROUTER_RESHARD_TIMEOUT"), -1)
+    shard_count_key = build_redis_piv_shard_count_key(PIV_CONTRIBUTOR_ID)
+
+    with app.app_context():
+        router = PivRouter(get_piv_contributor(PIV_CONTRIBUTOR_ID), 3)
+    monkeypatch.setattr(router, "_get_shard_queue_state", lambda shard: queue_states[shard])
+    router.producer = MagicMock()
+    redis_client.set(shard_count_key, 2)
+
+    # the PivWorker of shard 0 doesn't process its barrier in time
+    router._wait_for_previous_shards()
+    assert router.producer.publish.call_count == 1
+    assert router.producer.publish.call_args[1]["routing_key"] == "0"
+    assert router.shard_count == 2
+    assert redis_client.get(shard_count_key) == b"2"
+
+    def acknowledge_barrier(body, routing_key, headers, **kwargs):
+        barrier_key = build_redis_piv_shard_barrier_key(PIV_CONTRIBUTOR_ID, int(routing_key))
+        redis_client.set(barrier_key, headers[SHARD_BARRIER_HEADER])
+
+    router.producer.publish.side_effect = acknowledge_barrier
+    router.shard_count = 3
+    router._wait_for_previous_shards()
+    assert router.shard_count == 3
+    assert redis_client.get(shard_count_key) == b"3"
@@ -1,5 +1,9 @@
 from __future__ import absolute_import, print_function, unicode_literals, division
-from kirin import db, app
+import gzip
+import json
+import time
+
+from kirin import db, app, redis_client
 from kirin.core.model import (
     db,
     RealTimeUpdate,
@@ -11,6 +15,7 @@ from kirin.core.model import (
 )
 from kirin.core.types import ConnectorType
 from kirin.tasks import purge_trip_update, purge_rt_update
+from kirin.gtfs_rt.scheduler import pop_due_poll_configs, get_gtfsrt_poll_configs
 from tests.integration.utils_test import create_rt_update_and_trip_update
 from tests.integration.conftest import COTS_CONTRIBUTOR_ID
 from datetime import date, timedelta
@@ -170,3 +175,163 @@ def test_no_purge(mock_rabbitmq):
         assert VehicleJourney.query.count() == 1
         assert db.session.execute("select * from associate_realtimeupdate_tripupdate").rowcount == 1
         assert RealTimeUpdate.query.count() == 1
+
+
+def test_poll_schedule():
+    configs = [
+        {"contributor": "rt.gtfs_1", "retrieval_interval": 10},
+        {"contributor": "rt.gtfs_2", "retrieval_interval": 30},
+    ]
+    schedule_key = app.config[str("GTFS_RT_POLL_SCHEDULE_KEY")]
+
+    # new contributors are due immediately
+    due = pop_due_poll_configs(configs)
+    assert sorted(config["contributor"] for config, _ in due) == ["rt.gtfs_1", "rt.gtfs_2"]
+    # then not before their retrieval_interval
+    assert pop_due_poll_configs(configs) == []
+
+    # simulate the passing of time for one contributor only
+    redis_client.zadd(schedule_key, "rt.gtfs_1", time.time() - 2)
+    due = pop_due_poll_configs(configs)
+    assert len(due) == 1
+    config, lag = due[0]
+    assert config["contributor"] == "rt.gtfs_1"
+    assert lag >= 2
+
+    # a shortened retrieval_interval is taken into account without waiting for the previous one
+    configs[1]["retrieval_interval"] = 1
+    pop_due_poll_configs(configs)
+    assert redis_client.zscore(schedule_key, "rt.gtfs_2") <= time.time() + 1
+
+    # removed contributors are removed from schedule
+    pop_due_poll_configs(configs[:1])
+    assert redis_client.zscore(schedule_key, "rt.gtfs_2") is None
+
+
+def test_poll_configs_reloaded_on_contributor_change(test_client):
+    from tests.integration.conftest import GTFS_CONTRIBUTOR_ID, GTFS_CONTRIBUTOR_DB_ID
+
+    configs = get_gtfsrt_poll_configs()
+    assert sorted(config["contributor"] for config in configs) == [GTFS_CONTRIBUTOR_ID, GTFS_CONTRIBUTOR_DB_ID]
+
+    resp = test_client.delete("/contributors/{}".format(GTFS_CONTRIBUTOR_DB_ID))
+    assert resp.status_code == 204
+
+    configs = get_gtfsrt_poll_configs()
+    assert [config["contributor"] for config in configs] == [GTFS_CONTRIBUTOR_ID]
+
+
+def test_purge_trip_update_by_chunks(mock_rabbitmq):
+    with app.app_context():
+        old_date = date.today() - timedelta(days=DEFAULT_DAYS_TO_KEEP_TRIP_UPDATE + 1)
+        for i in range(3):
+            create_rt_update_and_trip_update(
+                "70866ce8-0638-4fa1-8556-1ddfa22d09d{}".format(i),
+                COTS_CONTRIBUTOR_ID,
+                ConnectorType.cots.value,
+                "70866ce8-0638-4fa1-8556-1ddfa22d09e{}".format(i),
+                "trip:{}".format(i),
+                old_date if i < 2 else date.today(),
+            )
+        db.session.commit()
+
+        chunks = []
+        nb_deleted = TripUpdate.remove_by_contributors_and_period(
+            contributors=[COTS_CONTRIBUTOR_ID],
+            end_date=date.today() - timedelta(days=DEFAULT_DAYS_TO_KEEP_TRIP_UPDATE),
+            chunk_size=1,
+            on_chunk_deleted=lambda nb, duration: chunks.append(nb),
+        )
+
+        assert nb_deleted == 2
+        assert chunks == [1, 1]
+        assert TripUpdate.query.count() == 1
+        assert VehicleJourney.query.count() == 1
+        assert db.session.execute("select * from associate_realtimeupdate_tripupdate").rowcount == 1
+        assert RealTimeUpdate.query.count() == 3
+
+
+def test_purge_rt_update_by_chunks(mock_rabbitmq):
+    with app.app_context():
+        old_date = date.today() - timedelta(days=DEFAULT_DAYS_TO_KEEP_RT_UPDATE + 1)
+        for i in range(3):
+            create_rt_update_and_trip_update(
+                "70866ce8-0638-4fa1-8556-1ddfa22d09d{}".format(i),
+                COTS_CONTRIBUTOR_ID,
+                ConnectorType.cots.value,
+                "70866ce8-0638-4fa1-8556-1ddfa22d09e{}".format(i),
+                "trip:{}".format(i),
+                old_date,
+            )
+        db.session.commit()
+        for i, rtu in enumerate(RealTimeUpdate.query.all()):
+            rtu.created_at = old_date + timedelta(hours=i)
+        db.session.commit()
+        until = date.today() - timedelta(days=DEFAULT_DAYS_TO_KEEP_RT_UPDATE)
+
+        # RTUs are only purged once their TripUpdates are
+        assert RealTimeUpdate.count_by_contributors_until([COTS_CONTRIBUTOR_ID], until) == 0
+        TripUpdate.remove_by_contributors_and_period(contributors=[COTS_CONTRIBUTOR_ID], chunk_size=1000)
+        assert RealTimeUpdate.count_by_contributors_until([COTS_CONTRIBUTOR_ID], until) == 3
+        assert RealTimeUpdate.count_by_contributors_until(["another_contributor"], until) == 0
+
+        chunks = []
+        nb_deleted = RealTimeUpdate.remove_by_contributors_until(
+            contributors=[COTS_CONTRIBUTOR_ID],
+            until=until,
+            chunk_size=2,
+            on_chunk_deleted=lambda nb, duration: chunks.append(nb),
+        )
+
+        assert nb_deleted == 3
+        assert chunks == [2, 1]
+        assert RealTimeUpdate.query.count() == 0
+
+
+def test_purge_with_archive(mock_rabbitmq, monkeypatch, tmpdir):
+    monkeypatch.setitem(app.config, str("PURGE_ARCHIVE_PATH"), str(tmpdir))
+    with app.app_context():
+        circulation_date = date.today() - timedelta(days=DEFAULT_DAYS_TO_KEEP_RT_UPDATE + 1)
+        create_rt_update_and_trip_update(
+            "70866ce8-0638-4fa1-8556-1ddfa22d09d3",
+            COTS_CONTRIBUTOR_ID,
+            ConnectorType.cots.value,
+            VJ_ID,
+            TRIP_ID,
+            circulation_date,
+        )
+        trip_update = TripUpdate.query.first()
+        trip_update.stop_time_updates.append(
+            StopTimeUpdate({"id": "sa:1"}, departure_delay=timedelta(minutes=5), dep_status="update", order=0)
+        )
+        RealTimeUpdate.query.first().created_at = circulation_date
+        db.session.commit()
+
+        config = {"contributor": COTS_CONTRIBUTOR_ID, "nb_days_to_keep": DEFAULT_DAYS_TO_KEEP_RT_UPDATE}
+        purge_trip_update(config)
+        purge_rt_update(config)
+        assert TripUpdate.query.count() == 0
+        assert RealTimeUpdate.query.count() == 0
+
+    def read_archive(table_name):
+        path = tmpdir.join(
+            table_name, "day={}".format(circulation_date.isoformat()), "{}.ndjson.gz".format(COTS_CONTRIBUTOR_ID)
+        )
+        with gzip.open(str(path), "rb") as f:
+            return [json.loads(line.decode("utf-8")) for line in f]
+
+    trip_updates = read_archive("trip_update")
+    assert len(trip_updates) == 1
+    assert trip_updates[0]["vj_id"] == VJ_ID
+    assert trip_updates[0]["navitia_trip_id"] == TRIP_ID
+
+    stop_time_updates = read_archive("stop_time_update")
+    assert len(stop_time_updates) == 1
+    assert stop_time_updates[0]["trip_update_id"] == VJ_ID
+    assert stop_time_updates[0]["stop_id"] == "sa:1"
+    assert stop_time_updates[0]["departure_delay"] == 300
+
+    rt_updates = read_archive("real_time_update")
+    assert len(rt_updates) == 1
+    assert rt_updates[0]["id"] == "70866ce8-0638-4fa1-8556-1ddfa22d09d3"
+    assert "raw_data" not in rt_updates[0]
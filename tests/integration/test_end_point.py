@@ -31,6 +31,7 @@
 from __future__ import absolute_import, print_function, unicode_literals, division
 
 from kirin.core.types import ConnectorType
+from kirin.core.probes import get_contributors_probes
 from kirin.utils import make_rt_update, save_rt_data_with_error
 from tests.check_utils import api_get
 from kirin.core import model
@@ -68,6 +69,7 @@ def test_status(setup_database):
 
     assert "version" in resp
     assert "db_pool_status" in resp
+    assert "http_pool_status" in resp
     assert "db_version" in resp
     assert "navitia_url" in resp
     assert "last_update" in resp
@@ -87,6 +89,7 @@ def test_status(setup_database):
 
     assert "rabbitmq_info" in resp
     assert "password" not in resp["rabbitmq_info"]
+    assert "navitia" in resp["health_probes"]
 
 
 def test_status_from_db(setup_database):
@@ -116,6 +119,86 @@ def test_status_from_db(setup_database):
     assert "2015-11-04T08:17:00Z" in resp["last_update"][PIV_CONTRIBUTOR_ID]
 
 
+def test_status_probes_maintained_on_write(setup_database):
+    with app.app_context():
+        # probes summary is built from db once, then maintained on each RealTimeUpdate write
+        assert get_contributors_probes() == model.RealTimeUpdate.get_probes_by_contributor()
+
+        rtu = save_rt_data_with_error(
+            None,
+            connector_type=ConnectorType.cots.value,
+            contributor_id=COTS_CONTRIBUTOR_ID,
+            error="boom",
+            is_reprocess_same_data_allowed=False,
+        )
+        resp = api_get("/status")
+        assert resp["last_update_error"][COTS_CONTRIBUTOR_ID] == "boom"
+        assert "2015-11-04T07:32:00Z" in resp["last_valid_update"][COTS_CONTRIBUTOR_ID]
+
+        rtu.status = "OK"
+        model.db.session.commit()
+        resp = api_get("/status")
+        assert COTS_CONTRIBUTOR_ID not in resp["last_update_error"]
+        assert resp["last_valid_update"][COTS_CONTRIBUTOR_ID] == rtu.created_at.strftime("%Y-%m-%dT%H:%M:%SZ")
+        assert get_contributors_probes() == model.RealTimeUpdate.get_probes_by_contributor()
+
+
+def test_status_probes_older_state_ignored(setup_database):
+    """
+    the state of a RealTimeUpdate committed after a more recent one (concurrent commits) doesn't overwrite it
+    """
+    import datetime
+    from kirin.core.probes import _store_rtu_probes
+
+    def make_probe(rtu_id, created_at, status, error=None):
+        return {
+            "id": rtu_id,
+            "contributor_id": COTS_CONTRIBUTOR_ID,
+            "created_at": created_at,
+            "updated_at": None,
+            "status": status,
+            "error": error,
+        }
+
+    with app.app_context():
+        get_contributors_probes()  # probes summary built from db
+        recent_dt = datetime.datetime(2030, 1, 1, 12, 0)
+        _store_rtu_probes([make_probe("recent", recent_dt, "OK")])
+        _store_rtu_probes([make_probe("older", recent_dt - datetime.timedelta(minutes=5), "KO", "boom")])
+
+        probes = get_contributors_probes()
+        assert probes["last_update"][COTS_CONTRIBUTOR_ID] == "2030-01-01T12:00:00Z"
+        assert probes["last_valid_update"][COTS_CONTRIBUTOR_ID] == "2030-01-01T12:00:00Z"
+        assert COTS_CONTRIBUTOR_ID not in probes["last_update_error"]
+
+
+def test_status_probes_redis_errors(setup_database, monkeypatch):
+    from redis.exceptions import TimeoutError
+
+    def raise_redis_timeout(*args, **kwargs):
+        raise TimeoutError()
+
+    def raise_value_error(*args, **kwargs):
+        raise ValueError()
+
+    with app.app_context():
+        # an error with redis doesn't fail the (already committed) write
+        monkeypatch.setattr("kirin.core.probes._store_rtu_probes", raise_redis_timeout)
+        save_rt_data_with_error(
+            None,
+            connector_type=ConnectorType.cots.value,
+            contributor_id=COTS_CONTRIBUTOR_ID,
+            error="boom",
+            is_reprocess_same_data_allowed=False,
+        )
+
+        # probes are read from db if they can't be read from redis
+        monkeypatch.setattr("kirin.core.probes.get_contributors_probes", raise_value_error)
+        resp = api_get("/status")
+        assert resp["last_update_error"][COTS_CONTRIBUTOR_ID] == "boom"
+        assert "2015-11-04T07:52:00Z" in resp["last_update"][GTFS_CONTRIBUTOR_ID]
+
+
 def test_health_ok(setup_database):
     with requests_mock.mock() as m:
         # Connection to navitia and database works
@@ -125,6 +208,30 @@ def test_health_ok(setup_database):
         assert resp["message"] == "OK"
 
 
+def test_health_sampled(setup_database):
+    from kirin.health_sampler import HealthSampler
+
+    sampler = HealthSampler(interval=3600, history_size=2)
+    sampler.started = True  # no background sampling in tests, samples are only refreshed by sample()
+    with requests_mock.mock() as m:
+        kirin.app.config["NAVITIA_URL"] = "http://navitia"
+        m.head("http://navitia", status_code=200)
+        assert sampler.get_samples()["navitia"]["ok"]
+        assert sampler.get_samples()["database"]["ok"]
+
+        # last samples are used until next sampling
+        m.head("http://navitia", status_code=400)
+        assert sampler.get_samples()["navitia"]["ok"]
+        assert m.call_count == 1
+
+        sampler.sample()
+        sampler.sample()
+        assert not sampler.get_samples()["navitia"]["ok"]
+        history = sampler.get_history()["navitia"]
+        assert [sample["ok"] for sample in history] == [False, False]
+        assert all(sample["duration"] >= 0 for sample in history)
+
+
 def test_health_navitia_ko(setup_database):
     with requests_mock.mock() as m:
         # Connection to navitia fails
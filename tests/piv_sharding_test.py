@@ -0,0 +1,96 @@
+# coding=utf-8
+
+#  Copyright (c) 2001, Canal TP and/or its affiliates. All rights reserved.
+#
+# This file is part of Navitia,
+#     the software to build cool stuff with public transport.
+#
+# Hope you'll enjoy and contribute to this project,
+#     powered by Canal TP (www.canaltp.fr).
+# Help us simplify mobility and open public transport:
+#     a non ending quest to the responsive locomotion way of traveling!
+#
+# LICENCE: This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Stay tuned using
+# twitter @navitia
+# [matrix] channel #navitia:matrix.org (https://app.element.io/#/room/#navitia:matrix.org)
+# https://groups.google.com/d/forum/navitia
+# www.navitia.io
+
+
+from __future__ import absolute_import, print_function, unicode_literals, division
+import ujson
+
+from kirin.piv.sharding import (
+    get_shard,
+    get_train_key,
+    jump_consistent_hash,
+    get_shard_barrier,
+    SHARD_BARRIER_HEADER,
+)
+from kirin.utils import JsonInput, parse_json_input
+
+
+def test_get_train_key():
+    body = ujson.dumps(
+        {
+            "objects": [
+                {
+                    "object": {
+                        "dateCirculation": "2020-10-22",
+                        "numero": "23187",
+                        "operateur": {"codeOperateur": "1187"},
+                        "modeTransport": {"codeMode": "TRAIN", "codeSousMode": "TER", "typeMode": "FERRE"},
+                    }
+                }
+            ]
+        }
+    )
+    assert get_train_key(body) == "2020-10-22:23187:1187:TRAIN:TER:FERRE"
+    assert get_train_key("{}") is None
+    assert get_train_key("not a json") is None
+    # already parsed message: not parsed again
+    assert (
+        get_train_key(JsonInput("not parsed again", ujson.loads(body)))
+        == "2020-10-22:23187:1187:TRAIN:TER:FERRE"
+    )
+    assert get_train_key(parse_json_input("not a json")) is None
+
+
+def test_jump_consistent_hash():
+    keys = ["2020-10-22:{}:1187:TRAIN:TER:FERRE".format(i) for i in range(1000)]
+    shards = [jump_consistent_hash(k, 4) for k in keys]
+    assert set(shards) == {0, 1, 2, 3}
+    assert shards == [jump_consistent_hash(k, 4) for k in keys]  # stable
+
+    # adding a shard only moves trains to the new shard (about a fifth of them)
+    moved = [k for k, shard in zip(keys, shards) if jump_consistent_hash(k, 5) != shard]
+    assert all(jump_consistent_hash(k, 5) == 4 for k in moved)
+    assert 100 < len(moved) < 300
+
+
+def test_get_shard():
+    assert get_shard(None, 4) == 0
+    assert get_shard("2020-10-22:23187:1187:TRAIN:TER:FERRE", 1) == 0
+
+
+def test_get_shard_barrier():
+    class Message(object):
+        def __init__(self, headers):
+            self.headers = headers
+
+    assert get_shard_barrier(Message({SHARD_BARRIER_HEADER: "1234"})) == "1234"
+    assert get_shard_barrier(Message({})) is None
+    assert get_shard_barrier(Message(None)) is None